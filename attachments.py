@@ -0,0 +1,297 @@
+"""
+attachments.py
+
+This module receives the extra attachment of an approval (a scan, a signed form)
+with a bounded amount of memory per request, whatever the size of the file:
+
+    AttachmentSpool   - capped buffer for the decoded attachment; it stays in memory
+                        up to a threshold and is spilled to a temporary file beyond it
+    Base64Decoder     - incremental base64 decoder, so the legacy JSON field
+                        ``file_data`` is decoded slice by slice into a spool instead of
+                        into one more full copy of the file
+    MultipartApproval - incremental multipart/form-data parser for
+                        ``/approve_letters/upload``: the approval JSON arrives in a
+                        ``details`` part and the attachment in a ``file`` part, which
+                        is written to a spool as the request body streams in
+
+Anything over the size cap is rejected as soon as the cap is crossed, without
+reading or decoding the rest.
+
+Classes:
+    AttachmentError: Unusable attachment or multipart body (HTTP 400).
+    AttachmentTooLarge: Attachment over the size cap (HTTP 413).
+    AttachmentSpool: Size-capped spooled buffer that also hashes what it holds.
+    Base64Decoder: Base64 decoder fed in pieces of any size.
+    MultipartApproval: Streaming parser of a multipart approval.
+
+Dependencies:
+    - python-multipart
+
+Configuration (config.json, optional):
+    attachment_max_mb           Largest extra attachment accepted (default: 25)
+    attachment_spool_memory_mb  Attachment size kept in memory before spilling to disk (default: 1)
+"""
+import binascii
+import hashlib
+import json
+import tempfile
+
+from python_multipart.multipart import MultipartParser, parse_options_header
+
+
+DEFAULT_MAX_BYTES = 25 * 1024 * 1024
+DEFAULT_SPOOL_MEMORY_BYTES = 1024 * 1024
+# The details part carries the approval JSON, notes included
+MAX_DETAILS_BYTES = 16 * 1024 * 1024
+# Base64 text decoded per step (a multiple of 4)
+DECODE_CHUNK_CHARS = 256 * 1024
+
+_BASE64_ALPHABET = b"ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/="
+# Like base64.b64decode, characters outside the alphabet (line breaks, spaces) are discarded
+_NOT_BASE64 = bytes(byte for byte in range(256) if byte not in _BASE64_ALPHABET)
+
+
+class AttachmentError(Exception):
+    """Raised for an attachment or multipart body that cannot be used."""
+    status_code = 400
+
+
+class AttachmentTooLarge(AttachmentError):
+    """Raised as soon as an attachment grows past the size cap."""
+    status_code = 413
+
+
+class AttachmentSpool(object):
+    """
+    Decoded attachment bytes, in memory up to ``memory_bytes`` and in a temporary file
+    beyond that, with a hard cap on the total size.
+    """
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, memory_bytes=DEFAULT_SPOOL_MEMORY_BYTES):
+        """
+        Args:
+            max_bytes (int): Largest attachment accepted
+            memory_bytes (int): Size kept in memory before spilling to disk
+        """
+        self.max_bytes = max_bytes
+        self.memory_bytes = memory_bytes
+        self.size = 0
+        self._file = tempfile.SpooledTemporaryFile(max_size=memory_bytes)
+        self._sha256 = hashlib.sha256()
+
+    @property
+    def on_disk(self):
+        """True once the spool spilled to a temporary file (writes then do disk I/O)."""
+        return self.size > self.memory_bytes
+
+    def write(self, data):
+        """
+        Raises:
+            AttachmentTooLarge: If the attachment would exceed max_bytes
+        """
+        if self.size + len(data) > self.max_bytes:
+            raise AttachmentTooLarge(f"Attachment exceeds the limit of {self.max_bytes / (1024 * 1024):.1f} MB")
+        self.size += len(data)
+        self._sha256.update(data)
+        self._file.write(data)
+
+    def hexdigest(self):
+        """SHA-256 of the bytes written so far."""
+        return self._sha256.hexdigest()
+
+    def getvalue(self):
+        """Return the whole attachment as bytes."""
+        self._file.seek(0)
+        return self._file.read()
+
+    def close(self):
+        self._file.close()
+
+
+class Base64Decoder(object):
+    """
+    Decodes base64 text fed in pieces of any size. Characters outside the base64
+    alphabet are ignored, like ``base64.b64decode`` does without ``validate``.
+    """
+    def __init__(self):
+        self._pending = b""
+
+    def decode(self, text):
+        """
+        Args:
+            text (str | bytes): Next piece of the base64 text
+
+        Returns:
+            bytes: Everything that can be decoded so far
+        """
+        if isinstance(text, str):
+            text = text.encode('ascii', 'ignore')
+        data = self._pending + text.translate(None, _NOT_BASE64)
+        usable = len(data) - len(data) % 4
+        self._pending = data[usable:]
+        return binascii.a2b_base64(data[:usable]) if usable else b""
+
+    def finish(self):
+        """
+        Raises:
+            binascii.Error: If the text ended in the middle of a base64 quantum
+        """
+        if self._pending:
+            raise binascii.Error("Incorrect padding")
+        return b""
+
+
+def decode_base64_to_spool(text, spool, chunk_chars=DECODE_CHUNK_CHARS):
+    """
+    Decode base64 text into a spool one slice at a time.
+
+    Args:
+        text (str): Base64 encoded file content
+        spool (AttachmentSpool): Destination; its cap applies while decoding
+
+    Raises:
+        AttachmentTooLarge: As soon as the decoded size passes the spool's cap
+        binascii.Error: If the text is not valid base64
+    """
+    decoder = Base64Decoder()
+    for start in range(0, len(text), chunk_chars):
+        spool.write(decoder.decode(text[start:start + chunk_chars]))
+    decoder.finish()
+    return spool
+
+
+class MultipartApproval(object):
+    """
+    Incremental parser of a multipart/form-data approval.
+
+    Expected parts:
+        details  The /approve_letters JSON (file_data may be omitted)
+        file     Optional extra attachment; its filename and Content-Type stand in
+                 for file_name and mime_type when the details do not set them
+    Other parts are read and ignored.
+    """
+    def __init__(self, content_type, max_bytes=DEFAULT_MAX_BYTES, memory_bytes=DEFAULT_SPOOL_MEMORY_BYTES):
+        """
+        Args:
+            content_type (str): Content-Type header of the request
+            max_bytes (int): Largest attachment accepted
+            memory_bytes (int): Attachment size kept in memory before spilling to disk
+
+        Raises:
+            AttachmentError: If the request is not multipart/form-data with a boundary
+        """
+        media_type, options = parse_options_header(content_type)
+        if media_type != b"multipart/form-data" or not options.get(b"boundary"):
+            raise AttachmentError("Expected a multipart/form-data body with a boundary")
+
+        self.max_bytes = max_bytes
+        self.memory_bytes = memory_bytes
+        self.attachment = None
+        self.filename = None
+        self.content_type = None
+        self._details = None
+        self._field = None
+        self._headers = {}
+        self._header_name = b""
+        self._header_value = b""
+        self._part_name = None
+        self._finished = False
+        self._parser = MultipartParser(options[b"boundary"], {
+            "on_part_begin": self._on_part_begin,
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end,
+            "on_end": self._on_end
+        })
+
+    @property
+    def on_disk(self):
+        """True once the attachment spilled to disk, so further writes do disk I/O."""
+        return self.attachment is not None and self.attachment.on_disk
+
+    def _on_part_begin(self):
+        self._headers = {}
+        self._field = None
+        self._part_name = None
+
+    def _on_header_field(self, data, start, end):
+        self._header_name += data[start:end]
+
+    def _on_header_value(self, data, start, end):
+        self._header_value += data[start:end]
+
+    def _on_header_end(self):
+        self._headers[self._header_name.lower()] = self._header_value
+        self._header_name = b""
+        self._header_value = b""
+
+    def _on_headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b"content-disposition"))
+        self._part_name = options.get(b"name", b"").decode('utf-8', 'replace')
+        if self._part_name == "file":
+            if self.attachment is not None:
+                raise AttachmentError("Only one file part is accepted")
+            self.attachment = AttachmentSpool(self.max_bytes, self.memory_bytes)
+            self.filename = options.get(b"filename", b"").decode('utf-8', 'replace') or None
+            content_type = self._headers.get(b"content-type")
+            self.content_type = content_type.decode('latin-1').split(';')[0].strip() if content_type else None
+        else:
+            self._field = bytearray()
+
+    def _on_part_data(self, data, start, end):
+        if self._field is None:
+            self.attachment.write(data[start:end])
+            return
+        if len(self._field) + end - start > MAX_DETAILS_BYTES:
+            raise AttachmentTooLarge(f"Part '{self._part_name}' exceeds {MAX_DETAILS_BYTES / (1024 * 1024):.1f} MB")
+        self._field += data[start:end]
+
+    def _on_part_end(self):
+        if self._part_name == "details":
+            self._details = bytes(self._field)
+        self._field = None
+
+    def _on_end(self):
+        self._finished = True
+
+    def write(self, chunk):
+        """
+        Feed the next chunk of the request body.
+
+        Raises:
+            AttachmentError: If the body is malformed
+            AttachmentTooLarge: As soon as the attachment or the details pass their cap
+        """
+        try:
+            self._parser.write(chunk)
+        except AttachmentError:
+            raise
+        except Exception as e:
+            raise AttachmentError(f"Malformed multipart body: {str(e)}")
+
+    def finish(self):
+        """
+        Returns:
+            dict: The approval fields from the details part
+
+        Raises:
+            AttachmentError: If the body ended early or has no usable details part
+        """
+        self._parser.finalize()
+        if not self._finished:
+            raise AttachmentError("Multipart body ended before its closing boundary")
+        if self._details is None:
+            raise AttachmentError("Multipart body has no 'details' part")
+        try:
+            details = json.loads(self._details)
+        except ValueError as e:
+            raise AttachmentError(f"The 'details' part is not valid JSON: {str(e)}")
+        if not isinstance(details, dict):
+            raise AttachmentError("The 'details' part must be a JSON object")
+        return details
+
+    def close(self):
+        if self.attachment is not None:
+            self.attachment.close()
@@ -0,0 +1,96 @@
+"""
+bench_attachments.py
+
+Peak memory and time spent receiving the extra attachment of an approval.
+
+For each attachment size, three ways of getting from the request to the file bytes:
+    b64decode  - base64.b64decode of the whole file_data string (the old JSON path)
+    spool      - decode_base64_to_spool: file_data decoded slice by slice into an
+                 AttachmentSpool that spills to disk (the JSON path now)
+    multipart  - MultipartApproval fed the multipart body in 64 KiB chunks, as
+                 /approve_letters/upload receives it
+
+Memory is the peak of Python allocations (tracemalloc) above what the input itself
+takes, i.e. what receiving the attachment adds on top of the request body.
+
+Usage:
+    python benchmarks/bench_attachments.py [--sizes-mb 1 5 20] [--spool-memory-mb 1]
+"""
+import argparse
+import base64
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from attachments import AttachmentSpool, MultipartApproval, decode_base64_to_spool
+
+BOUNDARY = "bench-boundary"
+CHUNK_BYTES = 64 * 1024
+
+
+def multipart_body(data):
+    return (f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="details"\r\n'
+            f'Content-Type: application/json\r\n\r\n{{"request_id": "bench"}}\r\n'
+            f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="file"; filename="scan.pdf"\r\n'
+            f'Content-Type: application/pdf\r\n\r\n').encode() + data + f'\r\n--{BOUNDARY}--\r\n'.encode()
+
+
+def measure(label, size, run):
+    tracemalloc.reset_peak()
+    baseline = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+    result = run()
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1] - baseline
+    print(f"{label:<10} {size / (1024 * 1024):6.0f} MiB  peak +{peak / (1024 * 1024):7.1f} MiB  {elapsed * 1000:8.1f} ms")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes-mb", type=float, nargs="+", default=[1, 5, 20])
+    parser.add_argument("--spool-memory-mb", type=float, default=1)
+    args = parser.parse_args()
+    spool_memory = int(args.spool_memory_mb * 1024 * 1024)
+
+    tracemalloc.start()
+    for size_mb in args.sizes_mb:
+        data = os.urandom(int(size_mb * 1024 * 1024))
+        size = len(data)
+        max_bytes = size + 1
+
+        text = base64.encodebytes(data).decode('ascii')
+        decoded = measure("b64decode", size, lambda: base64.b64decode(text))
+        assert decoded == data
+        del decoded
+
+        def spool_decode():
+            spool = AttachmentSpool(max_bytes, spool_memory)
+            try:
+                return decode_base64_to_spool(text, spool).hexdigest()
+            finally:
+                spool.close()
+        measure("spool", size, spool_decode)
+        del text
+
+        body = multipart_body(data)
+
+        def parse_multipart():
+            upload = MultipartApproval(f"multipart/form-data; boundary={BOUNDARY}", max_bytes, spool_memory)
+            try:
+                for start in range(0, len(body), CHUNK_BYTES):
+                    upload.write(body[start:start + CHUNK_BYTES])
+                upload.finish()
+                return upload.attachment.size
+            finally:
+                upload.close()
+        assert measure("multipart", size, parse_multipart) == size
+        del body
+        print()
+
+
+if __name__ == "__main__":
+    main()
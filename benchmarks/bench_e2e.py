@@ -0,0 +1,463 @@
+"""
+bench_e2e.py
+
+End-to-end benchmark of the service over HTTP, with every external dependency
+replaced by a local stand-in so the numbers only depend on this code and machine:
+
+    SMTP            aiosmtpd server accepting any LOGIN (bench_smtp_pool.py)
+    Object Storage  FakeOCIServer (fake_oci_server.py), used by the real OCI SDK
+    image host      HTTP server adding --image-latency to every image (bench_image_fetch.py)
+
+The app runs under uvicorn in a child process, from a scratch directory holding a
+generated config.json and copies of the templates and signatories. Two phases run
+at --concurrency, each with --requests requests:
+
+    approve   - POST /approve_letters, one request_id per request; every letter has
+                its own notes (so no render cache hits) with --images inline images
+    retrieve  - POST /get_pdf_by_id for the approved letters, once their uploads are done
+
+For each endpoint the client side reports req/s and p50/p95/p99 latency. For each
+stage (render, fill_template, oci_put, smtp_send, ...) the percentiles come from the
+``letters_stage_seconds`` histogram buckets, scraped from /metrics before and after
+the phase, so they are bucket estimates. CPU seconds and peak RSS are read from
+/proc for the server process and its render workers (Linux only).
+
+The results are written as JSON; pass an earlier result with --baseline to print
+the change of every number, e.g. between two commits.
+
+Requires: aiosmtpd, wkhtmltopdf (as for the service itself)
+
+Usage:
+    python benchmarks/bench_e2e.py [--requests 200] [--concurrency 8] [--images 2]
+                                   [--image-latency 0.05] [--oci-latency 0.01]
+                                   [--output bench_e2e.json] [--baseline old.json]
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer
+
+import requests
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.abspath(os.path.join(BENCH_DIR, '..'))
+sys.path.insert(0, BENCH_DIR)
+
+from bench_image_fetch import SlowImageHandler
+from bench_smtp_pool import CountingAuthenticator, CountingController, CountingHandler, free_port
+from fake_oci_server import FakeOCIServer
+
+# Files the app reads from its working directory
+APP_FILES = ("template.txt", "email_template.txt", "signatories.json", "sign.jpg")
+STAGE_BUCKET = re.compile(r'^letters_stage_seconds_bucket\{stage="([^"]+)",le="([^"]+)"\} (\d+)$')
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def write_app_dir(workdir, smtp_port, oci_url, args):
+    """Copy the app's files into workdir and write a config.json pointing at the stand-ins."""
+    for name in APP_FILES:
+        shutil.copy(os.path.join(ROOT, name), workdir)
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    with open(os.path.join(workdir, "bench_key.pem"), 'wb') as key_file:
+        key_file.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.TraditionalOpenSSL,
+                                         serialization.NoEncryption()))
+
+    config = {
+        "smtp_server": "127.0.0.1",
+        "smtp_port": smtp_port,
+        "smtp_starttls": False,
+        "smtp_username": "bench",
+        "smtp_password": "bench",
+        "sender_email": "noreply@example.com",
+        "oci_user_ocid": "ocid1.user.oc1..bench",
+        "oci_fingerprint": ":".join(["aa"] * 16),
+        "oci_tenancy_ocid": "ocid1.tenancy.oc1..bench",
+        "oci_region": "us-ashburn-1",
+        "oci_private_key_path": "bench_key.pem",
+        "oci_service_endpoint": oci_url,
+        "oci_namespace": "bench",
+        "oci_bucket_name": "letters",
+        "oci_folder_name": "approved",
+        "render_workers": args.render_workers
+    }
+    if args.no_pdf_cache:
+        # Every retrieval goes to Object Storage instead of the local PDF cache
+        config["pdf_cache_max_object_mb"] = 0
+    config.update(json.loads(args.config))
+    with open(os.path.join(workdir, "config.json"), 'w') as config_file:
+        json.dump({key: value for key, value in config.items() if value is not None}, config_file, indent=2)
+
+
+def approval_payload(index, image_urls, run_id):
+    request_id = f"BENCH-{run_id}-{index}"
+    images = "".join(f'<p><img src="{url}" width="120"></p>' for url in image_urls)
+    return {
+        "employee_name": f"Employee {index}",
+        "designation": "Engineer",
+        "receiver_email": f"receiver{index}@example.com",
+        "sender_email": "sender@example.com",
+        "cc_emails": [],
+        "request_id": request_id,
+        "request_type": "Service Letter",
+        "department": "Engineering",
+        "approval_type": "Final",
+        "transaction_status": "Approved",
+        "book_language": "English",
+        "transaction_creator": "Bench Creator",
+        "sender": "Bench Sender",
+        "receiver": f"Receiver {index}",
+        "transaction_date": "2025-01-01",
+        "transaction_type": "service_letter",
+        "confidentiality": "Internal",
+        "subject": f"Service letter {index}",
+        "file_name": "",
+        "mime_type": "",
+        "file_data": "",
+        "transaction_creator_email": "creator@example.com",
+        "notes_on_request": f"<p>This is to certify that employee {index} ({request_id}) works with us.</p>{images}"
+    }
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def summarize(latencies, elapsed, errors):
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "rps": round(len(latencies) / elapsed, 2) if elapsed else None,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2) if latencies else None,
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2) if latencies else None,
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2) if latencies else None
+    }
+
+
+def drive(base_url, path, payloads, concurrency, check):
+    """POST every payload to path from concurrency threads; returns (summary, results)."""
+    local = threading.local()
+
+    def post(payload):
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        started = time.perf_counter()
+        try:
+            response = session.post(base_url + path, json=payload, timeout=120)
+            body = response.content
+        except requests.RequestException as e:
+            return None, str(e)
+        elapsed = time.perf_counter() - started
+        error = check(response)
+        return elapsed, error or (response, body)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        outcomes = list(executor.map(post, payloads))
+    elapsed = time.perf_counter() - started
+
+    latencies = [latency for latency, result in outcomes if latency is not None and not isinstance(result, str)]
+    failures = [result for _, result in outcomes if isinstance(result, str)]
+    for failure in failures[:3]:
+        print(f"  {path} failed: {failure}")
+    results = [result for _, result in outcomes if not isinstance(result, str)]
+    return summarize(latencies, elapsed, len(failures)), results
+
+
+def scrape_stage_buckets(base_url):
+    """Return {stage: [(upper bound, cumulative count), ...]} from /metrics."""
+    text = requests.get(base_url + "/metrics", timeout=10).text
+    stages = {}
+    for line in text.splitlines():
+        match = STAGE_BUCKET.match(line)
+        if match:
+            stage, bound, count = match.groups()
+            stages.setdefault(stage, []).append((float(bound), int(count)))
+    return stages
+
+
+def stage_percentiles(before, after):
+    """Per-stage count and p50/p95/p99 (bucket upper bounds, interpolated) of the observations between two scrapes."""
+    summary = {}
+    for stage, buckets in sorted(after.items()):
+        previous = dict(before.get(stage, []))
+        delta = [(bound, count - previous.get(bound, 0)) for bound, count in buckets]
+        total = delta[-1][1] if delta else 0
+        if not total:
+            continue
+        result = {"count": total}
+        for label, fraction in (("p50_ms", 0.50), ("p95_ms", 0.95), ("p99_ms", 0.99)):
+            rank = fraction * total
+            lower_bound, lower_count = 0.0, 0
+            for bound, count in delta:
+                if count >= rank:
+                    if bound == float("inf"):
+                        value = lower_bound  # above the largest bucket; report its bound
+                    else:
+                        share = (rank - lower_count) / (count - lower_count) if count > lower_count else 1.0
+                        value = lower_bound + (bound - lower_bound) * share
+                    result[label] = round(value * 1000, 2)
+                    break
+                lower_bound, lower_count = bound, count
+        summary[stage] = result
+    return summary
+
+
+class ProcessSampler(object):
+    """
+    CPU time and peak RSS of a process and its descendants, sampled from /proc.
+    """
+    def __init__(self, pid, interval=0.1):
+        self.pid = pid
+        self.interval = interval
+        self.peak_rss = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _tree(self):
+        children = {}
+        for entry in os.listdir("/proc"):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f"/proc/{entry}/stat") as stat_file:
+                    fields = stat_file.read().rsplit(")", 1)[1].split()
+            except OSError:
+                continue
+            children.setdefault(int(fields[1]), []).append(int(entry))
+        pids, pending = [], [self.pid]
+        while pending:
+            pid = pending.pop()
+            pids.append(pid)
+            pending.extend(children.get(pid, ()))
+        return pids
+
+    def cpu_seconds(self):
+        """utime + stime of the tree, plus that of its exited and waited-for children."""
+        ticks = 0
+        for pid in self._tree():
+            try:
+                with open(f"/proc/{pid}/stat") as stat_file:
+                    fields = stat_file.read().rsplit(")", 1)[1].split()
+            except OSError:
+                continue
+            ticks += sum(int(value) for value in fields[11:15])
+        return ticks / CLOCK_TICKS
+
+    def rss_bytes(self):
+        total = 0
+        for pid in self._tree():
+            try:
+                with open(f"/proc/{pid}/statm") as statm_file:
+                    total += int(statm_file.read().split()[1]) * PAGE_SIZE
+            except OSError:
+                continue
+        return total
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak_rss = max(self.peak_rss, self.rss_bytes())
+
+    def start(self):
+        self.peak_rss = self.rss_bytes()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.peak_rss
+
+
+def run_phase(name, base_url, path, payloads, concurrency, check, sampler):
+    metrics_before = scrape_stage_buckets(base_url)
+    cpu_before = sampler.cpu_seconds()
+    sampler.start()
+    summary, results = drive(base_url, path, payloads, concurrency, check)
+    peak_rss = sampler.stop()
+    summary["cpu_seconds"] = round(sampler.cpu_seconds() - cpu_before, 2)
+    summary["peak_rss_mb"] = round(peak_rss / (1024 * 1024), 1)
+    summary["stages"] = stage_percentiles(metrics_before, scrape_stage_buckets(base_url))
+    print(f"{name:<9} {summary['requests']} requests, {summary['errors']} errors, {summary['rps']} req/s, "
+          f"p50 {summary['p50_ms']} ms, p95 {summary['p95_ms']} ms, p99 {summary['p99_ms']} ms, "
+          f"cpu {summary['cpu_seconds']} s, peak rss {summary['peak_rss_mb']} MiB")
+    for stage, stats in summary["stages"].items():
+        print(f"    {stage:<16} n={stats['count']:<6} p50 {stats.get('p50_ms')} ms, "
+              f"p95 {stats.get('p95_ms')} ms, p99 {stats.get('p99_ms')} ms")
+    return summary, results
+
+
+def wait_for_jobs(base_url, job_ids, timeout):
+    """Poll /jobs until every job completed; returns (completed, failed, seconds)."""
+    started = time.perf_counter()
+    pending, failed = set(job_ids), set()
+    with requests.Session() as session:
+        while pending and time.perf_counter() - started < timeout:
+            for job_id in list(pending):
+                status = session.get(f"{base_url}/jobs/{job_id}", timeout=10).json().get("status")
+                if status in ("completed", "failed"):
+                    pending.discard(job_id)
+                    if status == "failed":
+                        failed.add(job_id)
+            if pending:
+                time.sleep(0.2)
+    return len(job_ids) - len(pending) - len(failed), len(failed), time.perf_counter() - started
+
+
+def start_app(workdir, port):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get("PYTHONPATH")])))
+    log = open(os.path.join(workdir, "app.log"), 'w')
+    process = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1",
+                                "--port", str(port), "--log-level", "warning"],
+                               cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if process.poll() is not None:
+            break
+        try:
+            if requests.get(base_url + "/health/ready", timeout=2).status_code == 200:
+                return process, base_url
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    process.kill()
+    with open(os.path.join(workdir, "app.log")) as log_file:
+        sys.exit(f"The app did not become ready:\n{log_file.read()[-4000:]}")
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(results, baseline):
+    """Print every numeric result next to the baseline's value and the relative change."""
+    def flatten(value, prefix=""):
+        if isinstance(value, dict):
+            for key, item in value.items():
+                yield from flatten(item, f"{prefix}.{key}" if prefix else key)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield prefix, value
+
+    old = dict(flatten(baseline.get("results", {})))
+    print(f"\nchange against {baseline.get('commit')} ({baseline.get('timestamp')}):")
+    for key, value in flatten(results):
+        if key in old and old[key]:
+            print(f"    {key:<48} {old[key]:>10} -> {value:>10} ({(value - old[key]) / old[key] * 100:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200, help="requests per phase")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--images", type=int, default=2, help="inline images per letter")
+    parser.add_argument("--image-latency", type=float, default=0.05, help="seconds added to every image response")
+    parser.add_argument("--oci-latency", type=float, default=0.01, help="seconds added to every Object Storage request")
+    parser.add_argument("--render-workers", type=int, default=None, help="render pool size (default: the app's)")
+    parser.add_argument("--no-pdf-cache", action="store_true", help="serve every retrieval from Object Storage")
+    parser.add_argument("--config", default="{}", help="JSON object of extra config.json keys")
+    parser.add_argument("--job-timeout", type=float, default=300, help="seconds to wait for deliveries")
+    parser.add_argument("--output", default="bench_e2e.json")
+    parser.add_argument("--baseline", help="earlier --output file to compare with")
+    args = parser.parse_args()
+
+    # aiosmtpd logs a deprecation notice about its own internals on every AUTH
+    logging.getLogger("mail.log").setLevel(logging.ERROR)
+    smtp_handler = CountingHandler()
+    smtp_port = free_port()
+    smtp = CountingController(smtp_handler, CountingAuthenticator(), hostname="127.0.0.1", port=smtp_port)
+    smtp.start()
+    oci = FakeOCIServer(latency=args.oci_latency).start()
+    SlowImageHandler.latency = args.image_latency
+    image_host = ThreadingHTTPServer(('127.0.0.1', 0), SlowImageHandler)
+    image_host.daemon_threads = True
+    threading.Thread(target=image_host.serve_forever, daemon=True).start()
+    image_urls = [f"http://127.0.0.1:{image_host.server_port}/image-{index}.png" for index in range(args.images)]
+
+    workdir = tempfile.mkdtemp(prefix="bench_e2e_")
+    process = None
+    try:
+        write_app_dir(workdir, smtp_port, oci.url, args)
+        process, base_url = start_app(workdir, free_port())
+        sampler = ProcessSampler(process.pid)
+        run_id = uuid.uuid4().hex[:8]
+
+        def accepted(response):
+            return None if response.status_code == 202 else f"HTTP {response.status_code}: {response.text[:200]}"
+
+        def served_pdf(response):
+            if response.status_code != 200:
+                return f"HTTP {response.status_code}: {response.text[:200]}"
+            return None if response.content.startswith(b"%PDF") else "response is not a PDF"
+
+        payloads = [approval_payload(index, image_urls, run_id) for index in range(args.requests)]
+        approve, approved = run_phase("approve", base_url, "/approve_letters", payloads, args.concurrency,
+                                      accepted, sampler)
+
+        job_ids = [response.json()["job_id"] for response, _ in approved]
+        completed, failed, delivery_seconds = wait_for_jobs(base_url, job_ids, args.job_timeout)
+        print(f"delivery  {completed} jobs completed, {failed} failed, {delivery_seconds:.1f} s after the approve phase")
+
+        request_ids = [payloads[index]["request_id"] for index in range(args.requests)]
+        retrieve, _ = run_phase("retrieve", base_url, "/get_pdf_by_id",
+                                [{"id": request_id} for request_id in request_ids],
+                                args.concurrency, served_pdf, sampler)
+
+        results = {
+            "approve": approve,
+            "delivery": {"completed": completed, "failed": failed, "seconds": round(delivery_seconds, 2)},
+            "retrieve": retrieve,
+            "smtp_messages": smtp_handler.messages,
+            "oci_requests": dict(oci.store.requests)
+        }
+    finally:
+        if process is not None:
+            process.terminate()
+            try:
+                process.wait(timeout=20)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        smtp.stop()
+        oci.stop()
+        image_host.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        "params": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+        "results": results
+    }
+    with open(args.output, 'w') as output_file:
+        json.dump(report, output_file, indent=2)
+    print(f"\nresults written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            compare(results, json.load(baseline_file))
+
+
+if __name__ == "__main__":
+    main()
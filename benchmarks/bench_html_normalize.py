@@ -0,0 +1,108 @@
+"""
+bench_html_normalize.py
+
+Time to prepare notes_on_request for the letter template, from 1 KB to 5 MB of notes.
+
+    chained  - the previous pipeline: three regex passes to remove <p>/</p> tags and
+               collapse whitespace, a lowercase copy to look for <img, one regex
+               pass to find image URLs and one more to substitute the data URIs
+    single   - normalize_html (one tokenizer pass) + NormalizedHTML.render
+
+Notes are built from paragraphs with inline markup, images (two thirds of them
+http(s) URLs) and some malformed HTML (stray '<', unclosed tags and quotes). Both
+pipelines must produce the same HTML. Time per byte is reported per size: it stays
+flat when the work grows linearly with the input.
+
+Usage:
+    python benchmarks/bench_html_normalize.py [--sizes-kb 1 10 100 1000 5000] [--rounds 5]
+"""
+import argparse
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from html_normalize import normalize_html
+
+IMG_TAG_PATTERN = re.compile(r'<img\s+([^>]*?)src=["\']([^"\'>]+)["\']([^>]*?)>', re.IGNORECASE)
+
+PARAGRAPHS = (
+    '<p style="text-align: right;">  يرجى   التكرم بالموافقة على الطلب\n</p>',
+    '<p>Please <b>approve</b> the request of <i>{index}</i>   as discussed.</p>\n',
+    '<p><img src="https://images.example.com/logo-{image}.png" width="120" alt="logo"></p>',
+    "<p class='note'>Attached scan:<br><img alt='scan' src='http://cdn.example.com/scan-{image}.jpg'></p>",
+    '<p><img src="data:image/png;base64,iVBORw0KGgo=" width="1"></p>',
+    '<p>Budget 3 < 5 and a stray <  bracket, an <unclosed tag and a "quote</p>\n\n',
+    '<div><ul>\t<li>item one</li>  <li>item two</li></ul></div>',
+)
+
+
+def build_notes(size):
+    parts, length, index = [], 0, 0
+    while length < size:
+        paragraph = PARAGRAPHS[index % len(PARAGRAPHS)].format(index=index, image=index % 50)
+        parts.append(paragraph)
+        length += len(paragraph)
+        index += 1
+    return "".join(parts)
+
+
+def chained(notes, data_uris):
+    content = re.sub(r'<p\b[^>]*>', '', notes, flags=re.IGNORECASE)
+    content = re.sub(r'</p>', '', content, flags=re.IGNORECASE)
+    content = re.sub(r'\s+', ' ', content).strip()
+    if '<img' not in content.lower():
+        return content
+    urls = [match.group(2) for match in IMG_TAG_PATTERN.finditer(content)
+            if match.group(2).startswith('http://') or match.group(2).startswith('https://')]
+
+    def replace_image(match):
+        data_uri = data_uris.get(match.group(2)) if urls else None
+        if data_uri:
+            return f'<img {match.group(1)}src="{data_uri}"{match.group(3)}>'
+        return match.group(0)
+    return IMG_TAG_PATTERN.sub(replace_image, content)
+
+
+def single(notes, data_uris):
+    return normalize_html(notes).render(data_uris)
+
+
+def best_of(rounds, run, *args):
+    timings = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        result = run(*args)
+        timings.append(time.perf_counter() - started)
+    return min(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes-kb", type=float, nargs="+", default=[1, 10, 100, 1000, 5000])
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    # Stand-ins for downloaded images; one URL in five failed and keeps its src
+    data_uris = {}
+    for image in range(50):
+        if image % 5:
+            data_uris[f"https://images.example.com/logo-{image}.png"] = f"data:image/png;base64,{'A' * 64}"
+            data_uris[f"http://cdn.example.com/scan-{image}.jpg"] = f"data:image/jpeg;base64,{'B' * 64}"
+
+    print(f"{'notes':>10} {'chained':>12} {'single':>12} {'ns/byte':>16} {'speedup':>8}")
+    for size_kb in args.sizes_kb:
+        notes = build_notes(int(size_kb * 1024))
+        chained_time, chained_html = best_of(args.rounds, chained, notes, data_uris)
+        single_time, single_html = best_of(args.rounds, single, notes, data_uris)
+        if chained_html != single_html:
+            sys.exit(f"Outputs differ for {size_kb} KB of notes")
+        per_byte = f"{chained_time / len(notes) * 1e9:.1f} / {single_time / len(notes) * 1e9:.1f}"
+        print(f"{len(notes) / 1024:8.0f}KB {chained_time * 1000:10.2f}ms {single_time * 1000:10.2f}ms "
+              f"{per_byte:>16} {chained_time / single_time:7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+bench_image_fetch.py
+
+Benchmark for inlining the images of one note, against a local HTTP server that
+adds artificial latency to every response.
+
+    serial      - one throwaway requests.get per image, one after another (the old path)
+    concurrent  - ImageFetcher.fetch_all through a pooled keep-alive session
+
+Each run uses distinct image URLs and an empty cache directory, so the numbers
+measure downloads and not cache hits.
+
+Usage:
+    python benchmarks/bench_image_fetch.py [--images 10] [--latency 0.1] [--rounds 5]
+"""
+import argparse
+import base64
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import requests
+
+from image_cache import ImageCache
+from image_fetch import ImageFetcher
+
+
+IMAGE_BYTES = b'\x89PNG\r\n\x1a\n' + os.urandom(30 * 1024)
+
+
+class SlowImageHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    latency = 0.1
+    connections = set()
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        SlowImageHandler.connections.add(self.client_address)
+        time.sleep(self.latency)
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/png')
+        self.send_header('Content-Length', str(len(IMAGE_BYTES)))
+        self.end_headers()
+        self.wfile.write(IMAGE_BYTES)
+
+
+def serial(urls):
+    results = {}
+    for url in urls:
+        response = requests.get(url, timeout=20, headers={'User-Agent': 'Mozilla/5.0'})
+        response.raise_for_status()
+        results[url] = f"data:image/png;base64,{base64.b64encode(response.content).decode('utf-8')}"
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", type=int, default=10, help="images per note")
+    parser.add_argument("--latency", type=float, default=0.1, help="seconds added to every response")
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    SlowImageHandler.latency = args.latency
+    server = ThreadingHTTPServer(('127.0.0.1', 0), SlowImageHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        fetcher = ImageFetcher(ImageCache(cache_dir), workers=8, per_host=8)
+        for label, run in (("serial", serial), ("concurrent", fetcher.fetch_all)):
+            SlowImageHandler.connections = set()
+            timings = []
+            for round_index in range(args.rounds):
+                urls = [f"{base_url}/{label}/{round_index}/{i}.png" for i in range(args.images)]
+                started = time.perf_counter()
+                results = run(urls)
+                timings.append(time.perf_counter() - started)
+                assert all(results.values()), "some images failed"
+            print(f"{label:<11} {args.images} images @ {args.latency * 1000:.0f} ms latency: "
+                  f"avg {sum(timings) / len(timings) * 1000:8.1f} ms per note, "
+                  f"{len(SlowImageHandler.connections)} TCP connections over {args.rounds} notes")
+        fetcher.close()
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
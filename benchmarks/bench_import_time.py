@@ -0,0 +1,81 @@
+"""
+bench_import_time.py
+
+Import-time budget check for the service module.
+
+Runs ``import main`` in fresh interpreters, from an empty working directory with no
+config.json, so the import can only succeed if it reads no config, fetches no vault
+secrets and creates no OCI client. Reports the median and worst wall time, the
+slowest modules according to ``python -X importtime``, and exits with status 1 when
+the median exceeds the budget (or the import fails), so it can gate a CI job.
+
+Usage:
+    python benchmarks/bench_import_time.py [--runs 5] [--budget-ms 1500] [--top 10]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+# Fails if the import did any of the deferred startup work
+PROBE = "import main; assert main.config is None and main.object_storage_client is None and main.sm is None"
+
+
+def import_once(workdir, importtime=False):
+    """Import main in a new interpreter; returns (seconds, stderr)."""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get("PYTHONPATH")])))
+    command = [sys.executable] + (["-X", "importtime"] if importtime else []) + ["-c", PROBE]
+    started = time.perf_counter()
+    result = subprocess.run(command, cwd=workdir, env=env, capture_output=True, text=True)
+    elapsed = time.perf_counter() - started
+    if result.returncode != 0:
+        sys.exit(f"import main failed:\n{result.stderr}")
+    return elapsed, result.stderr
+
+
+def slowest_modules(importtime_output, top):
+    """Parse ``-X importtime`` output into (cumulative microseconds, module) for main's imports, slowest first."""
+    modules = []
+    for line in importtime_output.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 1:  # modules imported by main itself; deeper ones are included in them
+            modules.append((int(cumulative), name.strip()))
+    return sorted(modules, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=1500)
+    parser.add_argument("--top", type=int, default=10, help="slowest imports of main to list")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        import_once(workdir)  # warm the bytecode and filesystem caches
+        timings = [import_once(workdir)[0] for _ in range(args.runs)]
+        _, importtime_output = import_once(workdir, importtime=True)
+        leftovers = os.listdir(workdir)
+
+    print(f"{'module':<40} {'cumulative':>12}")
+    for cumulative, name in slowest_modules(importtime_output, args.top):
+        print(f"{name:<40} {cumulative / 1000:9.1f} ms")
+
+    median = statistics.median(timings) * 1000
+    print(f"\nimport main: median {median:.0f} ms, worst {max(timings) * 1000:.0f} ms "
+          f"over {args.runs} runs (budget {args.budget_ms:.0f} ms, includes interpreter start)")
+    if leftovers:
+        sys.exit(f"import main created files in the working directory: {leftovers}")
+    if median > args.budget_ms:
+        sys.exit(f"import main is over budget by {median - args.budget_ms:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
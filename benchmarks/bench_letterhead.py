@@ -0,0 +1,128 @@
+"""
+bench_letterhead.py
+
+Letter rendering time, full render against stamping onto a cached letterhead.
+
+    full     - the filled template.txt rendered by wkhtmltopdf on the warm render pool
+    overlay  - LetterheadRenderer: the letterhead is rendered once by the same pool,
+               then each letter only lays out its stamped fields and merges them onto it
+
+Every letter has a different subject and notes, so nothing but the letterhead is
+reused. Letters are rendered one after the other (latency) and then by --concurrency
+threads (throughput). The notes sweep at the end shows where letters stop fitting
+their letterhead and fall back to a full render.
+
+Needs wkhtmltopdf and PyMuPDF.
+
+Usage:
+    python benchmarks/bench_letterhead.py [--letters 50] [--concurrency 4] [--workers 4]
+"""
+import argparse
+import base64
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from letterhead import LetterheadRenderer
+from renderer import RenderPool
+from template_registry import TemplateRegistry
+
+
+NOTE = ('Please issue a service letter for <b>{index}</b> as discussed with the department. '
+        'يرجى التكرم بالموافقة على الطلب. ')
+
+
+def letter_values(index, signature_image, paragraphs=3):
+    return {
+        "approval_type": "Approved", "transaction_status": "Completed", "book_language": "English",
+        "transaction_creator": f"Manager {index}", "sender": "John Doe", "receiver": "HR Department",
+        "transaction_date": "2024-01-15", "transaction_type": "INNER BOOK", "confidentiality": "Internal",
+        "subject": f"Service Letter {index}", "l1": "<br>".join(NOTE.format(index=index) for _ in range(paragraphs)),
+        "l2": "", "l3": "", "signature_image": signature_image, "signature_display": "block",
+        "signatory_name": "Hardik Seth", "signatory_title": "Senior Manager", "signatory_designation": ""
+    }
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def report(label, timings, sizes, elapsed=None):
+    line = (f"{label:<10} {len(timings):5d} letters  p50 {percentile(timings, 0.5) * 1000:8.1f} ms  "
+            f"p95 {percentile(timings, 0.95) * 1000:8.1f} ms  avg size {sum(sizes) / len(sizes) / 1024:7.1f} KB")
+    if elapsed is not None:
+        line += f"  {len(timings) / elapsed:7.1f} letters/s"
+    print(line)
+
+
+def timed(render, values):
+    started = time.perf_counter()
+    pdf = render(values)
+    return time.perf_counter() - started, pdf
+
+
+def run(label, render, letters, concurrency, signature_image):
+    results = [timed(render, letter_values(index, signature_image)) for index in range(letters)]
+    if not all(pdf for _, pdf in results):
+        sys.exit(f"{label}: some letters were not rendered")
+    report(label, [elapsed for elapsed, _ in results], [len(pdf) for _, pdf in results])
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        results = list(executor.map(lambda index: timed(render, letter_values(index, signature_image)),
+                                    range(letters, 2 * letters)))
+    report(f"  x{concurrency}", [elapsed for elapsed, _ in results], [len(pdf) for _, pdf in results],
+           time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--letters", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--workers", type=int, default=4, help="render pool size")
+    parser.add_argument("--wkhtmltopdf", help="path to the wkhtmltopdf binary")
+    args = parser.parse_args()
+
+    path = os.path.join(ROOT, "template.txt")
+    template = TemplateRegistry().get(path)
+    with open(os.path.join(ROOT, "sign.jpg"), 'rb') as image_file:
+        signature_image = "data:image/jpeg;base64," + base64.b64encode(image_file.read()).decode('ascii')
+
+    pool = RenderPool(workers=args.workers, wkhtmltopdf_path=args.wkhtmltopdf).start()
+    try:
+        # Warm the workers so neither mode pays for their start-up
+        for pdf in [pool.submit(template.render(letter_values(0, signature_image))) for _ in range(args.workers)]:
+            pdf.result()
+
+        run("full", lambda values: pool.render(template.render(values)), args.letters, args.concurrency,
+            signature_image)
+
+        letterheads = LetterheadRenderer(pool.render)
+        started = time.perf_counter()
+        letterheads.letterhead(template, letter_values(0, signature_image))
+        print(f"letterhead rendered in {(time.perf_counter() - started) * 1000:.1f} ms")
+        run("overlay", lambda values: letterheads.render(template, values), args.letters, args.concurrency,
+            signature_image)
+
+        print("\nnotes sweep (overlay, falling back to full when the notes overflow):")
+        for paragraphs in (1, 5, 10, 20, 40):
+            values = letter_values(paragraphs, signature_image, paragraphs)
+            elapsed, pdf = timed(lambda values: letterheads.render(template, values), values)
+            if pdf is None:
+                elapsed, pdf = timed(lambda values: pool.render(template.render(values)), values)
+                mode = "full"
+            else:
+                mode = "overlay"
+            print(f"  {len(values['l1']):6d} chars of notes  {mode:<8} {elapsed * 1000:8.1f} ms  {len(pdf) / 1024:7.1f} KB")
+        print(f"\n{letterheads.stats()}")
+    finally:
+        pool.shutdown()
+
+
+if __name__ == "__main__":
+    main()
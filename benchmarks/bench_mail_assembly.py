@@ -0,0 +1,139 @@
+"""
+bench_mail_assembly.py
+
+Cost of building and sending the emails of N approvals against a local aiosmtpd server.
+
+Every approval emails the transaction creator and the sender, with the Cc list on
+both, exactly like /approve_letters. The same approvals are sent twice:
+
+    per-recipient  - one EmailMessage per recipient, each encoding the HTML body and
+                     the PDF again and serialized by smtplib.send_message (the old
+                     behaviour)
+    assembled      - a MessageAssembly per approval: parts encoded once, identical
+                     emails sent as one message with several RCPT TO
+
+With --extra-kb the sender's copy carries an extra attachment, so the two emails
+differ and only the encoding of the shared parts is saved. The server counts SMTP
+transactions (DATA), RCPT TO commands and message bytes; build CPU is measured in
+the client.
+
+Requires: aiosmtpd (pip install -r requirements-dev.txt)
+
+Usage:
+    python benchmarks/bench_mail_assembly.py [--approvals 200] [--pdf-kb 400] [--extra-kb 0] [--cc 2]
+"""
+import argparse
+import os
+import sys
+import time
+from email.message import EmailMessage
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from bench_smtp_pool import CountingAuthenticator, CountingController, CountingHandler, free_port
+from mail_assembly import PLAIN_TEXT_FALLBACK, MessageAssembly, recipient_addresses
+from smtp_pool import SMTPConnectionPool
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+SENDER = "noreply@example.com"
+
+
+class TransactionCounter(CountingHandler):
+    def __init__(self):
+        super().__init__()
+        self.recipients = 0
+        self.bytes = 0
+
+    async def handle_DATA(self, server, session, envelope):
+        self.recipients += len(envelope.rcpt_tos)
+        self.bytes += len(envelope.original_content or envelope.content)
+        return await super().handle_DATA(server, session, envelope)
+
+
+def approvals(count, html_content, pdf_kb, extra_kb, cc):
+    pdf_data = os.urandom(pdf_kb * 1024)
+    extra_data = os.urandom(extra_kb * 1024) if extra_kb else None
+    for index in range(count):
+        yield {
+            "subject": f"Inner Book - Request ID - {index} - Approved", "html_content": html_content,
+            "pdf": (f"{index}_Inner Book.pdf", pdf_data),
+            "extra": (f"{index}_scan.bin", extra_data) if extra_data else None,
+            "creator": f"creator{index}@example.com", "sender": f"sender{index}@example.com",
+            "cc": [f"cc{number}@example.com" for number in range(cc)]
+        }
+
+
+def per_recipient(approval):
+    messages = []
+    for receiver, extra in ((approval["creator"], None), (approval["sender"], approval["extra"])):
+        msg = EmailMessage()
+        msg['Subject'] = approval["subject"]
+        msg['From'] = SENDER
+        msg['To'] = receiver
+        if approval["cc"]:
+            msg['Cc'] = ', '.join(approval["cc"])
+        msg.set_content(PLAIN_TEXT_FALLBACK)
+        msg.add_alternative(approval["html_content"], subtype='html')
+        msg.add_attachment(approval["pdf"][1], maintype='application', subtype='pdf', filename=approval["pdf"][0])
+        if extra:
+            msg.add_attachment(extra[1], maintype='application', subtype='octet-stream', filename=extra[0])
+        messages.append(msg)
+    return messages
+
+
+def assembled(approval):
+    assembly = MessageAssembly(SENDER, approval["subject"], approval["html_content"])
+    assembly.add_attachment("pdf", approval["pdf"][0], approval["pdf"][1], 'application', 'pdf')
+    if not approval["extra"]:
+        return [assembly.message(recipient_addresses(approval["creator"], approval["sender"]), approval["cc"], ("pdf",))]
+    assembly.add_attachment("extra", approval["extra"][0], approval["extra"][1])
+    return [assembly.message([approval["creator"]], approval["cc"], ("pdf",)),
+            assembly.message([approval["sender"]], approval["cc"], ("pdf", "extra"))]
+
+
+def run(label, build, args, html_content):
+    handler = TransactionCounter()
+    host, port = "127.0.0.1", free_port()
+    controller = CountingController(handler, CountingAuthenticator(), hostname=host, port=port)
+    controller.start()
+    pool = SMTPConnectionPool(host, port, "user", "secret", size=1, starttls=False)
+    try:
+        build_cpu = 0.0
+        started = time.perf_counter()
+        for approval in approvals(args.approvals, html_content, args.pdf_kb, args.extra_kb, args.cc):
+            cpu_started = time.process_time()
+            messages = build(approval)
+            if label == "per-recipient":
+                # smtplib serializes an EmailMessage while sending; count that as building
+                messages = [(msg.as_bytes(policy=msg.policy.clone(linesep='\r\n')), SENDER,
+                             recipient_addresses(msg['To'], msg['Cc'])) for msg in messages]
+            build_cpu += time.process_time() - cpu_started
+            for error in pool.send_messages(messages):
+                if error is not None:
+                    sys.exit(f"{label}: {error}")
+        elapsed = time.perf_counter() - started
+    finally:
+        pool.close_all()
+        controller.stop()
+
+    print(f"{label:<14} transactions={handler.messages:5d} rcpt={handler.recipients:5d} "
+          f"sent={handler.bytes / 1024 / 1024:8.1f} MiB  build cpu={build_cpu / args.approvals * 1000:6.2f} ms/approval  "
+          f"elapsed={elapsed:.2f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--approvals", type=int, default=200)
+    parser.add_argument("--pdf-kb", type=int, default=400)
+    parser.add_argument("--extra-kb", type=int, default=0, help="extra attachment on the sender's copy")
+    parser.add_argument("--cc", type=int, default=2, help="Cc recipients on every email")
+    args = parser.parse_args()
+
+    with open(os.path.join(ROOT, "email_template.txt"), encoding="utf-8") as template_file:
+        html_content = template_file.read()
+    run("per-recipient", per_recipient, args, html_content)
+    run("assembled", assembled, args, html_content)
+
+
+if __name__ == "__main__":
+    main()
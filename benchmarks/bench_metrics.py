@@ -0,0 +1,90 @@
+"""
+bench_metrics.py
+
+Measures what timing a stage with ``metrics.stage`` adds to it:
+
+    untraced  - histogram update only (every request)
+    traced    - histogram update plus a span on the request's Trace
+    contended - untraced, from several threads recording the same stage at once
+                (total wall time over all threads' stages)
+
+and checks the cost against the per-stage budget. Finally prints a sample of the
+/metrics output.
+
+Usage:
+    python benchmarks/bench_metrics.py [--iterations 200000] [--threads 8] [--budget-us 50]
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import metrics
+
+
+def empty_loop(iterations):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        pass
+    return time.perf_counter() - started
+
+
+def stage_loop(iterations):
+    stage = metrics.stage
+    started = time.perf_counter()
+    for _ in range(iterations):
+        with stage("bench"):
+            pass
+    return time.perf_counter() - started
+
+
+def per_stage_us(iterations):
+    return (stage_loop(iterations) - empty_loop(iterations)) / iterations * 1e6
+
+
+def in_threads(loop, iterations, threads):
+    """Wall time for ``threads`` threads each running ``loop(iterations)``."""
+    workers = [threading.Thread(target=loop, args=(iterations,)) for _ in range(threads)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=200000)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--budget-us", type=float, default=50)
+    args = parser.parse_args()
+
+    results = {"untraced": per_stage_us(args.iterations)}
+
+    token = metrics._current_trace.set(metrics.Trace("bench"))
+    # Spans accumulate on one trace here; a real request has a handful
+    results["traced"] = per_stage_us(min(args.iterations, 20000))
+    metrics._current_trace.reset(token)
+
+    per_thread = args.iterations // args.threads
+    results[f"contended x{args.threads}"] = (
+        in_threads(stage_loop, per_thread, args.threads) - in_threads(empty_loop, per_thread, args.threads)
+    ) / (per_thread * args.threads) * 1e6
+
+    for label, cost in results.items():
+        print(f"{label:<16} {cost:7.2f} us per stage")
+
+    print("\n" + "\n".join(line for line in metrics.REGISTRY.render().splitlines()
+                            if 'stage="bench"' not in line or 'le="0.001"' in line or "_count" in line))
+
+    worst = max(results.values())
+    if worst > args.budget_us:
+        sys.exit(f"Stage timing costs {worst:.2f} us, over the {args.budget_us:.0f} us budget")
+
+
+if __name__ == "__main__":
+    main()
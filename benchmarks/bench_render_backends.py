@@ -0,0 +1,130 @@
+"""
+bench_render_backends.py
+
+Cost of rendering the real template.txt with each render backend (render_backends.py):
+
+    wkhtmltopdf  pdfkit + the wkhtmltopdf binary, one process per document
+    pymupdf      PyMuPDF Story, in process
+    reportlab    reportlab Platypus, in process
+
+Each backend runs in a fresh interpreter of its own, so its imports, peak RSS and CPU
+are not mixed with another backend's. That child renders one letter to warm up (the
+"first" column includes the imports), then --letters letters with different
+subjects and notes, and reports:
+
+    p50 / p95    wall time per letter
+    cpu          user + system CPU per letter, including child processes (wkhtmltopdf)
+    peak rss     the larger of the interpreter's and its children's peak RSS
+    size         average PDF size
+
+Backends whose library or binary is missing are listed as skipped. The PDFs of the
+last letter are written to --output-dir when given, to compare what each engine
+makes of the template.
+
+Usage:
+    python benchmarks/bench_render_backends.py [--letters 50] [--paragraphs 3]
+        [--backends wkhtmltopdf pymupdf reportlab] [--wkhtmltopdf PATH] [--output-dir DIR]
+"""
+import argparse
+import base64
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from bench_letterhead import letter_values, percentile
+from render_backends import BACKENDS, create_backend
+from template_registry import TemplateRegistry
+
+
+def cpu_seconds():
+    """User + system CPU of this process and its waited-for children."""
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+def peak_rss_mb():
+    # ru_maxrss is reported in KiB on Linux
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) / 1024
+
+
+def child(args):
+    """Render with one backend in this interpreter and print the results as JSON."""
+    template = TemplateRegistry().get(os.path.join(ROOT, "template.txt"))
+    with open(os.path.join(ROOT, "sign.jpg"), 'rb') as image_file:
+        signature_image = "data:image/jpeg;base64," + base64.b64encode(image_file.read()).decode('ascii')
+    options = {'quiet': ''}
+
+    started = time.perf_counter()
+    try:
+        backend = create_backend(args.child, wkhtmltopdf_path=args.wkhtmltopdf)
+        backend.render(template.render(letter_values(0, signature_image, args.paragraphs)), options)
+    except (ImportError, OSError) as e:
+        print(json.dumps({"backend": args.child, "skipped": str(e).splitlines()[0]}))
+        return
+    first = time.perf_counter() - started
+
+    documents = [template.render(letter_values(index, signature_image, args.paragraphs))
+                 for index in range(1, args.letters + 1)]
+    timings, sizes = [], []
+    cpu_started = cpu_seconds()
+    for html_content in documents:
+        started = time.perf_counter()
+        pdf = backend.render(html_content, options)
+        timings.append(time.perf_counter() - started)
+        sizes.append(len(pdf))
+    cpu = (cpu_seconds() - cpu_started) / len(documents)
+
+    if args.output_dir:
+        with open(os.path.join(args.output_dir, f"{args.child}.pdf"), 'wb') as pdf_file:
+            pdf_file.write(pdf)
+    print(json.dumps({
+        "backend": args.child, "first_ms": first * 1000,
+        "p50_ms": percentile(timings, 0.5) * 1000, "p95_ms": percentile(timings, 0.95) * 1000,
+        "cpu_ms": cpu * 1000, "peak_rss_mb": peak_rss_mb(), "size_kb": sum(sizes) / len(sizes) / 1024
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--letters", type=int, default=50)
+    parser.add_argument("--paragraphs", type=int, default=3, help="paragraphs of notes per letter")
+    parser.add_argument("--backends", nargs="+", default=sorted(BACKENDS), choices=sorted(BACKENDS))
+    parser.add_argument("--wkhtmltopdf", help="path to the wkhtmltopdf binary")
+    parser.add_argument("--output-dir", help="write each backend's last PDF here")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        return child(args)
+
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+    print(f"{'backend':<12} {'first':>9} {'p50':>9} {'p95':>9} {'cpu':>9} {'peak rss':>10} {'size':>9}")
+    for name in args.backends:
+        command = [sys.executable, os.path.abspath(__file__), "--child", name,
+                   "--letters", str(args.letters), "--paragraphs", str(args.paragraphs)]
+        for flag, value in (("--wkhtmltopdf", args.wkhtmltopdf), ("--output-dir", args.output_dir)):
+            if value:
+                command += [flag, value]
+        result = subprocess.run(command, capture_output=True, text=True)
+        lines = result.stdout.strip().splitlines()
+        if result.returncode != 0 or not lines:
+            sys.exit(f"{name} failed:\n{result.stderr}")
+        row = json.loads(lines[-1])
+        if "skipped" in row:
+            print(f"{name:<12} skipped: {row['skipped']}")
+            continue
+        print(f"{name:<12} {row['first_ms']:7.1f}ms {row['p50_ms']:7.1f}ms {row['p95_ms']:7.1f}ms "
+              f"{row['cpu_ms']:7.1f}ms {row['peak_rss_mb']:7.1f}MiB {row['size_kb']:6.1f}KB")
+
+
+if __name__ == "__main__":
+    main()
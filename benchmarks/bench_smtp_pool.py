@@ -0,0 +1,157 @@
+"""
+bench_smtp_pool.py
+
+Counts SMTP handshakes per N approvals against a local aiosmtpd server.
+
+Every approval sends two emails (transaction creator and sender), exactly like
+/approve_letters. The script runs the same approvals twice:
+    per-message  - a new smtplib.SMTP session with LOGIN for every email (the old behaviour)
+    pooled       - SMTPConnectionPool sessions shared by all emails
+
+The server counts EHLO/HELO greetings and AUTH exchanges, so the numbers come from
+the server side and not from the client's own bookkeeping. The script exits with an
+error when a run loses messages or the pooled run needs more handshakes or logins
+than one per pool session plus one per recycle (every --max-messages-per-session
+messages), so it can gate a CI job.
+
+Requires: aiosmtpd (pip install -r requirements-dev.txt)
+
+Usage:
+    python benchmarks/bench_smtp_pool.py [--approvals 1000] [--concurrency 8] [--max-messages-per-session 100]
+"""
+import argparse
+import math
+import os
+import smtplib
+import socket
+import sys
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.message import EmailMessage
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from aiosmtpd.controller import Controller
+from aiosmtpd.smtp import AuthResult, SMTP as SMTPServer
+
+from smtp_pool import SMTPConnectionPool
+
+# aiosmtpd logs a deprecation notice about its own internals on every AUTH
+logging.getLogger("mail.log").setLevel(logging.ERROR)
+
+
+class CountingHandler(object):
+    def __init__(self):
+        self.greetings = 0
+        self.messages = 0
+
+    async def handle_EHLO(self, server, session, envelope, hostname, responses):
+        self.greetings += 1
+        session.host_name = hostname
+        return responses
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages += 1
+        return '250 OK'
+
+
+class CountingAuthenticator(object):
+    def __init__(self):
+        self.logins = 0
+
+    def __call__(self, server, session, envelope, mechanism, auth_data):
+        self.logins += 1
+        return AuthResult(success=True)
+
+
+class CountingController(Controller):
+    def __init__(self, handler, authenticator, **kwargs):
+        self.authenticator = authenticator
+        super().__init__(handler, **kwargs)
+
+    def factory(self):
+        return SMTPServer(self.handler, authenticator=self.authenticator, auth_require_tls=False)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def build_message(index):
+    msg = EmailMessage()
+    msg['Subject'] = f"Inner Book - Request ID - {index} - Approved"
+    msg['From'] = "noreply@example.com"
+    msg['To'] = f"user{index}@example.com"
+    msg.set_content("This email contains HTML content. Please view in an HTML-compatible email client.")
+    msg.add_alternative("<p>approved</p>", subtype='html')
+    msg.add_attachment(b"%PDF-1.4 " + b"x" * 20000, maintype='application', subtype='pdf', filename=f"{index}.pdf")
+    return msg
+
+
+def send_per_message(host, port, msg):
+    with smtplib.SMTP(host, port) as smtp:
+        smtp.login("user", "secret")
+        smtp.send_message(msg)
+
+
+def run(label, approvals, concurrency, send):
+    handler = CountingHandler()
+    authenticator = CountingAuthenticator()
+    host, port = "127.0.0.1", free_port()
+    controller = CountingController(handler, authenticator, hostname=host, port=port)
+    controller.start()
+    try:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(lambda i: send(host, port, i), range(approvals)))
+        elapsed = time.perf_counter() - started
+    finally:
+        controller.stop()
+
+    print(f"{label:<12} approvals={approvals} messages={handler.messages} "
+          f"handshakes={handler.greetings} logins={authenticator.logins} "
+          f"elapsed={elapsed:.2f}s ({approvals / elapsed:.0f} approvals/s)")
+    if handler.messages != 2 * approvals:
+        sys.exit(f"{label}: the server received {handler.messages} of {2 * approvals} messages")
+    return handler.greetings, authenticator.logins
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--approvals", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--max-messages-per-session", type=int, default=100, help="pooled session recycle limit")
+    args = parser.parse_args()
+
+    def per_message(host, port, index):
+        send_per_message(host, port, build_message(index))
+        send_per_message(host, port, build_message(index))
+
+    run("per-message", args.approvals, args.concurrency, per_message)
+
+    pools = {}
+
+    def pooled(host, port, index):
+        pool = pools.get(port)
+        if pool is None:
+            pool = pools.setdefault(port, SMTPConnectionPool(host, port, "user", "secret",
+                                                             size=args.concurrency, starttls=False,
+                                                             max_messages_per_connection=args.max_messages_per_session))
+        pool.send_message(build_message(index))
+        pool.send_message(build_message(index))
+
+    handshakes, logins = run("pooled", args.approvals, args.concurrency, pooled)
+    for pool in pools.values():
+        pool.close_all()
+    # Sessions are opened once and only replaced when recycled; more means the pool reconnected or leaked them
+    budget = args.concurrency + math.ceil(2 * args.approvals / args.max_messages_per_session)
+    if handshakes > budget or logins > budget:
+        sys.exit(f"pooled: {handshakes} handshakes and {logins} logins, budget {budget} "
+                 f"({args.concurrency} sessions plus recycles)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+bench_templates.py
+
+Microbenchmark for filling the letter and email templates.
+
+    file+format  - os.path.exists, open, read and str.format on every call (the old path)
+    registry     - TemplateRegistry.render on the precompiled template
+
+Both paths must produce identical output; the script checks that before timing.
+
+Usage:
+    python benchmarks/bench_templates.py [--iterations 20000]
+"""
+import argparse
+import os
+import sys
+import timeit
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from template_registry import TemplateRegistry
+
+
+LETTER_VALUES = {
+    "approval_type": "Approved", "transaction_status": "Completed", "book_language": "English",
+    "transaction_creator": "Manager Name", "sender": "John Doe", "receiver": "HR Department",
+    "transaction_date": "2024-01-15", "transaction_type": "INNER BOOK", "confidentiality": "Internal",
+    "subject": "Service Letter Request", "l1": "Please issue a service letter. " * 20, "l2": "", "l3": "",
+    "signature_image": "", "signature_display": "none", "signatory_name": "Signatory",
+    "signatory_title": "Senior Manager", "signatory_designation": ""
+}
+EMAIL_VALUES = {
+    "request_id": "12345", "sender": "John Doe", "sender_email": "sender@example.com", "department": "IT",
+    "designation": "Software Engineer", "request_type": "Service Letter", "today": "01-15-2024"
+}
+
+
+def file_and_format(path, values):
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as file:
+            return file.read().format(**values)
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    registry = TemplateRegistry()
+    cases = (
+        ("template.txt", LETTER_VALUES),
+        ("email_template.txt", EMAIL_VALUES),
+    )
+    for name, values in cases:
+        path = os.path.join(ROOT, name)
+        registry.register(path, values.keys())
+        assert registry.render(path, values) == file_and_format(path, values), f"{name}: outputs differ"
+
+        old = timeit.timeit(lambda: file_and_format(path, values), number=args.iterations)
+        new = timeit.timeit(lambda: registry.render(path, values), number=args.iterations)
+        print(f"{name:<20} file+format {old / args.iterations * 1e6:8.2f} us/call   "
+              f"registry {new / args.iterations * 1e6:8.2f} us/call   speedup x{old / new:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+bench_upload.py
+
+Uploads one large document to the in-process FakeObjectStorage, which limits every
+request body to a per-stream bandwidth (like a single TCP stream to Object Storage):
+
+    single     - one put_object for the whole document (the old path)
+    multipart  - UploadManager with parts uploaded in parallel
+
+A second multipart run injects a failure into the first attempt of one part and
+shows that only that part is sent again. Every upload is read back and compared.
+
+Usage:
+    python benchmarks/bench_upload.py [--size-mb 64] [--part-mb 10] [--parallelism 4] [--bandwidth-mb 40]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from fake_object_storage import FakeObjectStorage
+from upload_manager import UploadManager
+
+
+def run(label, storage, manager, data):
+    started = time.perf_counter()
+    result = manager.upload("royal_group/1_MEMO.pdf", data)
+    elapsed = time.perf_counter() - started
+    stored = storage.get_object("ns", "bucket", "royal_group/1_MEMO.pdf").data.content
+    assert stored == data, "uploaded object differs from the document"
+    print(f"{label:<20} {elapsed:6.2f} s  {len(data) / elapsed / 1024 / 1024:7.1f} MiB/s  "
+          f"parts={result['parts']}  requests={storage.calls}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size-mb", type=float, default=64)
+    parser.add_argument("--part-mb", type=float, default=10)
+    parser.add_argument("--parallelism", type=int, default=4)
+    parser.add_argument("--bandwidth-mb", type=float, default=40, help="MiB/s per request stream")
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds added to every request")
+    args = parser.parse_args()
+
+    data = os.urandom(int(args.size_mb * 1024 * 1024))
+    part_size = int(args.part_mb * 1024 * 1024)
+
+    storage = FakeObjectStorage(args.latency, args.bandwidth_mb)
+    run("single put_object", storage,
+        UploadManager(storage, "ns", "bucket", multipart_threshold=len(data) + 1), data)
+
+    storage = FakeObjectStorage(args.latency, args.bandwidth_mb)
+    run("multipart", storage,
+        UploadManager(storage, "ns", "bucket", multipart_threshold=part_size, part_size=part_size,
+                      parallelism=args.parallelism), data)
+
+    storage = FakeObjectStorage(args.latency, args.bandwidth_mb, fail_parts={(2, 1)})
+    run("multipart, 1 retry", storage,
+        UploadManager(storage, "ns", "bucket", multipart_threshold=part_size, part_size=part_size,
+                      parallelism=args.parallelism, retry_delay=0.1), data)
+
+
+if __name__ == "__main__":
+    main()
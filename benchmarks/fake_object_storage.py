@@ -0,0 +1,135 @@
+"""
+fake_object_storage.py
+
+In-process stand-in for the parts of oci.object_storage.ObjectStorageClient the
+service uses for uploads, so UploadManager can be exercised without a tenancy.
+
+Like Object Storage, it checks the Content-MD5 of every put_object/upload_part
+body (answering 400 on a mismatch), echoes opc-content-md5, and only makes a
+multipart object visible once its parts are committed. Each request can be given
+a fixed latency and a per-stream bandwidth limit, and individual part attempts
+can be made to fail, to show the effect of parallel parts and part-level retries.
+
+Usage (from a script in this directory):
+    from fake_object_storage import FakeObjectStorage
+    storage = FakeObjectStorage(latency=0.02, bandwidth_mb=40, fail_parts={(2, 1)})
+    UploadManager(storage, "ns", "bucket").upload("folder/1_MEMO.pdf", data)
+"""
+import base64
+import hashlib
+import threading
+import time
+import types
+import uuid
+
+import oci
+
+
+def _response(status=200, headers=None, data=None):
+    return types.SimpleNamespace(status=status, headers=headers or {}, data=data)
+
+
+class FakeObjectStorage(object):
+    """
+    Thread-safe in-memory bucket store with OCI-like single and multipart uploads.
+    """
+    def __init__(self, latency=0.0, bandwidth_mb=None, fail_parts=None):
+        """
+        Args:
+            latency (float): Seconds added to every request
+            bandwidth_mb (float): MiB/s per request body, unlimited if None
+            fail_parts (set): (part_num, attempt) pairs answered with a 503
+        """
+        self.latency = latency
+        self.bandwidth = bandwidth_mb * 1024 * 1024 if bandwidth_mb else None
+        self.fail_parts = set(fail_parts or ())
+        self.objects = {}
+        self.uploads = {}
+        self.calls = {}
+        self._attempts = {}
+        self._lock = threading.Lock()
+
+    def _count(self, name):
+        with self._lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+
+    def _transfer(self, size):
+        delay = self.latency + (size / self.bandwidth if self.bandwidth else 0)
+        if delay:
+            time.sleep(delay)
+
+    @staticmethod
+    def _verify_md5(body, content_md5):
+        actual = base64.b64encode(hashlib.md5(body).digest()).decode('ascii')
+        if content_md5 is not None and content_md5 != actual:
+            raise oci.exceptions.ServiceError(400, "InvalidDigest", {}, "The Content-MD5 you specified did not match")
+        return actual
+
+    def put_object(self, namespace_name, bucket_name, object_name, put_object_body, content_type=None,
+                   content_md5=None, **kwargs):
+        self._count("put_object")
+        body = bytes(put_object_body)
+        self._transfer(len(body))
+        md5 = self._verify_md5(body, content_md5)
+        etag = uuid.uuid4().hex
+        with self._lock:
+            self.objects[(bucket_name, object_name)] = {"data": body, "etag": etag, "content_type": content_type}
+        return _response(headers={"etag": etag, "opc-content-md5": md5,
+                                  "last-modified": time.strftime('%a, %d %b %Y %H:%M:%S GMT', time.gmtime())})
+
+    def create_multipart_upload(self, namespace_name, bucket_name, create_multipart_upload_details, **kwargs):
+        self._count("create_multipart_upload")
+        self._transfer(0)
+        upload_id = uuid.uuid4().hex
+        with self._lock:
+            self.uploads[upload_id] = {"bucket": bucket_name, "object": create_multipart_upload_details.object,
+                                       "content_type": create_multipart_upload_details.content_type, "parts": {}}
+        return _response(data=types.SimpleNamespace(upload_id=upload_id, object=create_multipart_upload_details.object))
+
+    def upload_part(self, namespace_name, bucket_name, object_name, upload_id, upload_part_num, upload_part_body,
+                    content_md5=None, **kwargs):
+        self._count("upload_part")
+        with self._lock:
+            attempt = self._attempts[(upload_id, upload_part_num)] = self._attempts.get((upload_id, upload_part_num), 0) + 1
+        body = bytes(upload_part_body)
+        self._transfer(len(body))
+        if (upload_part_num, attempt) in self.fail_parts:
+            raise oci.exceptions.ServiceError(503, "ServiceUnavailable", {}, f"Injected failure of part {upload_part_num}")
+        md5 = self._verify_md5(body, content_md5)
+        etag = uuid.uuid4().hex
+        with self._lock:
+            self.uploads[upload_id]["parts"][upload_part_num] = (etag, body)
+        return _response(headers={"etag": etag, "opc-content-md5": md5})
+
+    def commit_multipart_upload(self, namespace_name, bucket_name, object_name, upload_id,
+                                commit_multipart_upload_details, **kwargs):
+        self._count("commit_multipart_upload")
+        self._transfer(0)
+        with self._lock:
+            upload = self.uploads.pop(upload_id)
+            chunks = []
+            for part in commit_multipart_upload_details.parts_to_commit:
+                etag, body = upload["parts"][part.part_num]
+                if etag != part.etag:
+                    raise oci.exceptions.ServiceError(400, "InvalidPart", {}, f"ETag mismatch for part {part.part_num}")
+                chunks.append(body)
+            etag = uuid.uuid4().hex
+            self.objects[(bucket_name, object_name)] = {"data": b''.join(chunks), "etag": etag,
+                                                        "content_type": upload["content_type"]}
+        return _response(headers={"etag": etag, "opc-multipart-md5": f"fake-{len(chunks)}"})
+
+    def abort_multipart_upload(self, namespace_name, bucket_name, object_name, upload_id, **kwargs):
+        self._count("abort_multipart_upload")
+        with self._lock:
+            self.uploads.pop(upload_id, None)
+        return _response(status=204)
+
+    def get_object(self, namespace_name, bucket_name, object_name, **kwargs):
+        self._count("get_object")
+        with self._lock:
+            obj = self.objects.get((bucket_name, object_name))
+        if obj is None:
+            raise oci.exceptions.ServiceError(404, "ObjectNotFound", {}, f"{object_name} not found")
+        self._transfer(len(obj["data"]))
+        return _response(headers={"etag": obj["etag"], "content-length": str(len(obj["data"]))},
+                         data=types.SimpleNamespace(content=obj["data"]))
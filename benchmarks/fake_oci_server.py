@@ -0,0 +1,199 @@
+"""
+fake_oci_server.py
+
+Local HTTP server speaking the parts of the OCI Object Storage REST API the service
+uses, so the real ObjectStorageClient (request signing, retries, streaming) can be
+pointed at it with ``service_endpoint`` / the ``oci_service_endpoint`` config key:
+
+    PUT  /n/{namespace}/b/{bucket}/o/{object}   put_object (checks Content-MD5)
+    GET  /n/{namespace}/b/{bucket}/o/{object}   get_object (Range, If-None-Match)
+    HEAD /n/{namespace}/b/{bucket}/o/{object}   head_object
+    GET  /n/{namespace}/b/{bucket}/o            list_objects (prefix, start, limit)
+
+Objects live in memory. Request signatures are not verified. Every request can be
+delayed by a fixed latency to stand in for the network round trip to the region.
+
+Usage (from a script in this directory):
+    from fake_oci_server import FakeOCIServer
+    server = FakeOCIServer(latency=0.02).start()
+    ObjectStorageClient(config, service_endpoint=server.url)
+"""
+import base64
+import email.utils
+import hashlib
+import json
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+
+_OBJECT_PATH = re.compile(r'^/n/([^/]+)/b/([^/]+)/o(?:/(.+))?$')
+_RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'FakeObjectStorage'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, body=b'', headers=None, content_type='application/json'):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('opc-request-id', uuid.uuid4().hex)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def _error(self, status, code, message):
+        self._reply(status, json.dumps({"code": code, "message": message}).encode())
+
+    def _route(self):
+        store = self.server.store
+        store.count(self.command)
+        if store.latency:
+            time.sleep(store.latency)
+        url = urlsplit(self.path)
+        match = _OBJECT_PATH.match(url.path)
+        if match is None:
+            self._error(404, "NotFound", f"Unknown path {url.path}")
+            return None, None, None
+        bucket, object_name = unquote(match.group(2)), match.group(3)
+        return url, bucket, unquote(object_name) if object_name else None
+
+    def do_PUT(self):
+        url, bucket, object_name = self._route()
+        if url is None:
+            return
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        md5 = base64.b64encode(hashlib.md5(body).digest()).decode('ascii')
+        expected = self.headers.get('Content-MD5')
+        if expected and expected != md5:
+            self._error(400, "InvalidDigest", "The Content-MD5 you specified did not match")
+            return
+        entry = self.server.store.put(bucket, object_name, body, self.headers.get('Content-Type'))
+        self._reply(200, headers={"ETag": entry["etag"], "opc-content-md5": md5,
+                                  "last-modified": entry["last_modified"]})
+
+    def do_HEAD(self):
+        self.do_GET()
+
+    def do_GET(self):
+        url, bucket, object_name = self._route()
+        if url is None:
+            return
+        if object_name is None:
+            self._list(bucket, parse_qs(url.query))
+            return
+
+        entry = self.server.store.get(bucket, object_name)
+        if entry is None:
+            self._error(404, "ObjectNotFound", f"The object '{object_name}' was not found")
+            return
+        headers = {"ETag": entry["etag"], "last-modified": entry["last_modified"], "Accept-Ranges": "bytes"}
+        if self.headers.get('If-None-Match') == entry["etag"]:
+            self.send_response(304)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        data, status = entry["data"], 200
+        match = _RANGE.match(self.headers.get('Range', ''))
+        if match:
+            size = len(data)
+            first, last = match.groups()
+            if first:
+                start, end = int(first), min(int(last), size - 1) if last else size - 1
+            else:
+                start, end = max(0, size - int(last)), size - 1
+            if start >= size or end < start:
+                self._error(416, "InvalidRange", "The requested range cannot be satisfied")
+                return
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+            data, status = data[start:end + 1], 206
+        self._reply(status, data, headers, content_type=entry["content_type"] or 'application/octet-stream')
+
+    def _list(self, bucket, query):
+        prefix = query.get('prefix', [''])[0]
+        start = query.get('start', [''])[0]
+        limit = int(query.get('limit', ['1000'])[0])
+        names = self.server.store.names(bucket, prefix, start)
+        page, rest = names[:limit], names[limit:]
+        objects = []
+        for name in page:
+            entry = self.server.store.get(bucket, name)
+            objects.append({"name": name, "size": len(entry["data"]), "etag": entry["etag"],
+                            "timeCreated": entry["time_created"]})
+        self._reply(200, json.dumps({"objects": objects, "prefixes": [],
+                                     "nextStartWith": rest[0] if rest else None}).encode())
+
+
+class ObjectStore(object):
+    """Thread-safe in-memory buckets plus request counters."""
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.requests = {}
+        self._objects = {}
+        self._lock = threading.Lock()
+
+    def count(self, method):
+        with self._lock:
+            self.requests[method] = self.requests.get(method, 0) + 1
+
+    def put(self, bucket, name, data, content_type):
+        now = time.time()
+        entry = {
+            "data": data,
+            "etag": uuid.uuid4().hex,
+            "content_type": content_type,
+            "last_modified": email.utils.formatdate(now, usegmt=True),
+            "time_created": time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(now)) + f".{int(now % 1 * 1000):03d}Z"
+        }
+        with self._lock:
+            self._objects[(bucket, name)] = entry
+        return entry
+
+    def get(self, bucket, name):
+        with self._lock:
+            return self._objects.get((bucket, name))
+
+    def names(self, bucket, prefix, start):
+        with self._lock:
+            return sorted(name for stored_bucket, name in self._objects
+                          if stored_bucket == bucket and name.startswith(prefix) and name >= start)
+
+
+class FakeOCIServer(object):
+    """
+    Threaded Object Storage stand-in on 127.0.0.1.
+    """
+    def __init__(self, port=0, latency=0.0):
+        """
+        Args:
+            port (int): Port to listen on, any free port if 0
+            latency (float): Seconds added to every request
+        """
+        self.store = ObjectStore(latency)
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', port), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.store = self.store
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="fake-oci", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -0,0 +1,293 @@
+"""
+cache.py
+
+Building blocks for the service's caches.
+
+Classes:
+    ByteLRU: Thread-safe in-memory LRU bounded by the total size of its values.
+    DiskStore: Content-addressed on-disk blob store with per-key metadata and
+        least-recently-used eviction by total size, indexed in memory.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+
+class ByteLRU(object):
+    """
+    In-memory LRU whose capacity is a byte budget rather than an entry count.
+    """
+    def __init__(self, max_bytes):
+        """
+        Args:
+            max_bytes (int): Total size of values kept before the least recently
+                used entries are evicted
+        """
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, size=None):
+        """
+        Store ``value`` under ``key``. Values larger than the whole budget are not stored.
+
+        Args:
+            size (int): Size charged against the budget, defaults to len(value)
+        """
+        size = len(value) if size is None else size
+        if size > self.max_bytes:
+            self.pop(key)
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[1]
+            self._entries[key] = (value, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def pop(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return None
+            self._bytes -= entry[1]
+            return entry[0]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
+
+
+def _atomic_write(path, data, mode='wb'):
+    """Write to a temporary file in the same directory and rename it into place."""
+    directory = os.path.dirname(path)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, mode) as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+class DiskStore(object):
+    """
+    On-disk store mapping keys to blobs plus a small JSON metadata record.
+
+    Blobs are stored once per SHA-256 of their content, so the same bytes
+    reached through different keys occupy disk space only once. Records are
+    evicted least-recently-used first when ``max_bytes`` is exceeded, down to
+    ``low_water`` of the budget so that eviction does not run on every put.
+
+    The records are read once, when the store is opened, into an in-memory index
+    of key -> (sha256, size) kept in access order, so puts and eviction never
+    scan the directory. Records written by another process sharing the
+    directory join the index the first time they are read.
+    """
+    def __init__(self, directory, max_bytes=None, low_water=0.9):
+        """
+        Args:
+            directory (str): Root directory of the store, created if missing
+            max_bytes (int): Total blob size kept on disk, unbounded if None
+            low_water (float): Fraction of max_bytes eviction brings the store down to
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.low_water = low_water
+        self._index_dir = os.path.join(directory, 'index')
+        self._blob_dir = os.path.join(directory, 'blobs')
+        os.makedirs(self._index_dir, exist_ok=True)
+        os.makedirs(self._blob_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self.evictions = 0
+        # key -> (sha256, size), least recently used first
+        self._index = OrderedDict()
+        # sha256 -> number of keys referencing the blob
+        self._refcounts = {}
+        # Total size of the referenced blobs
+        self._bytes = 0
+        self._load()
+
+    def _record_path(self, key):
+        return os.path.join(self._index_dir, hashlib.sha256(key.encode('utf-8')).hexdigest() + '.json')
+
+    def _blob_path(self, digest):
+        return os.path.join(self._blob_dir, digest)
+
+    def _load(self):
+        """Build the index from the records on disk and drop blobs no record references."""
+        records = []
+        for name in os.listdir(self._index_dir):
+            path = os.path.join(self._index_dir, name)
+            try:
+                accessed = os.path.getmtime(path)
+                with open(path, 'r', encoding='utf-8') as f:
+                    record = json.load(f)
+                records.append((accessed, record["key"], record["sha256"], record["size"]))
+            except (OSError, ValueError, KeyError):
+                continue
+        records.sort()
+        for _, key, digest, size in records:
+            self._add(key, digest, size)
+
+        for name in os.listdir(self._blob_dir):
+            if not name.startswith('.tmp-') and name not in self._refcounts:
+                self._remove_blob(name)
+
+        if self.max_bytes is not None and self._bytes > self.max_bytes:
+            self._evict()
+
+    def _add(self, key, digest, size):
+        """Index ``key`` as most recently used. Caller holds the lock."""
+        self._drop(key)
+        self._index[key] = (digest, size)
+        self._refcounts[digest] = self._refcounts.get(digest, 0) + 1
+        if self._refcounts[digest] == 1:
+            self._bytes += size
+
+    def _drop(self, key):
+        """Remove ``key`` from the index and its blob once unreferenced. Caller holds the lock."""
+        entry = self._index.pop(key, None)
+        if entry is None:
+            return
+        digest, size = entry
+        self._refcounts[digest] -= 1
+        if not self._refcounts[digest]:
+            del self._refcounts[digest]
+            self._bytes -= size
+            self._remove_blob(digest)
+
+    def get_meta(self, key):
+        """Return the metadata stored for ``key`` without reading the blob."""
+        try:
+            with open(self._record_path(key), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def get(self, key):
+        """
+        Returns:
+            tuple: (meta, data) or (None, None) if the key is not stored
+        """
+        record_path = self._record_path(key)
+        meta = self.get_meta(key)
+        if meta is None:
+            return None, None
+        try:
+            with open(self._blob_path(meta["sha256"]), 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None, None
+        with self._lock:
+            if self._index.get(key, (None,))[0] == meta["sha256"]:
+                self._index.move_to_end(key)
+            else:
+                self._add(key, meta["sha256"], len(data))
+        try:
+            # Persist the access time so the LRU order survives a restart
+            os.utime(record_path)
+        except OSError:
+            pass
+        return meta, data
+
+    def put(self, key, data, meta=None):
+        """
+        Store ``data`` with ``meta`` under ``key``.
+
+        Returns:
+            dict: The stored metadata, including ``sha256`` and ``size``
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        record = dict(meta or {}, key=key, sha256=digest, size=len(data), stored_at=time.time())
+        blob_path = self._blob_path(digest)
+        with self._lock:
+            if not os.path.exists(blob_path):
+                _atomic_write(blob_path, data)
+            _atomic_write(self._record_path(key), json.dumps(record), mode='w')
+            if self._index.get(key, (None,))[0] == digest:
+                self._index.move_to_end(key)
+            else:
+                self._add(key, digest, len(data))
+            if self.max_bytes is not None and self._bytes > self.max_bytes:
+                self._evict()
+        return record
+
+    def update_meta(self, key, **changes):
+        """Merge ``changes`` into the metadata of an existing record."""
+        meta = self.get_meta(key)
+        if meta is None:
+            return None
+        meta.update(changes)
+        with self._lock:
+            _atomic_write(self._record_path(key), json.dumps(meta), mode='w')
+        return meta
+
+    def delete(self, key):
+        """Remove the record for ``key`` and its blob if no other key references it."""
+        with self._lock:
+            try:
+                os.remove(self._record_path(key))
+            except OSError:
+                pass
+            self._drop(key)
+
+    def _remove_blob(self, digest):
+        try:
+            os.remove(self._blob_path(digest))
+        except OSError:
+            pass
+
+    def _evict(self):
+        """Drop least recently used records until under the low-water mark. Caller holds the lock."""
+        target = self.max_bytes * self.low_water
+        while self._index and self._bytes > target:
+            key = next(iter(self._index))
+            try:
+                os.remove(self._record_path(key))
+            except OSError:
+                pass
+            self._drop(key)
+            self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._index),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "evictions": self.evictions
+            }
@@ -0,0 +1,135 @@
+"""
+document_cache.py
+
+This module keeps recently used PDFs close to the API so re-opening a letter does
+not download it from OCI Object Storage again. Documents are kept in two levels:
+
+    memory  - PDF bytes in a byte-bounded LRU for the hottest documents
+    disk    - a larger content-addressed DiskStore that survives restarts
+
+An entry is served without contacting OCI for ``ttl`` seconds after it was stored
+or last validated. After that it is revalidated with its ETag, so an unchanged
+document costs a ``304`` instead of a full download.
+
+Classes:
+    DocumentCache: Two-level read-through cache for archived PDFs keyed by object name.
+
+Configuration (config.json, optional):
+    pdf_cache_dir             On-disk store directory (default: .pdf_cache)
+    pdf_cache_memory_mb       Memory LRU budget in MiB (default: 64)
+    pdf_cache_disk_mb         Disk store budget in MiB (default: 1024)
+    pdf_cache_ttl_seconds     Seconds an entry is served before revalidation (default: 300)
+    pdf_cache_max_object_mb   Largest document that is cached (default: 32)
+"""
+import threading
+import time
+
+from cache import ByteLRU, DiskStore
+
+
+class DocumentCache(object):
+    """
+    Memory + disk cache of PDF bytes with ETag revalidation.
+    """
+    def __init__(self, directory=".pdf_cache", memory_bytes=64 * 1024 * 1024, disk_bytes=1024 * 1024 * 1024,
+                 ttl=300, max_object_bytes=32 * 1024 * 1024):
+        """
+        Args:
+            directory (str): On-disk store directory
+            memory_bytes (int): Memory LRU budget
+            disk_bytes (int): Disk store budget
+            ttl (float): Seconds an entry is served before it must be revalidated
+            max_object_bytes (int): Documents larger than this are not cached
+        """
+        self.ttl = ttl
+        self.max_object_bytes = max_object_bytes
+        self.memory = ByteLRU(memory_bytes)
+        self.disk = DiskStore(directory, disk_bytes)
+        self._lock = threading.Lock()
+        self._counters = {"memory_hits": 0, "disk_hits": 0, "stale": 0, "misses": 0,
+                          "revalidated": 0, "stored": 0, "too_large": 0}
+
+    @classmethod
+    def from_config(cls, config):
+        """Build a cache from the optional pdf_cache_* keys in config.json."""
+        return cls(
+            directory=config.get("pdf_cache_dir", ".pdf_cache"),
+            memory_bytes=int(config.get("pdf_cache_memory_mb", 64) * 1024 * 1024),
+            disk_bytes=int(config.get("pdf_cache_disk_mb", 1024) * 1024 * 1024),
+            ttl=config.get("pdf_cache_ttl_seconds", 300),
+            max_object_bytes=int(config.get("pdf_cache_max_object_mb", 32) * 1024 * 1024)
+        )
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def cacheable(self, size):
+        """Whether a document of ``size`` bytes fits the per-object limit."""
+        return size is not None and size <= self.max_object_bytes
+
+    def get(self, key):
+        """
+        Look up a document.
+
+        Returns:
+            tuple: (entry, fresh) where entry is a dict with data, etag, last_modified
+                and expires_at, or (None, False) on a miss. A stale entry must be
+                revalidated before it is served.
+        """
+        now = time.time()
+        entry = self.memory.get(key)
+        if entry is None:
+            meta, data = self.disk.get(key)
+            if meta is None:
+                self._count("misses")
+                return None, False
+            entry = {"data": data, "etag": meta.get("etag"), "last_modified": meta.get("last_modified"),
+                     "expires_at": meta.get("expires_at", 0)}
+            if entry["expires_at"] > now:
+                self.memory.put(key, entry, size=len(data))
+                self._count("disk_hits")
+                return entry, True
+        elif entry["expires_at"] > now:
+            self._count("memory_hits")
+            return entry, True
+        self._count("stale")
+        return entry, False
+
+    def put(self, key, data, etag=None, last_modified=None):
+        """
+        Store a freshly uploaded or downloaded document.
+
+        Returns:
+            dict: The cache entry, or None if the document is too large to cache
+        """
+        if not self.cacheable(len(data)):
+            self._count("too_large")
+            self.delete(key)
+            return None
+        expires_at = time.time() + self.ttl
+        self.disk.put(key, data, {"etag": etag, "last_modified": last_modified, "expires_at": expires_at})
+        entry = {"data": data, "etag": etag, "last_modified": last_modified, "expires_at": expires_at}
+        self.memory.put(key, entry, size=len(data))
+        self._count("stored")
+        return entry
+
+    def refresh(self, key, entry):
+        """Mark a stale entry as valid for another TTL after the origin answered 304."""
+        entry = dict(entry, expires_at=time.time() + self.ttl)
+        self.disk.update_meta(key, expires_at=entry["expires_at"])
+        self.memory.put(key, entry, size=len(entry["data"]))
+        self._count("revalidated")
+        return entry
+
+    def delete(self, key):
+        self.memory.pop(key)
+        self.disk.delete(key)
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+        counters["hits"] = counters["memory_hits"] + counters["disk_hits"] + counters["revalidated"]
+        counters["memory"] = self.memory.stats()
+        counters["disk"] = self.disk.stats()
+        return counters
@@ -0,0 +1,153 @@
+"""
+executors.py
+
+This module moves blocking work (PDF rendering, SMTP, object storage, remote
+image fetching and the CPU work of preparing letters and emails) off the asyncio
+event loop. Every kind of blocking work runs on
+its own bounded thread pool, so a slow SMTP server can only exhaust the "mail"
+stage and never the event loop or the other stages.
+
+Each stage admits at most ``workers + max_pending`` calls at a time. Once that
+limit is reached new calls fail fast with StageSaturated, which the API turns
+into a 503 so callers back off instead of piling up.
+
+Classes:
+    Stage: A bounded executor for one kind of blocking work.
+    StageSaturated: Raised when a stage has no room for another call.
+
+Configuration (config.json, optional):
+    "executor_stages": {
+        "render":  {"workers": 4,  "max_pending": 16},
+        "mail":    {"workers": 8,  "max_pending": 32},
+        "storage": {"workers": 8,  "max_pending": 32},
+        "fetch":   {"workers": 16, "max_pending": 64},
+        "prepare": {"workers": 4,  "max_pending": 32}
+    }
+"""
+import asyncio
+import contextvars
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+DEFAULT_STAGE_LIMITS = {
+    "render": {"workers": 4, "max_pending": 16},
+    "mail": {"workers": 8, "max_pending": 32},
+    "storage": {"workers": 8, "max_pending": 32},
+    "fetch": {"workers": 16, "max_pending": 64},
+    # Template filling, HTML normalization, attachment decoding and email assembly
+    "prepare": {"workers": 4, "max_pending": 32},
+}
+
+
+class StageSaturated(Exception):
+    """Raised when a stage already has as many calls in flight as it admits."""
+    def __init__(self, stage):
+        super().__init__(f"The '{stage}' stage is saturated, try again later")
+        self.stage = stage
+
+
+class Stage(object):
+    """
+    A thread pool with a hard admission limit.
+    """
+    def __init__(self, name, workers, max_pending=0):
+        """
+        Args:
+            name (str): Stage name used in errors and stats
+            workers (int): Threads running calls concurrently
+            max_pending (int): Calls allowed to wait for a free thread
+        """
+        self.name = name
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"stage-{name}")
+        self._slots = threading.BoundedSemaphore(workers + max_pending)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._rejected = 0
+
+    def _release(self, _future=None):
+        with self._lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Schedule a blocking call on this stage.
+
+        Returns:
+            concurrent.futures.Future: Future for the call result
+
+        Raises:
+            StageSaturated: If the stage has no admission slot left
+        """
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            raise StageSaturated(self.name)
+        with self._lock:
+            self._in_flight += 1
+        try:
+            future = self._executor.submit(fn, *args, **kwargs)
+        except Exception:
+            self._release()
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    async def run(self, fn, *args, **kwargs):
+        """Await a blocking call executed on this stage."""
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "max_pending": self.max_pending,
+                "in_flight": self._in_flight,
+                "rejected": self._rejected
+            }
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+
+class StageExecutors(object):
+    """
+    Registry of the named stages used by the API.
+    """
+    def __init__(self, limits=None):
+        """
+        Args:
+            limits (dict): Per-stage overrides of DEFAULT_STAGE_LIMITS
+        """
+        merged = {name: dict(values) for name, values in DEFAULT_STAGE_LIMITS.items()}
+        for name, values in (limits or {}).items():
+            merged.setdefault(name, {"workers": 1, "max_pending": 0}).update(values)
+        self._stages = {
+            name: Stage(name, values["workers"], values.get("max_pending", 0))
+            for name, values in merged.items()
+        }
+
+    def __getitem__(self, name):
+        return self._stages[name]
+
+    async def run(self, stage, fn, *args, **kwargs):
+        """
+        Run ``fn(*args, **kwargs)`` on the named stage and await the result.
+
+        Raises:
+            StageSaturated: If the stage cannot admit another call
+        """
+        # Run in a copy of the caller's context so the request's trace follows the call
+        context = contextvars.copy_context()
+        return await self._stages[stage].run(context.run, functools.partial(fn, *args, **kwargs))
+
+    def stats(self):
+        return {name: stage.stats() for name, stage in self._stages.items()}
+
+    def shutdown(self, wait=True):
+        for stage in self._stages.values():
+            stage.shutdown(wait=wait)
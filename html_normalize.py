@@ -0,0 +1,170 @@
+"""
+html_normalize.py
+
+This module prepares HTML fragments (the notes of a request) for the letter template
+in one linear pass over the text. A single tokenizer walks the fragment once and, as
+it goes:
+
+    - drops <p> and </p> tags (with or without attributes), keeping every other tag
+    - collapses each run of whitespace into one space and trims both ends
+    - collects the http(s) URLs of <img src=...> and marks where each src value sits,
+      so the data URIs can be put in later without searching the text again
+
+Only what needs changing becomes a token: runs of paragraph tags and whitespace
+(other than a lone space between words) and <img> tags. The text between tokens,
+which is most of a fragment, is skipped by the regex engine's search loop and
+copied by slicing.
+
+The result is a NormalizedHTML: literal text plus image slots. ``render(data_uris)``
+joins it into the final HTML, with every image that was downloaded replaced by its
+data URI and the others left as they were.
+
+Malformed HTML is passed through rather than rejected: a tag ends at the first '>'
+and never spans a '<', so a stray '<', an unterminated tag or an unbalanced quote is
+copied as text and cannot make the tokenizer rescan the rest of the fragment. No tag
+nesting is tracked, so the work stays linear in the length of the input.
+
+Classes:
+    NormalizedHTML: Normalized fragment with image slots, rendered with data URIs.
+
+Functions:
+    normalize_html: Tokenize a fragment once, optionally stripping <p> tags and whitespace.
+"""
+import re
+
+
+_PARAGRAPH_TAG = r'(?:<p\b[^<>]*>|</p>)'
+
+
+def _token_pattern(strip_paragraphs, collapse_whitespace):
+    """
+    Compile the tokenizer for one combination of options.
+
+    Every token starts with '<' or a whitespace character and the pattern starts
+    with that character class, so the regex engine skips plain text in its C
+    search loop. Token kinds, by the group that is set:
+        img            an <img> tag
+        run / spaces   whitespace, possibly mixed with paragraph tags -> one space
+                       (starting with a paragraph tag / with whitespace)
+        none           paragraph tags only -> removed
+    """
+    tag_rest = [r'(?P<img>img\s[^<>]*>)']
+    space_rest = []
+    if strip_paragraphs:
+        tags = r'(?:/p>|p\b[^<>]*>)' + _PARAGRAPH_TAG + '*'
+        if collapse_whitespace:
+            tags += r'(?P<run>\s(?:\s|' + _PARAGRAPH_TAG + r')*)?'
+        tag_rest.append(tags)
+    if collapse_whitespace:
+        body = r'(?:\s|' + _PARAGRAPH_TAG + r')*' if strip_paragraphs else r'\s*'
+        ahead = r'(?=\s|' + _PARAGRAPH_TAG + r')' if strip_paragraphs else r'(?=\s)'
+        # A lone space between words is left alone; anything longer or other than ' ' is a run
+        space_rest.append(r'(?P<spaces>(?:(?<= )' + ahead + r'|(?<=[^\S ]))' + body + r')')
+    pattern = r'(?<=<)(?:' + '|'.join(tag_rest) + r')'
+    if space_rest:
+        pattern = r'[<\s](?:' + pattern + '|(?<=\s)' + space_rest[0] + r')'
+    else:
+        pattern = '<' + pattern
+    return re.compile(pattern, re.IGNORECASE)
+
+
+_TOKENS = {(strip, collapse): _token_pattern(strip, collapse) for strip in (True, False) for collapse in (True, False)}
+_SRC_ATTRIBUTE = re.compile(r'''\ssrc\s*=\s*("[^"]*"|'[^']*'|[^\s"'>]+)''', re.IGNORECASE)
+
+
+class NormalizedHTML(object):
+    """
+    HTML fragment as literal text and image slots.
+
+    ``parts`` alternates between text and (url, original src value) slots;
+    ``image_urls`` lists the http(s) image URLs in document order.
+    """
+    __slots__ = ("parts", "image_urls")
+
+    def __init__(self, parts, image_urls):
+        self.parts = parts
+        self.image_urls = image_urls
+
+    def render(self, data_uris=None):
+        """
+        Join the fragment, replacing the src of every image found in data_uris.
+
+        Args:
+            data_uris (dict): url -> data URI; missing or None keeps the original src
+
+        Returns:
+            str: The HTML fragment
+        """
+        if not self.image_urls:
+            return "".join(self.parts)
+        data_uris = data_uris or {}
+        pieces = []
+        for part in self.parts:
+            if isinstance(part, tuple):
+                url, original = part
+                data_uri = data_uris.get(url)
+                pieces.append(f'"{data_uri}"' if data_uri else original)
+            else:
+                pieces.append(part)
+        return "".join(pieces)
+
+    def __str__(self):
+        return self.render()
+
+
+def normalize_html(html_content, strip_paragraphs=True, collapse_whitespace=True):
+    """
+    Tokenize an HTML fragment once.
+
+    Args:
+        html_content (str): HTML fragment
+        strip_paragraphs (bool): Drop every <p> and </p> tag
+        collapse_whitespace (bool): Turn every whitespace run into one space (inside
+            tags too) and trim the ends
+
+    Returns:
+        NormalizedHTML: The normalized fragment with its image slots
+    """
+    if not html_content:
+        return NormalizedHTML([html_content or ""], [])
+
+    pattern = _TOKENS[strip_paragraphs, collapse_whitespace]
+    # split() returns the text between tokens followed by each token's groups:
+    # text, img, [run, [spaces]], text, img, ...
+    pieces = pattern.split(html_content)
+    stride = pattern.groups + 1
+    images = pieces[1::stride]
+    if stride == 4:
+        runs = [run if run is not None else spaces for run, spaces in zip(pieces[2::4], pieces[3::4])]
+    else:
+        runs = pieces[2::stride] if stride == 3 else images
+    # Runs become one space, paragraph tags nothing; the img slots are filled below
+    out = [None] * (2 * len(images) + 1)
+    out[::2] = pieces[::stride]
+    out[1::2] = [" " if run is not None else "" for run in runs]
+
+    parts, image_urls, start = [], [], 0
+    for index in [index for index, tag in enumerate(images) if tag is not None]:
+        # The group starts after the '<' the pattern consumed
+        tag = '<' + images[index]
+        if collapse_whitespace:
+            tag = " ".join(tag.split())
+        position = 2 * index + 1
+        src = _SRC_ATTRIBUTE.search(tag)
+        value = src.group(1) if src else ""
+        url = value[1:-1] if value[:1] in ("'", '"') else value
+        if not (url.startswith('http://') or url.startswith('https://')):
+            out[position] = tag
+            continue
+        out[position] = tag[:src.start(1)]
+        parts.append("".join(out[start:position + 1]))
+        parts.append((url, value))
+        image_urls.append(url)
+        out[position] = tag[src.end(1):]
+        start = position
+    parts.append("".join(out[start:]))
+
+    if collapse_whitespace:
+        parts[0] = parts[0].lstrip()
+        parts[-1] = parts[-1].rstrip()
+    return NormalizedHTML(parts, image_urls)
@@ -0,0 +1,192 @@
+"""
+idempotency.py
+
+Building blocks that keep retried approvals from doing the same work twice:
+
+    payload_hash  - SHA-256 of a normalized request payload; together with the
+                    request_id it identifies one approval (the outbox stores it
+                    with the job, so a retry is answered with the existing job)
+    text_sha256   - SHA-256 of a large string field hashed in slices, to stand in
+                    for it in payload_hash
+    SingleFlight  - collapses concurrent calls with the same key into one
+                    execution whose result every caller receives
+    RenderCache   - rendered PDFs keyed by the SHA-256 of the filled HTML, so a
+                    letter whose HTML was already rendered is not rendered again
+
+Classes:
+    SingleFlight: In-flight de-duplication of coroutines by key.
+    RenderCache: Memory + disk cache of PDFs keyed by their HTML.
+
+Configuration (config.json, optional):
+    render_cache_dir        On-disk store directory (default: .render_cache)
+    render_cache_memory_mb  Memory LRU budget in MiB (default: 32)
+    render_cache_disk_mb    Disk store budget in MiB (default: 256)
+"""
+import asyncio
+import hashlib
+import json
+import threading
+
+from cache import ByteLRU, DiskStore
+
+
+def _normalize(value):
+    if isinstance(value, str):
+        return value.strip()
+    if isinstance(value, dict):
+        return {key: _normalize(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(item) for item in value]
+    return value
+
+
+def payload_hash(payload):
+    """
+    Hash a JSON-like payload independently of key order and surrounding whitespace.
+
+    Args:
+        payload (dict): Request payload
+
+    Returns:
+        str: Hex SHA-256 of the canonical JSON form
+    """
+    canonical = json.dumps(_normalize(payload), sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def text_sha256(text, chunk_chars=1024 * 1024):
+    """
+    Hex SHA-256 of a string's UTF-8 form, encoded a slice at a time so a large
+    field (e.g. base64 file_data) is never copied whole.
+    """
+    digest = hashlib.sha256()
+    for start in range(0, len(text), chunk_chars):
+        digest.update(text[start:start + chunk_chars].encode('utf-8'))
+    return digest.hexdigest()
+
+
+class SingleFlight(object):
+    """
+    Runs at most one coroutine per key at a time; callers that arrive while it runs
+    wait for it and get its result (or exception) instead of running their own. If
+    the running coroutine is cancelled (its client went away), the waiters run the
+    work again themselves, one of them at a time. Must be used from a single event loop.
+    """
+    def __init__(self):
+        self._inflight = {}
+        self.executions = 0
+        self.collapsed = 0
+
+    async def run(self, key, produce):
+        """
+        Args:
+            key: Hashable identity of the work
+            produce: Zero-argument coroutine function doing the work
+
+        Returns:
+            tuple: (result, shared) where shared is True if another caller's execution was reused
+        """
+        future = self._inflight.get(key)
+        if future is not None:
+            self.collapsed += 1
+            try:
+                # shield: a caller that disconnects must not cancel the shared execution
+                return await asyncio.shield(future), True
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    # This caller was cancelled, not the shared execution
+                    raise
+            # The owner was cancelled; the first waiter to get here runs the work, the others wait for it
+            return await self.run(key, produce)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        self.executions += 1
+        try:
+            result = await produce()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # retrieved here, so an unwaited future does not log it
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+
+    def stats(self):
+        return {"in_flight": len(self._inflight), "executions": self.executions, "collapsed": self.collapsed}
+
+
+class RenderCache(object):
+    """
+    PDFs keyed by the SHA-256 of the HTML they were rendered from, in memory and on disk.
+    """
+    def __init__(self, directory=".render_cache", memory_bytes=32 * 1024 * 1024, disk_bytes=256 * 1024 * 1024):
+        """
+        Args:
+            directory (str): On-disk store directory
+            memory_bytes (int): Memory LRU budget
+            disk_bytes (int): Disk store budget
+        """
+        self.memory = ByteLRU(memory_bytes)
+        self.disk = DiskStore(directory, disk_bytes)
+        self._lock = threading.Lock()
+        self._counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stored": 0}
+
+    @classmethod
+    def from_config(cls, config):
+        """Build a cache from the optional render_cache_* keys in config.json."""
+        return cls(
+            directory=config.get("render_cache_dir", ".render_cache"),
+            memory_bytes=int(config.get("render_cache_memory_mb", 32) * 1024 * 1024),
+            disk_bytes=int(config.get("render_cache_disk_mb", 256) * 1024 * 1024)
+        )
+
+    @staticmethod
+    def key(html_content, backend=None):
+        """
+        Cache key of the filled HTML. PDFs of render backends other than wkhtmltopdf
+        are kept apart; wkhtmltopdf keeps the keys it had before backends existed.
+        """
+        digest = hashlib.sha256(html_content.encode('utf-8'))
+        if backend and backend != "wkhtmltopdf":
+            digest.update(b"\0" + backend.encode('utf-8'))
+        return digest.hexdigest()
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def get(self, key):
+        """
+        Returns:
+            bytes: The PDF rendered from the HTML with this key, or None
+        """
+        pdf_data = self.memory.get(key)
+        if pdf_data is not None:
+            self._count("memory_hits")
+            return pdf_data
+        _, pdf_data = self.disk.get(key)
+        if pdf_data is not None:
+            self._count("disk_hits")
+            self.memory.put(key, pdf_data)
+            return pdf_data
+        self._count("misses")
+        return None
+
+    def put(self, key, pdf_data):
+        self.memory.put(key, pdf_data)
+        self.disk.put(key, pdf_data)
+        self._count("stored")
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+        counters["memory"] = self.memory.stats()
+        counters["disk"] = self.disk.stats()
+        return counters
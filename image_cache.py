@@ -0,0 +1,205 @@
+"""
+image_cache.py
+
+This module caches the remote images that are inlined into letters as base64 data
+URIs. The same logos and stamps appear in many ``notes_on_request`` payloads, so
+they are kept in two levels:
+
+    memory  - ready-to-embed data URIs in a byte-bounded LRU
+    disk    - raw image bytes in a content-addressed DiskStore, surviving restarts
+
+Entries stay fresh for the response's Cache-Control max-age (or a default TTL) and
+are then revalidated with If-None-Match / If-Modified-Since, so an unchanged image
+costs a 304 instead of a full download. URLs that fail are negatively cached for a
+short time so a dead image host is not hit on every request.
+
+Classes:
+    ImageCache: Two-level cache for remote images keyed by URL.
+
+Configuration (config.json, optional):
+    image_cache_dir                   On-disk store directory (default: .image_cache)
+    image_cache_memory_mb             Memory LRU budget in MiB (default: 64)
+    image_cache_disk_mb               Disk store budget in MiB (default: 512)
+    image_cache_ttl_seconds           Freshness when the server sends no max-age (default: 3600)
+    image_cache_negative_ttl_seconds  How long a failed URL is not retried (default: 60)
+"""
+import base64
+import re
+import threading
+import time
+
+import requests
+
+from cache import ByteLRU, DiskStore
+
+
+_MAX_AGE_PATTERN = re.compile(r'max-age\s*=\s*(\d+)', re.IGNORECASE)
+
+
+class ImageFetchError(Exception):
+    """Raised when an image cannot be downloaded, or the URL is negatively cached."""
+
+
+class ImageCache(object):
+    """
+    Memory + disk cache of remote images with HTTP revalidation.
+    """
+    def __init__(self, directory=".image_cache", memory_bytes=64 * 1024 * 1024, disk_bytes=512 * 1024 * 1024,
+                 default_ttl=3600, negative_ttl=60, max_negative_entries=10000):
+        """
+        Args:
+            directory (str): On-disk store directory
+            memory_bytes (int): Memory LRU budget for data URIs
+            disk_bytes (int): Disk store budget for image bytes
+            default_ttl (float): Seconds an image is fresh when the server sends no max-age
+            negative_ttl (float): Seconds a failed URL is answered from the negative cache
+            max_negative_entries (int): Maximum failed URLs remembered at once
+        """
+        self.default_ttl = default_ttl
+        self.negative_ttl = negative_ttl
+        self.memory = ByteLRU(memory_bytes)
+        self.disk = DiskStore(directory, disk_bytes)
+        self._negative = ByteLRU(max_negative_entries)
+        self._lock = threading.Lock()
+        self._counters = {"memory_hits": 0, "disk_hits": 0, "revalidated": 0, "downloads": 0,
+                          "negative_hits": 0, "failures": 0}
+
+    @classmethod
+    def from_config(cls, config):
+        """Build a cache from the optional image_cache_* keys in config.json."""
+        return cls(
+            directory=config.get("image_cache_dir", ".image_cache"),
+            memory_bytes=int(config.get("image_cache_memory_mb", 64) * 1024 * 1024),
+            disk_bytes=int(config.get("image_cache_disk_mb", 512) * 1024 * 1024),
+            default_ttl=config.get("image_cache_ttl_seconds", 3600),
+            negative_ttl=config.get("image_cache_negative_ttl_seconds", 60)
+        )
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def _freshness(self, headers):
+        match = _MAX_AGE_PATTERN.search(headers.get('cache-control', ''))
+        if match:
+            return int(match.group(1))
+        return self.default_ttl
+
+    @staticmethod
+    def _data_uri(content_type, data):
+        return f"data:{content_type};base64,{base64.b64encode(data).decode('utf-8')}"
+
+    def _remember(self, url, entry):
+        self.memory.put(url, entry, size=len(entry["data_uri"]))
+
+    def get_data_uri(self, url, timeout=20, session=None, headers=None, max_bytes=None):
+        """
+        Return the image at ``url`` as a base64 data URI.
+
+        Args:
+            url (str): Image URL
+            timeout (float): Request timeout in seconds for a download or revalidation
+            session: requests.Session to use, a plain requests call if None
+            headers (dict): Extra request headers
+            max_bytes (int): Reject images larger than this many bytes
+
+        Returns:
+            str: ``data:<content-type>;base64,...``
+
+        Raises:
+            ImageFetchError: If the image cannot be fetched or failed recently
+        """
+        now = time.time()
+        entry = self.memory.get(url)
+        if entry is not None and entry["expires_at"] > now:
+            self._count("memory_hits")
+            return entry["data_uri"]
+
+        failed_until = self._negative.get(url)
+        if failed_until is not None and failed_until > now:
+            self._count("negative_hits")
+            raise ImageFetchError(f"Recent fetch of {url} failed, retrying after the negative cache TTL")
+
+        meta, data = self.disk.get(url)
+        if meta is not None and meta.get("expires_at", 0) > now:
+            entry = {"data_uri": self._data_uri(meta["content_type"], data), "expires_at": meta["expires_at"]}
+            self._remember(url, entry)
+            self._count("disk_hits")
+            return entry["data_uri"]
+
+        return self._fetch(url, meta, data, timeout, session, headers, max_bytes)
+
+    @staticmethod
+    def _read_limited(response, max_bytes):
+        """Read a streamed response body, giving up as soon as it exceeds max_bytes."""
+        declared = response.headers.get('content-length')
+        if declared and declared.isdigit() and int(declared) > max_bytes:
+            response.close()
+            raise ImageFetchError(f"Image is {declared} bytes, limit is {max_bytes}")
+        chunks, received = [], 0
+        for chunk in response.iter_content(64 * 1024):
+            received += len(chunk)
+            if received > max_bytes:
+                response.close()
+                raise ImageFetchError(f"Image exceeds the {max_bytes} byte limit")
+            chunks.append(chunk)
+        return b''.join(chunks)
+
+    def _fetch(self, url, meta, data, timeout, session, headers, max_bytes):
+        request_headers = {'User-Agent': 'Mozilla/5.0'}
+        request_headers.update(headers or {})
+        if meta is not None:
+            if meta.get("etag"):
+                request_headers['If-None-Match'] = meta["etag"]
+            if meta.get("last_modified"):
+                request_headers['If-Modified-Since'] = meta["last_modified"]
+
+        try:
+            response = (session or requests).get(url, timeout=timeout, headers=request_headers,
+                                                 stream=max_bytes is not None)
+            if response.status_code == 304 and meta is not None:
+                response.close()
+                expires_at = time.time() + self._freshness(response.headers)
+                self.disk.update_meta(url, expires_at=expires_at)
+                entry = {"data_uri": self._data_uri(meta["content_type"], data), "expires_at": expires_at}
+                self._remember(url, entry)
+                self._count("revalidated")
+                return entry["data_uri"]
+            response.raise_for_status()
+            content = self._read_limited(response, max_bytes) if max_bytes is not None else response.content
+        except Exception as e:
+            self._negative.put(url, time.time() + self.negative_ttl, size=1)
+            self._count("failures")
+            raise ImageFetchError(f"Failed to fetch image {url}: {e}")
+
+        return self.store(url, content, response.headers)
+
+    def store(self, url, content, response_headers):
+        """
+        Cache freshly downloaded image bytes and return their data URI.
+
+        Args:
+            url (str): Image URL
+            content (bytes): Image bytes
+            response_headers: Response headers (content-type, etag, last-modified, cache-control)
+        """
+        content_type = response_headers.get('content-type', 'image/png')
+        expires_at = time.time() + self._freshness(response_headers)
+        self.disk.put(url, content, {
+            "content_type": content_type,
+            "etag": response_headers.get('etag'),
+            "last_modified": response_headers.get('last-modified'),
+            "expires_at": expires_at
+        })
+        self._negative.pop(url)
+        entry = {"data_uri": self._data_uri(content_type, content), "expires_at": expires_at}
+        self._remember(url, entry)
+        self._count("downloads")
+        return entry["data_uri"]
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+        counters["memory"] = self.memory.stats()
+        counters["disk"] = self.disk.stats()
+        return counters
@@ -0,0 +1,145 @@
+"""
+image_fetch.py
+
+This module downloads the remote images referenced by a piece of HTML concurrently,
+through one pooled keep-alive ``requests.Session`` shared by the whole process.
+
+Fetches are capped per host so one note full of images cannot flood a single image
+server, bounded by a total deadline so a slow host cannot hold a request hostage,
+and limited in size so an oversized image is skipped rather than inlined.
+
+Classes:
+    ImageFetcher: Concurrent, cache-aware image downloader.
+
+Configuration (config.json, optional):
+    image_fetch_workers           Concurrent downloads across all hosts (default: 8)
+    image_fetch_per_host          Concurrent downloads per host (default: 4)
+    image_fetch_deadline_seconds  Total time allowed for all images of one document (default: 20)
+    image_fetch_max_bytes         Largest image that is inlined (default: 5 MiB)
+"""
+import contextvars
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+
+class ImageFetcher(object):
+    """
+    Fetches many image URLs at once and returns their data URIs.
+    """
+    def __init__(self, image_cache, workers=8, per_host=4, deadline=20, max_bytes=5 * 1024 * 1024):
+        """
+        Args:
+            image_cache (ImageCache): Cache consulted before, and filled after, each download
+            workers (int): Concurrent downloads across all hosts
+            per_host (int): Concurrent downloads per host
+            deadline (float): Seconds allowed for all images of one fetch_all call
+            max_bytes (int): Largest image accepted
+        """
+        self.image_cache = image_cache
+        self.per_host = per_host
+        self.deadline = deadline
+        self.max_bytes = max_bytes
+
+        self.session = requests.Session()
+        self.session.headers['User-Agent'] = 'Mozilla/5.0'
+        adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="image-fetch")
+        self._host_slots = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config, image_cache):
+        """Build a fetcher from the optional image_fetch_* keys in config.json."""
+        return cls(
+            image_cache,
+            workers=config.get("image_fetch_workers", 8),
+            per_host=config.get("image_fetch_per_host", 4),
+            deadline=config.get("image_fetch_deadline_seconds", 20),
+            max_bytes=config.get("image_fetch_max_bytes", 5 * 1024 * 1024)
+        )
+
+    def _host_slot(self, url):
+        host = urlsplit(url).netloc.lower()
+        with self._lock:
+            slot = self._host_slots.get(host)
+            if slot is None:
+                slot = self._host_slots[host] = threading.BoundedSemaphore(self.per_host)
+            return slot
+
+    def fetch(self, url, deadline_at=None, timeout=None):
+        """
+        Fetch one image, waiting for a per-host slot.
+
+        Args:
+            url (str): Image URL
+            deadline_at (float): time.monotonic() value after which the fetch is abandoned
+            timeout (float): Request timeout, defaults to the time left until the deadline
+
+        Returns:
+            str: Base64 data URI
+
+        Raises:
+            ImageFetchError / TimeoutError: If the image cannot be fetched in time
+        """
+        if deadline_at is None:
+            deadline_at = time.monotonic() + (timeout or self.deadline)
+        slot = self._host_slot(url)
+        if not slot.acquire(timeout=max(0.0, deadline_at - time.monotonic())):
+            raise TimeoutError(f"No connection slot for {url} before the deadline")
+        try:
+            remaining = deadline_at - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f"Deadline passed before fetching {url}")
+            with metrics.stage("image_fetch"):
+                return self.image_cache.get_data_uri(url, timeout=min(remaining, timeout or remaining),
+                                                     session=self.session, max_bytes=self.max_bytes)
+        finally:
+            slot.release()
+
+    def fetch_all(self, urls):
+        """
+        Fetch every URL concurrently within the total deadline.
+
+        Args:
+            urls (iterable): Image URLs; duplicates are fetched once
+
+        Returns:
+            dict: url -> data URI, or None for images that failed or missed the deadline
+        """
+        unique_urls = list(dict.fromkeys(urls))
+        if not unique_urls:
+            return {}
+
+        deadline_at = time.monotonic() + self.deadline
+        # Each fetch runs in its own copy of the caller's context so it joins the request's trace
+        futures = {self._executor.submit(contextvars.copy_context().run, self.fetch, url, deadline_at): url
+                   for url in unique_urls}
+        done, not_done = wait(futures, timeout=self.deadline)
+
+        results = {}
+        for future, url in futures.items():
+            if future in not_done:
+                future.cancel()
+                print(f"Image fetch missed the deadline, keeping original URL: {url}")
+                results[url] = None
+                continue
+            try:
+                results[url] = future.result()
+            except Exception as e:
+                print(f"Error converting image URL to base64: {str(e)}")
+                results[url] = None
+        return results
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        self.session.close()
@@ -0,0 +1,347 @@
+"""
+letterhead.py
+
+This module renders letters as a cached letterhead with the per-letter fields stamped
+onto it, instead of laying out the whole letter template for every request.
+
+Most of the letter template (CSS, headers, table scaffolding, the signature block) is
+the same from one letter to the next. Only a few fields change every time: the table
+values, the subject and the notes. For those "stamped" fields the template is filled
+with an empty box of a fixed size, an ``<a href="letterhead-slot:<field>">`` element,
+and every other field with its value. That background is rendered once by the full
+HTML renderer and cached, keyed by the hash of its HTML, so there is one background
+per combination of the remaining fields (transaction type, book language, signatory).
+The link annotations the renderer makes for the boxes give their position on the page
+and are then removed from the background.
+
+Each letter lays out only its stamped fields with PyMuPDF's HTML engine, each inside
+the same element chain and CSS the template puts it in, and draws them into their
+boxes on a copy of the background. A value that does not fit its box (a long note,
+a long name in a table cell) makes ``render`` return None, and the caller falls back
+to rendering the full HTML. So does a background whose boxes could not be found.
+
+Stamped text is laid out by MuPDF, not by the renderer that drew the background, so
+font fallback may differ slightly from a full render. PyMuPDF is not thread-safe: one
+letter is stamped at a time per process.
+
+Classes:
+    Letterhead: Cached background PDF with the position of each stamped field.
+    LetterheadRenderer: Renders letters from cached letterheads.
+
+Dependencies:
+    - PyMuPDF (imported only in overlay mode)
+
+Configuration (config.json, optional):
+    letter_render_mode   "full" (default) renders every letter from its HTML;
+                         "overlay" stamps the fields onto a cached letterhead
+    letterhead_slots     Stamped fields and their boxes: {"field": [css width, height px]};
+                         replaces the default set when given
+    letterhead_cache_mb  Memory budget of cached letterheads (default: 16)
+"""
+import hashlib
+import html
+import io
+import threading
+from html.parser import HTMLParser
+
+import metrics
+from cache import ByteLRU
+
+
+SLOT_SCHEME = "letterhead-slot:"
+
+# Stamped fields of template.txt: CSS width of the box and its height in CSS px.
+# The table values get one line at 15px, the subject one line at 48px.
+DEFAULT_SLOTS = {
+    "approval_type": ("130px", 20),
+    "transaction_status": ("130px", 20),
+    "transaction_creator": ("130px", 20),
+    "receiver": ("130px", 20),
+    "transaction_date": ("130px", 20),
+    "sender": ("130px", 20),
+    "confidentiality": ("130px", 20),
+    "subject": ("100%", 64),
+    "l1": ("100%", 420)
+}
+
+# The element a stamped field is laid out in starts at the nearest of these ancestors
+_BLOCK_TAGS = frozenset(("p", "div", "td", "th", "li", "h1", "h2", "h3", "h4", "h5", "h6", "body"))
+_VOID_TAGS = frozenset(("area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "wbr"))
+_KEPT_ATTRIBUTES = ("class", "dir", "style")
+
+_pymupdf = None
+# PyMuPDF is not thread-safe, and holds the GIL while it works anyway
+_pymupdf_lock = threading.Lock()
+
+
+def _import_pymupdf():
+    global _pymupdf
+    if _pymupdf is None:
+        import pymupdf
+        _pymupdf = pymupdf
+    return _pymupdf
+
+
+class _SlotContext(HTMLParser):
+    """
+    Collects the text of the <style> elements and the open elements around each slot box.
+    """
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.css = []
+        self.ancestors = {}
+        self._stack = []
+        self._in_style = False
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        href = attrs.get("href") or ""
+        if tag == "a" and href.startswith(SLOT_SCHEME):
+            self.ancestors[href[len(SLOT_SCHEME):]] = list(self._stack)
+        if tag == "style":
+            self._in_style = True
+        if tag not in _VOID_TAGS:
+            self._stack.append((tag, attrs))
+
+    def handle_endtag(self, tag):
+        if tag == "style":
+            self._in_style = False
+        # Close up to the matching element; an end tag without one is ignored
+        for index in range(len(self._stack) - 1, -1, -1):
+            if self._stack[index][0] == tag:
+                del self._stack[index:]
+                break
+
+    def handle_data(self, data):
+        if self._in_style:
+            self.css.append(data)
+
+
+def _wrapper(ancestors):
+    """
+    Opening and closing tags that put a stamped value in the same element chain as the
+    template, from its nearest block ancestor down. The outer block becomes a <div>
+    without margin or padding: those are already part of the background.
+    """
+    start = max((index for index, (tag, _) in enumerate(ancestors) if tag in _BLOCK_TAGS), default=0)
+    opening, closing = [], []
+    for depth, (tag, attrs) in enumerate(ancestors[start:]):
+        kept = {name: attrs[name] for name in _KEPT_ATTRIBUTES if attrs.get(name)}
+        if depth == 0:
+            tag = "div"
+            kept["style"] = "; ".join(filter(None, (kept.get("style", "").rstrip("; "), "margin: 0; padding: 0")))
+        elif tag in _BLOCK_TAGS:
+            tag = "div"
+        opening.append(f"<{tag}" + "".join(f' {name}="{html.escape(value)}"' for name, value in kept.items()) + ">")
+        closing.append(f"</{tag}>")
+    return "".join(opening), "".join(reversed(closing))
+
+
+class Letterhead(object):
+    """
+    Background PDF of one letterhead and where its stamped fields go.
+
+    ``pages`` lists, per page with boxes, (page number, page size in CSS px,
+    [(field, box in CSS px)]): the fields of a page are laid out together on one
+    page of that size, which is then scaled onto the background page.
+    ``wrappers`` maps a field to the opening and closing tags its value is laid out in.
+    """
+    __slots__ = ("pdf", "pages", "wrappers", "css")
+
+    def __init__(self, pdf, pages, wrappers, css):
+        self.pdf = pdf
+        self.pages = pages
+        self.wrappers = wrappers
+        self.css = css
+
+
+class LetterheadRenderer(object):
+    """
+    Renders letters by stamping their changing fields onto a cached letterhead.
+    """
+    def __init__(self, render_html, slots=None, cache_bytes=16 * 1024 * 1024):
+        """
+        Args:
+            render_html (callable): Full HTML to PDF renderer used for the backgrounds;
+                returns the PDF bytes, or None if rendering failed
+            slots (dict): Stamped fields -> (CSS width, height in CSS px), defaults to DEFAULT_SLOTS
+            cache_bytes (int): Memory budget of cached letterheads
+        """
+        self.render_html = render_html
+        self.slots = {name: (width, int(height)) for name, (width, height) in (slots or DEFAULT_SLOTS).items()}
+        self._letterheads = ByteLRU(cache_bytes)
+        self._building = {}
+        self._lock = threading.Lock()
+        self._counters = {"stamped": 0, "overflow": 0, "unusable": 0, "backgrounds": 0}
+
+    @classmethod
+    def from_config(cls, config, render_html):
+        """
+        Build a renderer from the optional letterhead_* keys in config.json.
+
+        Returns:
+            LetterheadRenderer: The renderer, or None unless letter_render_mode is "overlay"
+        """
+        if config.get("letter_render_mode", "full") != "overlay":
+            return None
+        try:
+            _import_pymupdf()
+        except ImportError:
+            print("PyMuPDF is not installed; letters are rendered in full")
+            return None
+        return cls(
+            render_html,
+            slots=config.get("letterhead_slots"),
+            cache_bytes=int(config.get("letterhead_cache_mb", 16) * 1024 * 1024)
+        )
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def background_html(self, template, values):
+        """
+        Fill a template with empty boxes for the stamped fields and values for the rest.
+
+        Args:
+            template (CompiledTemplate): Letter template
+            values (dict): Placeholder name -> value, as for a full render
+        """
+        background_values = dict(values)
+        for name, (width, height) in self.slots.items():
+            background_values[name] = (f'<a href="{SLOT_SCHEME}{name}" style="display: inline-block; '
+                                       f'width: {width}; height: {height}px; vertical-align: top;"></a>')
+        return template.render(background_values)
+
+    def _build(self, background_html):
+        """
+        Render a background and locate its boxes.
+
+        Returns:
+            Letterhead: The letterhead, False if its boxes could not all be found,
+                or None if rendering failed
+        """
+        pdf = self.render_html(background_html)
+        if not pdf:
+            return None
+        self._count("backgrounds")
+
+        context = _SlotContext()
+        context.feed(background_html)
+        context.close()
+
+        pymupdf = _import_pymupdf()
+        found, pages = set(), []
+        with _pymupdf_lock, pymupdf.open("pdf", pdf) as document:
+            for page in document:
+                boxes = []
+                for link in page.get_links():
+                    uri = link.get("uri") or ""
+                    if not uri.startswith(SLOT_SCHEME):
+                        continue
+                    name = uri[len(SLOT_SCHEME):]
+                    if name in self.slots and name not in found and link["from"].height > 0:
+                        found.add(name)
+                        boxes.append((name, link["from"]))
+                    page.delete_link(link)
+                if boxes:
+                    # Points per CSS px: the renderer's zoom, measured on the box heights
+                    scale = sum(box.height / self.slots[name][1] for name, box in boxes) / len(boxes)
+                    pages.append((page.number, (page.rect.width / scale, page.rect.height / scale),
+                                  [(name, tuple(coordinate / scale for coordinate in box)) for name, box in boxes]))
+            missing = set(self.slots) - found | set(self.slots) - set(context.ancestors)
+            if missing:
+                print(f"Letterhead boxes not found for {sorted(missing)}; rendering letters in full")
+                return False
+            pdf = document.tobytes(garbage=1, deflate=True)
+
+        wrappers = {name: _wrapper(context.ancestors[name]) for name in self.slots}
+        return Letterhead(pdf, pages, wrappers, "body {margin: 0;}\n" + "".join(context.css))
+
+    def letterhead(self, template, values):
+        """
+        Return the cached letterhead for these values, rendering it on first use.
+
+        Returns:
+            Letterhead: The letterhead, or None if there is no usable one
+        """
+        background_html = self.background_html(template, values)
+        key = hashlib.sha256(background_html.encode('utf-8')).hexdigest()
+        letterhead = self._letterheads.get(key)
+        if letterhead is None:
+            # One render per background, however many letters wait for it
+            with self._lock:
+                building = self._building.setdefault(key, threading.Lock())
+            with building:
+                letterhead = self._letterheads.get(key)
+                if letterhead is None:
+                    letterhead = self._build(background_html)
+                    if letterhead is not None:
+                        # A letterhead without boxes is remembered too, so it is not rendered again
+                        self._letterheads.put(key, letterhead, len(letterhead.pdf) if letterhead else 0)
+                with self._lock:
+                    self._building.pop(key, None)
+        if not letterhead:
+            self._count("unusable")
+            return None
+        return letterhead
+
+    def render(self, template, values):
+        """
+        Render a letter onto its letterhead.
+
+        Args:
+            template (CompiledTemplate): Letter template
+            values (dict): Placeholder name -> value, with images already inlined
+
+        Returns:
+            bytes: The PDF, or None if the letter has to be rendered in full (no usable
+                letterhead, or a stamped field overflows its box)
+        """
+        letterhead = self.letterhead(template, values)
+        if letterhead is None:
+            return None
+
+        pymupdf = _import_pymupdf()
+        with _pymupdf_lock, metrics.stage("letterhead"):
+            # Lay out the stamped fields in their boxes, one page per background page, in CSS px
+            buffer = io.BytesIO()
+            writer = pymupdf.DocumentWriter(buffer, "compress")
+            try:
+                for _, (width, height), boxes in letterhead.pages:
+                    device = writer.begin_page(pymupdf.Rect(0, 0, width, height))
+                    try:
+                        for name, box in boxes:
+                            opening, closing = letterhead.wrappers[name]
+                            value = values[name]
+                            story = pymupdf.Story(html=opening + (value if isinstance(value, str) else str(value)) + closing,
+                                                  user_css=letterhead.css)
+                            more, _ = story.place(pymupdf.Rect(box))
+                            if more:
+                                self._count("overflow")
+                                return None
+                            story.draw(device)
+                    finally:
+                        writer.end_page()
+            finally:
+                writer.close()
+
+            # Scale each page onto its background page, on a copy of the background
+            with pymupdf.open("pdf", buffer.getvalue()) as stamps, pymupdf.open("pdf", letterhead.pdf) as document:
+                for number, (page_number, _, _) in enumerate(letterhead.pages):
+                    page = document[page_number]
+                    page.show_pdf_page(page.rect, stamps, number)
+                pdf = document.tobytes(deflate=True)
+        self._count("stamped")
+        return pdf
+
+    def stats(self):
+        """
+        Returns:
+            dict: Letters stamped, overflows and unusable letterheads that fell back to a
+                full render, backgrounds rendered and the letterhead cache
+        """
+        with self._lock:
+            counters = dict(self._counters)
+        counters["cache"] = self._letterheads.stats()
+        return counters
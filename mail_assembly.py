@@ -0,0 +1,181 @@
+"""
+mail_assembly.py
+
+This module builds approval emails from MIME parts that are encoded once.
+
+The emails of one approval share their subject, HTML body and PDF, and differ only
+in their recipients and, for the sender's copy, an extra attachment. A
+MessageAssembly holds that shared content and serializes it lazily, in wire format:
+
+    - the body (plain-text fallback + HTML alternative) is generated once by the
+      email package
+    - each attachment is base64-encoded once, straight into 76-character CRLF lines,
+      instead of going through email.generator
+    - the multipart/mixed body of each attachment combination is joined from those
+      parts once and cached
+
+A message for one envelope is then its own headers (Subject, From, To, Cc) followed
+by the cached body, as bytes ready for ``smtplib.SMTP.sendmail``. The recipients of
+identical emails go into one envelope, so the message is sent once in one SMTP
+transaction (one MAIL FROM, one RCPT TO per address, one DATA) instead of once per
+recipient.
+
+Classes:
+    MessageAssembly: Shared content of one approval's emails, encoded once.
+
+Functions:
+    recipient_addresses: Addresses from To/Cc values, de-duplicated, in order.
+"""
+import base64
+import threading
+import uuid
+from email import policy
+from email.message import EmailMessage
+from email.utils import getaddresses
+
+
+PLAIN_TEXT_FALLBACK = "This email contains HTML content. Please view in an HTML-compatible email client."
+
+
+def recipient_addresses(*values):
+    """
+    Addresses from To/Cc values, in order and without duplicates.
+
+    Args:
+        values: Address strings (possibly comma-separated), lists of them or None
+
+    Returns:
+        list: Bare email addresses
+    """
+    fields = []
+    for value in values:
+        if not value:
+            continue
+        fields.extend(value if isinstance(value, (list, tuple)) else [value])
+    addresses = []
+    for _, address in getaddresses(fields):
+        if address and address.lower() not in (seen.lower() for seen in addresses):
+            addresses.append(address)
+    return addresses
+
+
+def _header_value(value):
+    return ", ".join(value) if isinstance(value, (list, tuple)) else value
+
+
+def _headers(**fields):
+    """Serialize header fields (folded and encoded as the email package does), without the blank line."""
+    headers = EmailMessage(policy=policy.SMTP)
+    for name, value in fields.items():
+        if value:
+            headers[name] = _header_value(value)
+    return headers.as_bytes()[:-2]
+
+
+def _attachment_part(filename, data, maintype, subtype):
+    """Encode a file as a base64 attachment part: headers from the email package, body by binascii."""
+    part = EmailMessage(policy=policy.SMTP)
+    part['Content-Type'] = f"{maintype}/{subtype}"
+    part.add_header('Content-Disposition', 'attachment', filename=filename)
+    part['Content-Transfer-Encoding'] = 'base64'
+    return part.as_bytes() + base64.encodebytes(data).replace(b"\n", b"\r\n")
+
+
+def _alternative_part(text_content, html_content):
+    """The plain-text fallback and the HTML body as one multipart/alternative part."""
+    part = EmailMessage(policy=policy.SMTP)
+    part.set_content(text_content)
+    part.add_alternative(html_content, subtype='html')
+    del part['MIME-Version']
+    return part.as_bytes()
+
+
+class MessageAssembly(object):
+    """
+    Subject, sender, HTML body and attachments shared by the emails of one approval.
+
+    Parts are encoded on first use and every message built from the assembly reuses
+    them; the assembly is safe to use from several threads.
+    """
+    def __init__(self, from_addr, subject, html_content, text_content=PLAIN_TEXT_FALLBACK):
+        """
+        Args:
+            from_addr (str): Sender address (From header and MAIL FROM)
+            subject (str): Subject of every message
+            html_content (str): HTML body
+            text_content (str): Plain-text alternative of the HTML body
+        """
+        self.from_addr = from_addr
+        self.subject = subject
+        self.html_content = html_content
+        self.text_content = text_content
+        self._attachments = {}
+        self._parts = {}
+        self._bodies = {}
+        self._lock = threading.Lock()
+
+    def add_attachment(self, name, filename, data, maintype='application', subtype='octet-stream'):
+        """
+        Register a file that messages can attach by name.
+
+        Args:
+            name (str): Key used to pick the attachment in message()
+            filename (str): File name shown to the recipient
+            data (bytes): File content
+        """
+        self._attachments[name] = (filename, data, maintype, subtype)
+        return self
+
+    def _part(self, name):
+        # Called with the lock held
+        part = self._parts.get(name)
+        if part is None:
+            if name is None:
+                part = _alternative_part(self.text_content, self.html_content)
+            else:
+                part = _attachment_part(*self._attachments[name])
+            self._parts[name] = part
+        return part
+
+    def body(self, attachments=()):
+        """
+        The MIME-Version and Content-Type headers and the multipart/mixed body carrying
+        the HTML and the named attachments, serialized once per combination.
+
+        Returns:
+            bytes: Body in wire format (CRLF line endings)
+        """
+        key = tuple(attachments)
+        with self._lock:
+            body = self._bodies.get(key)
+            if body is None:
+                parts = [self._part(None)] + [self._part(name) for name in key]
+                boundary = "===============" + uuid.uuid4().hex + "=="
+                # The text parts come from the email package and could in theory hold the boundary
+                while any(boundary.encode('ascii') in part for part in parts):
+                    boundary = "===============" + uuid.uuid4().hex + "=="
+                delimiter = b"--" + boundary.encode('ascii')
+                pieces = [b'MIME-Version: 1.0\r\nContent-Type: multipart/mixed; boundary="' + boundary.encode('ascii')
+                          + b'"\r\n\r\n']
+                for part in parts:
+                    # The CRLF before a delimiter belongs to the delimiter, as email.generator writes it
+                    pieces += [delimiter, b"\r\n", part, b"\r\n"]
+                pieces += [delimiter, b"--\r\n"]
+                body = self._bodies[key] = b"".join(pieces)
+        return body
+
+    def message(self, to_addrs, cc_addrs=None, attachments=()):
+        """
+        Build one envelope: a message to every recipient in to_addrs and cc_addrs.
+
+        Args:
+            to_addrs (list): To recipients (addresses or comma-separated strings)
+            cc_addrs (list): Cc recipients
+            attachments (tuple): Names of the attachments to carry, in order
+
+        Returns:
+            tuple: (message bytes, from_addr, recipient addresses), as SMTPConnectionPool.send_messages takes them
+        """
+        headers = _headers(Subject=self.subject, From=self.from_addr, To=to_addrs, Cc=cc_addrs)
+        recipients = recipient_addresses(to_addrs, cc_addrs)
+        return headers + self.body(attachments), self.from_addr, recipients
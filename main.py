@@ -1,47 +1,126 @@
-import pdfkit
 import os
 import re
-import base64
-import requests
-from io import BytesIO
 # from secret_manager import SecretManager
 from secret_manager_local import SecretManager
 from pydantic import BaseModel
-from typing import Optional
-from fastapi.responses import JSONResponse, FileResponse
+from typing import Optional, List
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from datetime import datetime
-import os
 import traceback
 import json
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, Request
+from fastapi.exceptions import RequestValidationError
+from pydantic import ValidationError
 from fastapi.middleware.cors import CORSMiddleware
-from email.message import EmailMessage
-import smtplib
+from email.utils import formatdate, parsedate_to_datetime
 import oci
 from oci.object_storage import ObjectStorageClient
+import threading
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from renderer import RenderPool
+from render_backends import BACKENDS, DEFAULT_BACKEND
+from executors import StageExecutors, StageSaturated
+from smtp_pool import SMTPConnectionPool, SMTPBatcher, DeliveryUnknown
+from outbox import Outbox
+from template_registry import TemplateRegistry, TemplateError
+from signature_registry import SignatureRegistry, SignatureError
+from image_cache import ImageCache
+from image_fetch import ImageFetcher
+from pdf_index import PDFIndex, request_id_from_object_name
+from document_cache import DocumentCache
+from upload_manager import UploadManager
+from idempotency import SingleFlight, RenderCache, payload_hash, text_sha256
+from html_normalize import NormalizedHTML, normalize_html
+from letterhead import LetterheadRenderer
+from mail_assembly import MessageAssembly, recipient_addresses
+from attachments import AttachmentError, AttachmentSpool, MultipartApproval, MAX_DETAILS_BYTES, decode_base64_to_spool
+import metrics
 
 
 
-sm = SecretManager()
-# Pass a sensible default so get_secret never returns None unexpectedly
-secrets = sm.get_secret(default={})
+# -------------------------------
+# PDF RENDER POOL
+# -------------------------------
+render_pool = None
+_render_pool_lock = threading.Lock()
 
+# Cached letterheads the per-letter fields are stamped onto ("overlay" letter_render_mode), created by init_services()
+letterhead_renderer = None
 
-def html_to_pdf(html_content, output_filename):
-    print(f"Output file: {output_filename}")
-    
+# Render backend of each transaction type, and of the types not listed (render_backends_by_type / render_backend)
+RENDER_BACKEND = DEFAULT_BACKEND
+RENDER_BACKENDS_BY_TYPE = {}
+
+
+def get_render_pool():
+    """Return the shared pool of warm render workers, starting it on first use."""
+    global render_pool
+    if render_pool is None:
+        with _render_pool_lock:
+            if render_pool is None:
+                render_pool = RenderPool.from_config(config).start()
+    return render_pool
+
+
+def render_backend_for(transaction_type):
+    """Name of the render backend configured for a transaction type."""
+    return RENDER_BACKENDS_BY_TYPE.get(transaction_type, RENDER_BACKEND)
+
+
+def html_to_pdf(html_content, backend=DEFAULT_BACKEND):
+    """
+    Render HTML to PDF in memory.
+
+    Args:
+        html_content (str): Complete HTML document
+        backend (str): Render backend name (see render_backends.py)
+
+    Returns:
+        bytes: The PDF document, or None if rendering failed
+    """
     try:
-        # Convert HTML string to PDF
-        pdfkit.from_string(html_content, output_filename)
-        print(f"PDF generated successfully: {output_filename}")
-        return output_filename
+        # Convert HTML string to PDF on a warm render worker
+        with metrics.stage("render"):
+            pdf_bytes = get_render_pool().render(html_content, backend=backend)
+        metrics.PDF_BYTES.observe(len(pdf_bytes))
+        print(f"PDF generated successfully: {len(pdf_bytes)} bytes")
+        return pdf_bytes
     except Exception as e:
         print(f"Error generating PDF: {str(e)}")
         return None
 
+
+def render_letter(html_content, values, backend=DEFAULT_BACKEND):
+    """
+    Render a letter to PDF. In overlay mode, letters rendered by wkhtmltopdf have their
+    fields stamped onto the cached letterhead; letters that do not fit their letterhead
+    are rendered from the full HTML.
+
+    Args:
+        html_content (str): The filled letter template
+        values (dict): The values it was filled with, images inlined
+        backend (str): Render backend of the letter's transaction type
+
+    Returns:
+        bytes: The PDF document, or None if rendering failed
+    """
+    # The in-process backends are cheap enough that stamping would not pay off
+    if letterhead_renderer is not None and backend == DEFAULT_BACKEND:
+        try:
+            pdf_bytes = letterhead_renderer.render(template_registry.get(LETTER_TEMPLATE_PATH), values)
+        except Exception as e:
+            print(f"Error stamping letter onto its letterhead, rendering it in full: {str(e)}")
+            pdf_bytes = None
+        if pdf_bytes:
+            metrics.PDF_BYTES.observe(len(pdf_bytes))
+            return pdf_bytes
+    return html_to_pdf(html_content, backend)
+
 def convert_image_url_to_base64(url, timeout=20):
     """
-    Download image from URL and convert to base64 data URI.
+    Convert an image URL to a base64 data URI, served from the image cache when possible.
     
     Args:
         url (str): URL of the image
@@ -51,29 +130,37 @@ def convert_image_url_to_base64(url, timeout=20):
         str: Base64 data URI or original URL if conversion fails
     """
     try:
-        # Download the image
-        response = requests.get(url, timeout=timeout, headers={'User-Agent': 'Mozilla/5.0'})
-        response.raise_for_status()
-        
-        # Get content type
-        content_type = response.headers.get('content-type', 'image/png')
-        
-        # Convert to base64
-        image_data = base64.b64encode(response.content).decode('utf-8')
-        
-        # Create data URI
-        data_uri = f"data:{content_type};base64,{image_data}"
-        return data_uri
-        
+        return image_fetcher.fetch(url, timeout=timeout)
     except Exception as e:
         print(f"Error converting image URL to base64: {str(e)}")
         print(f"Keeping original URL: {url}")
         return url
 
 
+def inline_images(fragments):
+    """
+    Download the images of normalized HTML fragments together and render the fragments
+    with the images inlined as base64 data URIs.
+
+    Args:
+        fragments (list): NormalizedHTML fragments
+
+    Returns:
+        list: The rendered HTML of each fragment; images that failed keep their URL
+    """
+    image_urls = [url for fragment in fragments for url in fragment.image_urls]
+    if not image_urls:
+        return [fragment.render() for fragment in fragments]
+    print(f"Found {len(image_urls)} image URL(s) in HTML")
+    with metrics.stage("inline_images"):
+        data_uris = image_fetcher.fetch_all(image_urls)
+    return [fragment.render(data_uris) for fragment in fragments]
+
+
 def process_html_images(html_content):
     """
     Find all image tags with URL sources and convert them to base64.
+    All images are downloaded concurrently before the HTML is rewritten.
     
     Args:
         html_content (str): HTML content with image tags
@@ -81,101 +168,103 @@ def process_html_images(html_content):
     Returns:
         str: HTML content with images converted to base64
     """
-    # Regex pattern to find img tags with src containing http/https URLs
-    img_pattern = r'<img\s+([^>]*?)src=["\']([^"\'>]+)["\']([^>]*?)>'
-    
-    def replace_image(match):
-        before_src = match.group(1)
-        src_url = match.group(2)
-        after_src = match.group(3)
-        
-        # Check if it's a URL (http or https)
-        if src_url.startswith('http://') or src_url.startswith('https://'):
-            print(f"Found image URL in HTML: {src_url}")
-            # Convert to base64
-            base64_src = convert_image_url_to_base64(src_url)
-            return f'<img {before_src}src="{base64_src}"{after_src}>'
-        else:
-            # Not a URL, keep as is
-            return match.group(0)
-    
-    # Replace all image URLs with base64
-    processed_html = re.sub(img_pattern, replace_image, html_content, flags=re.IGNORECASE)
-    return processed_html
+    return inline_images([normalize_html(html_content, strip_paragraphs=False, collapse_whitespace=False)])[0]
+
+
+# -------------------------------
+# TEMPLATES
+# -------------------------------
+LETTER_TEMPLATE_PATH = "template.txt"
+EMAIL_TEMPLATE_PATH = "email_template.txt"
+
+# Placeholders each template must use; checked when the template is (re)loaded
+LETTER_TEMPLATE_FIELDS = (
+    "approval_type", "transaction_status", "book_language", "transaction_creator", "sender",
+    "receiver", "transaction_date", "transaction_type", "confidentiality", "subject",
+    "l1", "l2", "l3", "signature_image", "signature_display",
+    "signatory_name", "signatory_title", "signatory_designation"
+)
+EMAIL_TEMPLATE_FIELDS = (
+    "request_id", "sender", "sender_email", "department", "designation", "request_type", "today"
+)
+
+template_registry = TemplateRegistry()
+
+# Signatories and their pre-encoded signature images (signatories.json), created by init_services()
+signature_registry = None
+
+
+def register_templates():
+    """Compile the letter and email templates and check their placeholders."""
+    for path, fields in ((LETTER_TEMPLATE_PATH, LETTER_TEMPLATE_FIELDS), (EMAIL_TEMPLATE_PATH, EMAIL_TEMPLATE_FIELDS)):
+        try:
+            template_registry.register(path, fields)
+        except TemplateError as e:
+            print(f"Warning: {e}")
 
 
-def get_html_content(data_dict, template_file_path="template.txt"):
+def inline_field_images(data_dict):
     """
-    Load HTML template from file and fill it with dynamic data.
+    Convert image URLs to base64 in the HTML values of template data.
     
     Args:
-        data_dict (dict): Dictionary containing data to fill in the template placeholders
-        template_file_path (str): Path to the HTML template file
+        data_dict (dict): Template placeholder values; NormalizedHTML values are
+            rendered with their images inlined
     
     Returns:
-        str: HTML content with filled placeholders
+        dict: The values with every HTML field rendered to a string
     """
-    
-    # Process data_dict to convert image URLs to base64 in dynamic data
-    processed_data_dict = {}
+    # The images of all fields are fetched together
+    processed_data_dict = dict(data_dict)
+    fragments = {}
     for key, value in data_dict.items():
-        if isinstance(value, str) and ('<img' in value.lower()):
+        if isinstance(value, NormalizedHTML):
+            fragments[key] = value
+        elif isinstance(value, str) and ('<img' in value.lower()):
             # This field contains HTML with potential images
-            processed_data_dict[key] = process_html_images(value)
-        else:
-            processed_data_dict[key] = value
-    
-    # Try to load template from file
-    if os.path.exists(template_file_path):
-        print(f"Reading HTML template from file: {template_file_path}")
-        try:
-            with open(template_file_path, 'r', encoding='utf-8') as file:
-                template_content = file.read()
-            print("HTML template loaded from file successfully")
-            
-            # Fill the template with data using format()
-            filled_html = template_content.format(**processed_data_dict)
-            print("Template filled with dynamic data successfully")
-            return filled_html
-            
-        except Exception as e:
-            print(f"Error reading HTML template file: {str(e)}")
-            print("Template file not found or error occurred")
-            return None
-    else:
-        print(f"Template file '{template_file_path}' not found")
-        return None
+            fragments[key] = normalize_html(value, strip_paragraphs=False, collapse_whitespace=False)
+    if fragments:
+        processed_data_dict.update(zip(fragments, inline_images(list(fragments.values()))))
+    return processed_data_dict
 
 
-def remove_paragraph_tags(html_content):
+def get_html_content(data_dict, template_file_path=LETTER_TEMPLATE_PATH):
     """
-    Remove ALL <p> and </p> tags while keeping all other HTML tags intact.
-    This function removes all paragraph tags, including nested ones.
+    Fill the precompiled HTML letter template with dynamic data.
     
     Args:
-        html_content (str): HTML content that may contain paragraph tags
+        data_dict (dict): Dictionary containing data to fill in the template placeholders;
+            NormalizedHTML values are rendered with their images inlined
+        template_file_path (str): Path to the HTML template file
     
     Returns:
-        str: HTML content with ALL paragraph tags removed
+        str: HTML content with filled placeholders
     """
-    if not html_content:
-        return html_content
-    
-    # Remove ALL opening <p> tags (with or without attributes) - use global flag
-    content = re.sub(r'<p\b[^>]*>', '', html_content, flags=re.IGNORECASE)
-    
-    # Remove ALL closing </p> tags - use global flag  
-    content = re.sub(r'</p>', '', content, flags=re.IGNORECASE)
-    
-    # Clean up any extra whitespace that might be left
-    content = re.sub(r'\s+', ' ', content)  # Replace multiple spaces with single space
+    return fill_html_template(inline_field_images(data_dict), template_file_path)
+
+
+def fill_html_template(values, template_file_path=LETTER_TEMPLATE_PATH):
+    """
+    Fill the precompiled HTML letter template with values whose images are already inlined.
     
-    return content.strip()
+    Returns:
+        str: HTML content with filled placeholders, or None if the template could not be filled
+    """
+    # Fill the precompiled template (loaded once, reloaded when the file changes)
+    try:
+        with metrics.stage("fill_template"):
+            return template_registry.render(template_file_path, values)
+    except TemplateError as e:
+        print(f"Error loading HTML template: {str(e)}")
+        return None
+    except KeyError as e:
+        print(f"Error filling HTML template, missing value for {str(e)}")
+        return None
 
 
-def get_email_content(data_dict, template_file_path="email_template.txt"):
+def get_email_content(data_dict, template_file_path=EMAIL_TEMPLATE_PATH):
     """
-    Load email template from file and fill it with dynamic data.
+    Fill the precompiled email template with dynamic data.
     Simple template loading without image processing since emails don't need image URL conversion.
     
     Args:
@@ -186,40 +275,73 @@ def get_email_content(data_dict, template_file_path="email_template.txt"):
         str: Email HTML content with filled placeholders
     """
     
-    # Try to load template from file
-    if os.path.exists(template_file_path):
-        print(f"Reading email template from file: {template_file_path}")
-        try:
-            with open(template_file_path, 'r', encoding='utf-8') as file:
-                template_content = file.read()
-            print("Email template loaded from file successfully")
-            
-            # Fill the template with data using format()
-            filled_html = template_content.format(**data_dict)
-            print("Email template filled with dynamic data successfully")
-            return filled_html
-            
-        except Exception as e:
-            print(f"Error reading email template file: {str(e)}")
-            return None
-    else:
-        print(f"Email template file '{template_file_path}' not found")
+    try:
+        return template_registry.render(template_file_path, data_dict)
+    except TemplateError as e:
+        print(f"Error loading email template: {str(e)}")
+        return None
+    except KeyError as e:
+        print(f"Error filling email template, missing value for {str(e)}")
         return None
     
 # -------------------------------
 # LOAD CONFIG
 # -------------------------------
-with open('config.json') as config_file:
-    config = json.load(config_file)
+# Importing this module does no I/O: init_services() reads config.json and builds the
+# local services when the app starts (see lifespan below), and the vault secrets and
+# the OCI client are only fetched/created on first use or by the background warm-up,
+# so a slow or unreachable dependency never holds up startup.
+config = None
+sm = None
+
+SMTP_SERVER = None
+SENDER_EMAIL = None
+SMTP_PORT = None
+
+smtp_pool = None
+stage_executors = None
+image_cache = None
+image_fetcher = None
+pdf_index = None
+document_cache = None
+render_cache = None
+outbox = None
+
+
+def load_config(path='config.json'):
+    """Read the service configuration."""
+    with open(path) as config_file:
+        return json.load(config_file)
+
+
+# Logged-in SMTP sessions shared by every email the service sends
+_smtp_credentials_loaded = False
+_smtp_credentials_lock = threading.Lock()
+
 
-username = secrets.get("email_username")
-password = secrets.get("email_password")
+def get_smtp_pool():
+    """Return the shared SMTP pool, giving it the vault credentials on first use."""
+    global _smtp_credentials_loaded
+    if not _smtp_credentials_loaded:
+        with _smtp_credentials_lock:
+            if not _smtp_credentials_loaded:
+                # Pass a sensible default so get_secret never returns None unexpectedly
+                # (secrets are fetched concurrently and cached; see secret_manager.py)
+                secrets = sm.get_secret(default={})
+                if secrets:
+                    smtp_pool.set_credentials(secrets.get("email_username"), secrets.get("email_password"))
+                    _smtp_credentials_loaded = True
+    return smtp_pool
 
-SMTP_SERVER = config['smtp_server']
-SENDER_EMAIL = config['sender_email']
-SMTP_USERNAME = username
-SMTP_PASSWORD = password
-SMTP_PORT = config['smtp_port']
+
+def refresh_smtp_credentials():
+    """Re-fetch the SMTP credentials from the vault after the server rejected LOGIN."""
+    try:
+        values = sm.refresh(force=True)
+    except Exception as e:
+        print(f"Failed to refresh SMTP credentials: {str(e)}")
+        return None
+    return values.get("email_username"), values.get("email_password")
 
 # -------------------------------
 # OCI CONFIGURATION
@@ -246,65 +368,181 @@ def load_oci_private_key():
         print(f"Error loading OCI private key: {str(e)}")
         return None
 
-# OCI Configuration from config.json
-oci_private_key = load_oci_private_key()
-OCI_CONFIG = {
-    "user": config.get("oci_user_ocid"),
-    "key_content": oci_private_key,
-    "fingerprint": config.get("oci_fingerprint"),
-    "tenancy": config.get("oci_tenancy_ocid"),
-    "region": config.get("oci_region", "us-ashburn-1")
-}
-
-OCI_BUCKET_NAME = config.get("oci_bucket_name")
-OCI_FOLDER_NAME = config.get("oci_folder_name")
-OCI_NAMESPACE = config.get("oci_namespace")
-
-# Initialize OCI Object Storage client
-try:
-    oci_config = oci.config.from_file() if os.path.exists(os.path.expanduser("~/.oci/config")) else OCI_CONFIG
-    object_storage_client = ObjectStorageClient(oci_config)
-except Exception as e:
-    print(f"Warning: Failed to initialize OCI client: {str(e)}")
-    object_storage_client = None
+
+def load_oci_config():
+    """OCI Configuration from ~/.oci/config, or else from config.json"""
+    if os.path.exists(os.path.expanduser("~/.oci/config")):
+        return oci.config.from_file()
+    return {
+        "user": config.get("oci_user_ocid"),
+        "key_content": load_oci_private_key(),
+        "fingerprint": config.get("oci_fingerprint"),
+        "tenancy": config.get("oci_tenancy_ocid"),
+        "region": config.get("oci_region", "us-ashburn-1")
+    }
+
+
+OCI_BUCKET_NAME = None
+OCI_FOLDER_NAME = None
+OCI_NAMESPACE = None
+
+# Created by get_object_storage_client(); a failed attempt is retried after OCI_CLIENT_RETRY_SECONDS
+object_storage_client = None
+upload_manager = None
+OCI_CLIENT_RETRY_SECONDS = 30
+_oci_client_lock = threading.Lock()
+_oci_client_error = None
+_oci_client_failed_at = 0.0
+
+
+def get_object_storage_client():
+    """Return the shared OCI Object Storage client, creating it on first use (None if unavailable)."""
+    global object_storage_client, upload_manager, _oci_client_error, _oci_client_failed_at
+    if object_storage_client is None and time.time() - _oci_client_failed_at >= OCI_CLIENT_RETRY_SECONDS:
+        with _oci_client_lock:
+            if object_storage_client is None and time.time() - _oci_client_failed_at >= OCI_CLIENT_RETRY_SECONDS:
+                try:
+                    # oci_service_endpoint overrides the regional endpoint (private endpoints, local stand-ins)
+                    client = ObjectStorageClient(load_oci_config(), service_endpoint=config.get("oci_service_endpoint"))
+                except Exception as e:
+                    print(f"Warning: Failed to initialize OCI client: {str(e)}")
+                    _oci_client_error = str(e)
+                    _oci_client_failed_at = time.time()
+                    return None
+                # Single put_object for small PDFs, parallel multipart upload for large ones
+                upload_manager = UploadManager.from_config(config, client, OCI_NAMESPACE, OCI_BUCKET_NAME)
+                object_storage_client = client
+                _oci_client_error = None
+    return object_storage_client
+
+
+def init_services():
+    """
+    Read config.json and create the services that only need local resources: stage
+    executors, caches, the PDF index, the outbox and the (not yet logged-in) SMTP pool.
+    Nothing here contacts the vault, the SMTP server or OCI.
+    """
+    global config, sm, SMTP_SERVER, SENDER_EMAIL, SMTP_PORT, smtp_pool, stage_executors
+    global image_cache, image_fetcher, pdf_index, document_cache, render_cache, outbox, signature_registry
+    global letterhead_renderer, RENDER_BACKEND, RENDER_BACKENDS_BY_TYPE
+    global PDF_CACHE_CONTROL, ATTACHMENT_MAX_BYTES, ATTACHMENT_SPOOL_BYTES
+    global OCI_BUCKET_NAME, OCI_FOLDER_NAME, OCI_NAMESPACE
+
+    config = load_config()
+
+    SMTP_SERVER = config['smtp_server']
+    SENDER_EMAIL = config['sender_email']
+    SMTP_PORT = config['smtp_port']
+
+    OCI_BUCKET_NAME = config.get("oci_bucket_name")
+    OCI_FOLDER_NAME = config.get("oci_folder_name")
+    OCI_NAMESPACE = config.get("oci_namespace")
+
+    PDF_CACHE_CONTROL = config.get("pdf_cache_control", PDF_CACHE_CONTROL)
+
+    ATTACHMENT_MAX_BYTES = int(config.get("attachment_max_mb", 25) * 1024 * 1024)
+    ATTACHMENT_SPOOL_BYTES = int(config.get("attachment_spool_memory_mb", 1) * 1024 * 1024)
+
+    sm = SecretManager()
+    smtp_pool = SMTPConnectionPool.from_config(config, SMTP_SERVER, SMTP_PORT, None, None,
+                                               on_auth_failure=refresh_smtp_credentials)
+    # Rotated credentials found by the background refresh apply to new sessions right away
+    sm.on_change(lambda values: smtp_pool.set_credentials(values.get("email_username"), values.get("email_password")))
+
+    # Bounded executors for blocking work (render, mail, storage, fetch)
+    stage_executors = StageExecutors(config.get("executor_stages"))
+
+    # Remote images inlined into letters (memory LRU + on-disk store), fetched concurrently
+    image_cache = ImageCache.from_config(config)
+    image_fetcher = ImageFetcher.from_config(config, image_cache)
+
+    # Local request_id -> object index of archived PDFs
+    pdf_index = PDFIndex.from_config(config)
+
+    # Recently uploaded and downloaded PDFs, served without a round trip to OCI
+    document_cache = DocumentCache.from_config(config)
+
+    # PDFs by the hash of their filled HTML, so an identical letter is not rendered twice
+    render_cache = RenderCache.from_config(config)
+
+    # Render backend per transaction type; unknown names are ignored with a warning
+    RENDER_BACKEND = config.get("render_backend", DEFAULT_BACKEND)
+    if RENDER_BACKEND not in BACKENDS:
+        print(f"Warning: unknown render_backend '{RENDER_BACKEND}', using {DEFAULT_BACKEND}")
+        RENDER_BACKEND = DEFAULT_BACKEND
+    RENDER_BACKENDS_BY_TYPE = {}
+    for transaction_type, backend in (config.get("render_backends_by_type") or {}).items():
+        if backend in BACKENDS:
+            RENDER_BACKENDS_BY_TYPE[transaction_type] = backend
+        else:
+            print(f"Warning: unknown render backend '{backend}' for {transaction_type}, using {RENDER_BACKEND}")
+
+    # Letterheads rendered once per transaction type, language and signatory, in overlay mode
+    letterhead_renderer = LetterheadRenderer.from_config(config, html_to_pdf)
+
+    outbox = Outbox.from_config(config)
+    outbox.register_handler("email", deliver_email_task)
+    outbox.register_handler("upload", deliver_upload_task)
+
+    register_templates()
+
+    # Requests traced without asking for it with an X-Trace header
+    metrics.TraceMiddleware.sample_rate = config.get("trace_sample_rate", 0.0)
+    register_metric_collectors()
+
+    signature_registry = SignatureRegistry.from_config(config)
+    try:
+        signature_registry.get()
+    except SignatureError as e:
+        print(f"Warning: {e}")
+
+
+def warm_up_services():
+    """
+    Fetch the SMTP credentials and create the OCI client ahead of the first request,
+    then rebuild the PDF index; uploads and lookups keep using the index meanwhile.
+    """
+    get_smtp_pool()
+    if get_object_storage_client() is not None and config.get("pdf_index_rebuild_on_startup", True):
+        rebuild_pdf_index()
 
 # -------------------------------
 # OCI UPLOAD FUNCTION
 # -------------------------------
-def upload_pdf_to_oci(file_path, request_id, transaction_type):
+def upload_pdf_to_oci(pdf_data, request_id, transaction_type):
     """
     Upload PDF file to OCI Object Storage bucket.
     
     Args:
-        file_path (str): Local path to the PDF file
+        pdf_data (bytes): The rendered PDF
         request_id (str): Request ID for naming
         transaction_type (str): Type of transaction for naming
     
     Returns:
         str: OCI object name if successful, None if failed
     """
-    if not object_storage_client or not OCI_NAMESPACE:
+    if not OCI_NAMESPACE or not get_object_storage_client():
         print("OCI client not available or namespace not configured")
         return None
     
     try:
         # Create object name with folder path and request_id prefix
-        file_name = os.path.basename(file_path)
         object_name = f"{OCI_FOLDER_NAME}/{request_id}_{transaction_type.replace(' ', '_')}.pdf"
         
-        # Check if local file exists
-        if not os.path.exists(file_path):
+        if not pdf_data:
             return None
         
-        # Upload file to OCI
-        with open(file_path, 'rb') as file_data:
-            object_storage_client.put_object(
-                namespace_name=OCI_NAMESPACE,
-                bucket_name=OCI_BUCKET_NAME,
-                object_name=object_name,
-                put_object_body=file_data,
-                content_type='application/pdf'
-            )
+        # Upload the in-memory PDF to OCI (multipart above the size threshold)
+        upload = upload_manager.upload(object_name, pdf_data, content_type='application/pdf')
+        if upload["parts"] > 1:
+            print(f"Uploaded {object_name} in {upload['parts']} parts")
+        
+        # Index and cache the upload so retrieval neither searches the bucket nor downloads it
+        try:
+            pdf_index.record(request_id, object_name, size=len(pdf_data), etag=upload["etag"])
+            document_cache.put(object_name, pdf_data, etag=upload["etag"], last_modified=upload["last_modified"])
+        except Exception as e:
+            print(f"Error indexing uploaded PDF: {str(e)}")
         
         return object_name
         
@@ -312,69 +550,290 @@ def upload_pdf_to_oci(file_path, request_id, transaction_type):
         print(f"Error uploading PDF to OCI: {str(e)}")
         return None
 
+# -------------------------------
+# OCI PDF INDEX
+# -------------------------------
+def list_bucket_pdfs(prefix=None):
+    """
+    List every archived PDF in the bucket folder, following pagination.
+
+    Args:
+        prefix (str): Object name prefix, defaults to the whole folder
+
+    Yields:
+        dict: object_name, size, etag and time_created (epoch seconds)
+    """
+    prefix = prefix or f"{OCI_FOLDER_NAME}/"
+    next_start = None
+    while True:
+        with metrics.stage("oci_list"):
+            list_objects_response = object_storage_client.list_objects(
+                namespace_name=OCI_NAMESPACE,
+                bucket_name=OCI_BUCKET_NAME,
+                prefix=prefix,
+                start=next_start,
+                fields="name,size,etag,timeCreated"
+            )
+        for obj in list_objects_response.data.objects:
+            if obj.name.lower().endswith('.pdf'):
+                yield {
+                    "object_name": obj.name,
+                    "size": obj.size,
+                    "etag": obj.etag,
+                    "time_created": obj.time_created.timestamp() if obj.time_created else None
+                }
+        next_start = list_objects_response.data.next_start_with
+        if not next_start:
+            break
+
+
+def rebuild_pdf_index():
+    """Re-index the bucket folder so PDFs uploaded elsewhere are found without a search."""
+    if not OCI_NAMESPACE or not get_object_storage_client():
+        print("OCI client not available or namespace not configured, PDF index not rebuilt")
+        return
+    try:
+        indexed = pdf_index.rebuild(list_bucket_pdfs())
+        print(f"PDF index rebuilt: {indexed} documents")
+    except Exception as e:
+        print(f"Error rebuilding PDF index: {str(e)}")
+
+
+def find_pdf_in_bucket(search_id):
+    """
+    Fallback for IDs missing from the index: list only ``{search_id}_`` objects and keep
+    the newest one. Objects indexed under another request ID, or whose name parses to
+    another request ID (``{search_id}_12_MEMO.pdf`` belongs to ``{search_id}_12``), are
+    not taken. The result is indexed.
+
+    Returns:
+        dict: Index entry, or None if no such PDF exists
+    """
+    matches = []
+    for obj in list_bucket_pdfs(f"{OCI_FOLDER_NAME}/{search_id}_"):
+        owner = pdf_index.owner(obj["object_name"]) or request_id_from_object_name(obj["object_name"])
+        if owner is None or owner == search_id:
+            matches.append(obj)
+    if not matches:
+        return None
+    newest = max(matches, key=lambda obj: obj["time_created"] or 0.0)
+    pdf_index.record(search_id, newest["object_name"], newest["size"], newest["etag"], newest["time_created"])
+    return dict(newest, request_id=search_id)
+
+
 # -------------------------------
 # OCI DOWNLOAD FUNCTION
 # -------------------------------
-def search_and_download_pdf_by_id(search_id):
+# Single byte range in the forms OCI accepts: "bytes=0-99", "bytes=100-", "bytes=-100"
+BYTE_RANGE_PATTERN = re.compile(r'^bytes=(\d+-\d*|-\d+)$')
+
+
+def parse_byte_range(range_header):
+    """
+    Validate a Range header for pass-through to OCI.
+
+    Multi-range and malformed headers are ignored (the whole file is sent), as RFC 9110 allows.
+
+    Returns:
+        str: The normalized range, or None to send the whole object
+    """
+    if not range_header:
+        return None
+    byte_range = range_header.replace(' ', '')
+    match = BYTE_RANGE_PATTERN.match(byte_range)
+    if not match:
+        return None
+    first, _, last = match.group(0)[len('bytes='):].partition('-')
+    if first and last and int(last) < int(first):
+        return None
+    return byte_range
+
+
+def resolve_byte_range(byte_range, size):
+    """
+    Turn a range accepted by parse_byte_range into offsets within a document of ``size`` bytes.
+
+    Returns:
+        tuple: (start, end) inclusive, or None if the range cannot be satisfied
+    """
+    first, _, last = byte_range[len('bytes='):].partition('-')
+    if not first:
+        start, end = max(0, size - int(last)), size - 1
+    else:
+        start, end = int(first), min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        return None
+    return start, end
+
+
+# Archived PDFs do not change once uploaded, so clients and proxies may keep them
+PDF_CACHE_CONTROL = "public, max-age=31536000, immutable"  # pdf_cache_control in config.json
+
+
+def strong_etag(etag):
+    """Return ``etag`` as a quoted strong entity tag, or None."""
+    if not etag:
+        return None
+    etag = etag.strip()
+    if etag.startswith('W/'):
+        etag = etag[2:]
+    return etag if etag.startswith('"') else f'"{etag}"'
+
+
+def is_not_modified(etag, last_modified, if_none_match=None, if_modified_since=None):
+    """
+    Evaluate If-None-Match / If-Modified-Since against a document's validators (RFC 9110).
+
+    If-Modified-Since is only considered when no If-None-Match was sent.
+
+    Returns:
+        bool: True if the client's copy is current and a 304 can be sent
     """
-    Search for PDF file in OCI bucket by ID prefix and download it.
+    if if_none_match:
+        if if_none_match.strip() == '*':
+            return True
+        return bool(etag) and strong_etag(etag) in {strong_etag(tag) for tag in if_none_match.split(',')}
+    if if_modified_since and last_modified:
+        try:
+            return parsedate_to_datetime(last_modified) <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def range_applies(if_range, etag, last_modified):
+    """
+    Evaluate If-Range: a range is only served if the client's partial copy is still current.
+
+    Returns:
+        bool: True if there is no If-Range or it matches the document's ETag / Last-Modified
+    """
+    if not if_range:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith('"'):
+        return bool(etag) and strong_etag(etag) == if_range
+    return bool(last_modified) and if_range == last_modified
+
+
+def open_pdf_by_id(search_id, byte_range=None, if_none_match=None, if_modified_since=None, if_range=None):
+    """
+    Look up the PDF for a request ID and return it from the document cache, or open
+    its OCI download stream.
+    
+    A cached entry past its TTL is revalidated with If-None-Match; a ``304`` renews it.
+    When the client's conditional headers already match the indexed ETag or creation
+    time, nothing is downloaded.
     
     Args:
-        search_id (str): ID to search for (files should start with this ID)
+        search_id (str): Request ID the PDF was uploaded under
+        byte_range (str): Optional ``bytes=...`` range passed through to OCI on a cache miss
+        if_none_match (str): Client If-None-Match header
+        if_modified_since (str): Client If-Modified-Since header
+        if_range (str): Client If-Range header; a stale one drops ``byte_range``
     
     Returns:
-        tuple: (file_path, object_name) if found, (None, None) if not found
+        dict: object_name, etag, last_modified and one of ``not_modified`` (True),
+            ``cached`` (cache entry) or ``response`` (get_object response), or None if
+            not found. The caller streams ``response.data.raw`` and must close ``response.data``.
+    
+    Raises:
+        oci.exceptions.ServiceError: 416 if the range cannot be satisfied
     """
-    if not object_storage_client or not OCI_NAMESPACE:
+    if not OCI_NAMESPACE or not get_object_storage_client():
         print("OCI client not available or namespace not configured")
-        return None, None
+        return None
     
     try:
-        # List objects in bucket with folder prefix and search_id
-        search_prefix = f"{OCI_FOLDER_NAME}/{search_id}_"
-        
-        list_objects_response = object_storage_client.list_objects(
-            namespace_name=OCI_NAMESPACE,
-            bucket_name=OCI_BUCKET_NAME,
-            prefix=search_prefix,
-            fields="name,size,timeCreated"
-        )
-        
-        objects = list_objects_response.data.objects
-        
-        if not objects:
-            return None, None
-        
-        # Find the first PDF file (you can modify this logic if needed)
-        pdf_object = None
-        for obj in objects:
-            if obj.name.lower().endswith('.pdf'):
-                pdf_object = obj
-                break
-        
-        if not pdf_object:
-            return None, None
-        
-        # Download the file
-        get_object_response = object_storage_client.get_object(
-            namespace_name=OCI_NAMESPACE,
-            bucket_name=OCI_BUCKET_NAME,
-            object_name=pdf_object.name
-        )
-        
-        # Save to temporary file (extract just the filename, not the full path)
-        original_filename = os.path.basename(pdf_object.name)  # Gets "441_INNER_BOOK.pdf" from "royal_group/441_INNER_BOOK.pdf"
-        temp_file_path = f"temp_{original_filename}"
-        
-        with open(temp_file_path, 'wb') as f:
-            for chunk in get_object_response.data.raw.stream(1024 * 1024, decode_content=False):
-                f.write(chunk)
-        
-        return temp_file_path, pdf_object.name
+        entry = pdf_index.lookup(search_id)
+        for attempt in range(2):
+            if entry is None:
+                entry = find_pdf_in_bucket(search_id)
+                if entry is None:
+                    return None
+            object_name = entry["object_name"]
+            source = {
+                "object_name": object_name,
+                "etag": entry["etag"],
+                "last_modified": formatdate(entry["time_created"], usegmt=True) if entry["time_created"] else None,
+                "not_modified": False,
+                "cached": None,
+                "response": None
+            }
+            
+            cached, fresh = document_cache.get(object_name)
+            if cached is not None and fresh:
+                source.update(cached=cached, etag=cached["etag"] or source["etag"],
+                              last_modified=cached["last_modified"] or source["last_modified"])
+                return source
+            if is_not_modified(source["etag"], source["last_modified"], if_none_match, if_modified_since):
+                source["not_modified"] = True
+                return source
+            if not range_applies(if_range, source["etag"], source["last_modified"]):
+                byte_range = None
+            
+            try:
+                # Revalidate a stale entry (whole document), or download the requested range;
+                # timed until the response headers, the body is streamed afterwards
+                with metrics.stage("oci_get"):
+                    get_object_response = object_storage_client.get_object(
+                        namespace_name=OCI_NAMESPACE,
+                        bucket_name=OCI_BUCKET_NAME,
+                        object_name=object_name,
+                        range=None if cached is not None else byte_range,
+                        if_none_match=cached["etag"] if cached is not None and cached["etag"] else None
+                    )
+            except oci.exceptions.ServiceError as e:
+                if e.status == 304 and cached is not None:
+                    cached = document_cache.refresh(object_name, cached)
+                    source.update(cached=cached, etag=cached["etag"],
+                                  last_modified=cached["last_modified"] or source["last_modified"])
+                    return source
+                if e.status != 404 or attempt:
+                    raise
+                # The indexed object is gone; drop the stale entries and search once
+                pdf_index.forget(search_id, object_name)
+                document_cache.delete(object_name)
+                entry = None
+                continue
+            
+            source.update(response=get_object_response,
+                          etag=get_object_response.headers.get("ETag") or source["etag"],
+                          last_modified=get_object_response.headers.get("Last-Modified") or source["last_modified"])
+            return source
+        return None
         
+    except oci.exceptions.ServiceError as e:
+        if e.status == 416:
+            raise
+        print(f"Error searching/downloading PDF from OCI: {str(e)}")
+        return None
     except Exception as e:
         print(f"Error searching/downloading PDF from OCI: {str(e)}")
-        return None, None
+        return None
+
+
+def stream_object_body(get_object_response, chunk_size=64 * 1024, on_complete=None):
+    """
+    Yield an OCI object body as it arrives, releasing the connection when done
+    (or when the client disconnects).
+    
+    Args:
+        on_complete (callable): Called with the whole body once it has been sent completely
+    """
+    chunks = [] if on_complete else None
+    try:
+        for chunk in get_object_response.data.raw.stream(chunk_size, decode_content=False):
+            if chunks is not None:
+                chunks.append(chunk)
+            yield chunk
+    finally:
+        get_object_response.data.close()
+    if on_complete:
+        try:
+            on_complete(b''.join(chunks))
+        except Exception as e:
+            print(f"Error caching downloaded PDF: {str(e)}")
 
 # -------------------------------
 # EXTRACT DOCUMENT NAME FROM FILENAME
@@ -393,150 +852,226 @@ def extract_document_name(pdf_filename):
 # SEND EMAIL WITH ATTACHMENT
 # -------------------------------
 
-def create_file_from_base64(file_data, mime_type, file_name):
+# Extra attachments are decoded into a capped spool (see attachments.py)
+ATTACHMENT_MAX_BYTES = 25 * 1024 * 1024  # attachment_max_mb in config.json
+ATTACHMENT_SPOOL_BYTES = 1024 * 1024  # attachment_spool_memory_mb in config.json
+
+
+def attachment_filename(file_name, mime_type):
+    """
+    Give an attachment name the extension of its MIME type ("type/extension").
+
+    Returns:
+        str: file_name, with the extension appended if it does not end with it
+    """
+    # Extract extension from mime_type (after '/')
+    if '/' in mime_type:
+        extension = mime_type.split('/')[-1]
+    else:
+        extension = 'bin'  # Default extension if mime_type is invalid
+        print(f"Warning: Invalid MIME type format, using default extension: {extension}")
+
+    # Check if filename already has the correct extension
+    if file_name.lower().endswith(f'.{extension.lower()}'):
+        return file_name  # Already has correct extension
+    return f"{file_name}.{extension}"  # Add extension
+
+
+def decode_base64_attachment(file_data, mime_type, file_name, max_bytes=None):
     """
-    Decode base64 file data and create a file with proper extension.
+    Decode base64 file data into an in-memory attachment with a proper extension.
+
+    The text is decoded slice by slice into a spool that spills to disk, so decoding
+    holds one copy of the file at most, and stops as soon as it passes the size cap.
     
     Args:
         file_data (str): Base64 encoded file content
         mime_type (str): MIME type in format "type/extension" (e.g., "application/pdf")
         file_name (str): Base name for the file
+        max_bytes (int): Largest decoded attachment accepted (default: ATTACHMENT_MAX_BYTES)
     
     Returns:
-        str: Full file path with extension, or None if error
+        tuple: (filename with extension, file bytes), or None if error
+
+    Raises:
+        AttachmentTooLarge: If the decoded file is larger than max_bytes
     """
     try:
-        print(f"Creating file from base64 data...")
+        print("Decoding attachment from base64 data...")
         
         # Validate inputs
         if not file_data or not file_name or not mime_type:
             print("Error: Missing required parameters (file_data, file_name, or mime_type)")
             return None
         
-        # Extract extension from mime_type (after '/')
-        if '/' in mime_type:
-            extension = mime_type.split('/')[-1]
-        else:
-            extension = 'bin'  # Default extension if mime_type is invalid
-            print(f"Warning: Invalid MIME type format, using default extension: {extension}")
-        
-        # Check if filename already has the correct extension
-        if file_name.lower().endswith(f'.{extension.lower()}'):
-            full_filename = file_name  # Already has correct extension
-        else:
-            full_filename = f"{file_name}.{extension}"  # Add extension
+        full_filename = attachment_filename(file_name, mime_type)
         
         # Decode base64 data
-        file_content = base64.b64decode(file_data)
-        
-        # Write file to disk
-        with open(full_filename, 'wb') as f:
-            f.write(file_content)
+        spool = AttachmentSpool(max_bytes or ATTACHMENT_MAX_BYTES, ATTACHMENT_SPOOL_BYTES)
+        try:
+            decode_base64_to_spool(file_data, spool)
+            file_content = spool.getvalue()
+        finally:
+            spool.close()
         
-        return full_filename
+        return full_filename, file_content
         
+    except AttachmentError:
+        raise
     except Exception as e:
-        print(f" Error creating file from base64: {str(e)}")
+        print(f" Error decoding attachment from base64: {str(e)}")
         return None
 
 
-def send_email_with_attachment(pdf_path, html_content, reciever_email, request_id, subject='Service Request - Approved', cc_emails=None):
-    pdf_filename = os.path.basename(pdf_path)
-    document_name = extract_document_name(pdf_filename)
-    # Service Request [#RequestID] – Approved
+def guess_attachment_type(filename):
+    """
+    Determine the MIME type of an attachment from its file extension.
 
-    msg = EmailMessage()
-    msg['Subject'] = subject
-    msg['From'] = SENDER_EMAIL
-    msg['To'] = reciever_email
+    Returns:
+        tuple: (maintype, subtype)
+    """
+    file_ext = filename.split('.')[-1].lower()
+    if file_ext == 'pdf':
+        return 'application', 'pdf'
+    elif file_ext in ['jpg', 'jpeg']:
+        return 'image', 'jpeg'
+    elif file_ext == 'png':
+        return 'image', 'png'
+    elif file_ext in ['doc', 'docx']:
+        return 'application', 'msword'
+    return 'application', 'octet-stream'
 
-    if cc_emails:
-        if isinstance(cc_emails, list):
-            msg['Cc'] = ', '.join(cc_emails)
-        else:
-            msg['Cc'] = cc_emails
 
-    # Set the plain text fallback (optional)
-    msg.set_content("This email contains HTML content. Please view in an HTML-compatible email client.")
+def approval_message_assembly(html_content, subject, attachments):
+    """
+    Collect the parts the emails of one approval share, to be encoded once.
+
+    Args:
+        html_content (str): HTML body
+        subject (str): Email subject
+        attachments (dict): name -> (filename, bytes); "pdf" is the letter
+
+    Returns:
+        MessageAssembly: Builds a message per envelope from the shared parts
+    """
+    assembly = MessageAssembly(SENDER_EMAIL, subject, html_content)
+    for name, (filename, data) in attachments.items():
+        maintype, subtype = guess_attachment_type(filename)
+        assembly.add_attachment(name, filename, data, maintype, subtype)
+    return assembly
+
+
+def build_email_message(pdf_filename, pdf_data, html_content, reciever_email, subject='Service Request - Approved', cc_emails=None, extra_attachment=None):
+    """
+    Build the approval email with the PDF attached, plus the extra file when one is given.
 
-    # Add HTML content
-    msg.add_alternative(html_content, subtype='html')
+    Args:
+        pdf_filename (str): Attachment name of the PDF
+        pdf_data (bytes): The rendered PDF
+        extra_attachment (tuple): Optional (filename, bytes) attached after the PDF
 
-    # Attach PDF
-    with open(pdf_path, 'rb') as f:
-        file_data = f.read()
-    msg.add_attachment(file_data, maintype='application', subtype='pdf', filename=pdf_filename)
+    Returns:
+        tuple: (message bytes, from_addr, recipients) ready for the SMTP pool
+    """
+    attachments = {"pdf": (pdf_filename, pdf_data)}
+    if extra_attachment:
+        attachments["extra"] = extra_attachment
+    assembly = approval_message_assembly(html_content, subject, attachments)
+    return assembly.message([reciever_email], cc_emails, tuple(attachments))
 
-    # Send email
-    with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as smtp:
-        smtp.starttls()
-        smtp.login(SMTP_USERNAME, SMTP_PASSWORD)
-        smtp.send_message(msg)
 
+def send_email_with_attachment(pdf_filename, pdf_data, html_content, reciever_email, request_id, subject='Service Request - Approved', cc_emails=None):
+    # Service Request [#RequestID] – Approved
+    msg, from_addr, recipients = build_email_message(pdf_filename, pdf_data, html_content, reciever_email, subject, cc_emails)
+
+    # Send email over a pooled session
+    get_smtp_pool().send_message(msg, from_addr, recipients)
 
-def send_email_with_extra_attachment(pdf_path, html_content, reciever_email, request_id, subject='Service Request - Approved', cc_emails=None, extra_file_path=None):
+
+def send_email_with_extra_attachment(pdf_filename, pdf_data, html_content, reciever_email, request_id, subject='Service Request - Approved', cc_emails=None, extra_attachment=None):
     """
     Send email with PDF attachment plus an additional file attachment.
     This is used for sending to sender_email with the decoded base64 file.
     """
-    pdf_filename = os.path.basename(pdf_path)
-    document_name = extract_document_name(pdf_filename)
+    msg, from_addr, recipients = build_email_message(pdf_filename, pdf_data, html_content, reciever_email, subject,
+                                                     cc_emails, extra_attachment)
 
-    msg = EmailMessage()
-    msg['Subject'] = subject
-    msg['From'] = SENDER_EMAIL
-    msg['To'] = reciever_email
+    # Send email over a pooled session
+    get_smtp_pool().send_message(msg, from_addr, recipients)
 
-    if cc_emails:
-        if isinstance(cc_emails, list):
-            msg['Cc'] = ', '.join(cc_emails)
-        else:
-            msg['Cc'] = cc_emails
 
-    # Set the plain text fallback (optional)
-    msg.set_content("This email contains HTML content. Please view in an HTML-compatible email client.")
+# -------------------------------
+# DELIVERY OUTBOX
+# -------------------------------
+def task_receivers(payload):
+    """To recipients of an outbox email task; tasks queued before recipients were grouped have one."""
+    return payload.get("receiver_emails") or [payload["receiver_email"]]
 
-    # Add HTML content
-    msg.add_alternative(html_content, subtype='html')
 
-    # Attach main PDF
-    with open(pdf_path, 'rb') as f:
-        file_data = f.read()
-    msg.add_attachment(file_data, maintype='application', subtype='pdf', filename=pdf_filename)
+def build_task_email(payload, artifacts, assembly=None):
+    """
+    Build the email described by an outbox email task from the job's in-memory artifacts.
 
-    # Attach extra file if provided
-    if extra_file_path and os.path.exists(extra_file_path):
-        try:
-            extra_filename = os.path.basename(extra_file_path)
-            with open(extra_file_path, 'rb') as f:
-                extra_file_data = f.read()
-            
-            # Determine MIME type based on file extension
-            file_ext = extra_filename.split('.')[-1].lower()
-            if file_ext == 'pdf':
-                maintype, subtype = 'application', 'pdf'
-            elif file_ext in ['jpg', 'jpeg']:
-                maintype, subtype = 'image', 'jpeg'
-            elif file_ext == 'png':
-                maintype, subtype = 'image', 'png'
-            elif file_ext in ['doc', 'docx']:
-                maintype, subtype = 'application', 'msword'
-            else:
-                maintype, subtype = 'application', 'octet-stream'
-            
-            msg.add_attachment(extra_file_data, maintype=maintype, subtype=subtype, filename=extra_filename)
-        except Exception as e:
-            print(f"Error attaching extra file: {str(e)}")
+    Args:
+        assembly (MessageAssembly): Parts already encoded for another email of the same job
+
+    Returns:
+        tuple: (message bytes, from_addr, recipients) ready for the SMTP pool
+    """
+    if assembly is None:
+        assembly = approval_message_assembly(payload["html_content"], payload["subject"], artifacts)
+    extra_name = payload.get("extra_artifact")
+    attachments = ("pdf", extra_name) if extra_name and extra_name in artifacts else ("pdf",)
+    return assembly.message(task_receivers(payload), payload["cc_emails"], attachments)
+
+
+def deliver_email_task(payload, artifacts):
+    """Outbox handler: send one approval email, to all of its recipients, with the rendered PDF attached."""
+    get_smtp_pool().send_message(*build_task_email(payload, artifacts))
+    return {"receiver_emails": task_receivers(payload)}
+
+
+def deliver_upload_task(payload, artifacts):
+    """Outbox handler: archive the rendered PDF in OCI Object Storage."""
+    if not OCI_NAMESPACE or not get_object_storage_client():
+        # Retrying cannot help until the service is configured
+        return {"oci_object_name": None, "skipped": "OCI client not available or namespace not configured"}
+    _, pdf_data = artifacts["pdf"]
+    oci_object_name = upload_pdf_to_oci(pdf_data, payload["request_id"], payload["transaction_type"])
+    if not oci_object_name:
+        raise RuntimeError("Upload to OCI failed")
+    return {"oci_object_name": oci_object_name}
+
+
+
+def stop_workers():
+    """Stop outbox workers, render workers, stage executors and SMTP sessions when the server shuts down."""
+    outbox.stop()
+    if render_pool is not None:
+        render_pool.shutdown(wait=False)
+    stage_executors.shutdown(wait=False)
+    smtp_pool.close_all()
+    image_fetcher.close()
+    sm.stop_refresh()
 
-    # Send email
-    with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as smtp:
-        smtp.starttls()
-        smtp.login(SMTP_USERNAME, SMTP_PASSWORD)
-        smtp.send_message(msg)
+
+@asynccontextmanager
+async def lifespan(app):
+    """
+    Create the services and resume pending deliveries on startup; fetch the vault secrets
+    and connect to OCI in the background so the server accepts requests right away.
+    """
+    init_services()
+    outbox.start()
+    # Fetches the vault secrets now, then refreshes them before they expire
+    sm.start_refresh()
+    threading.Thread(target=warm_up_services, name="service-warm-up", daemon=True).start()
+    yield
+    stop_workers()
 
 
 # FastAPI app
-app = FastAPI(title="Employee Service Letter Generator")
+app = FastAPI(title="Employee Service Letter Generator", lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -544,6 +1079,17 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(metrics.TraceMiddleware)
+
+
+@app.exception_handler(StageSaturated)
+async def stage_saturated_handler(request, exc):
+    """Tell callers to back off when a blocking stage is full."""
+    return JSONResponse(
+        {"status": "error", "message": str(exc), "stage": exc.stage},
+        status_code=503,
+        headers={"Retry-After": "1"}
+    )
     
 
 class approve_letters(BaseModel):
@@ -570,39 +1116,26 @@ class approve_letters(BaseModel):
     file_data: str 
     transaction_creator_email : str
     notes_on_request: str # Base64 encoded file content
+    signatory: Optional[str] = None  # Key in signatories.json, default signatory if omitted
     # l2: str
     # l3: str
 
-@app.post("/approve_letters")
-async def generate_emp_service_letter(details: approve_letters):
-    employee_name= details.employee_name
-    designation= details.designation
-    receiver_email =details.receiver_email
-    sender_email = details.sender_email
-    cc_emails = details.cc_emails
-    request_id = details.request_id
-    request_type = details.request_type
-    department = details.department
-    approval_type = details.approval_type
-    transaction_status = details.transaction_status
-    book_language = details.book_language
-    transaction_creator = details.transaction_creator
-    transaction_creator_email = details.transaction_creator_email
-    sender = details.sender
-    receiver = details.receiver
-    transaction_date = details.transaction_date
-    transaction_type = details.transaction_type
-    confidentiality = details.confidentiality
-    subject = details.subject
-    file_name = details.file_name
-    mime_type = details.mime_type
-    file_data = details.file_data
-    notes_on_request= details.notes_on_request
-    # l2 = details.l2
-    # l3 = details.l3
-    today = datetime.today().strftime("%m-%d-%Y")
-    
-    # Generate PDF filename and email subject based on transaction_type
+
+class LetterGenerationError(Exception):
+    """Raised when the letter template or PDF for an approval cannot be produced."""
+
+    def __init__(self, message, status_code=500):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def get_document_naming(transaction_type, request_id):
+    """
+    Generate PDF filename and email subject based on transaction_type.
+
+    Returns:
+        tuple: (pdf_filename, email_subject)
+    """
     if transaction_type == "INNER BOOK":
         pdf_filename = f"{request_id}_Inner Book.pdf"
         email_subject = f"Inner Book - Request ID - {request_id} – Approved"
@@ -618,7 +1151,220 @@ async def generate_emp_service_letter(details: approve_letters):
     else:
         pdf_filename = f"{request_id}_Document.pdf"
         email_subject = f"Document - Request ID - {request_id} – Approved"
+    return pdf_filename, email_subject
+
+
+# Notes longer than this are normalized on the "prepare" stage instead of the event loop
+NORMALIZE_INLINE_MAX_CHARS = 32 * 1024
+
+
+async def prepare_letter(details, attachment=None):
+    """
+    Render the PDF and the email body for one approval and decode its extra attachment.
+
+    The PDF and the attachment stay in memory; nothing is written to the working directory.
+
+    Args:
+        details (approve_letters): The approval payload
+        attachment (AttachmentSpool): Extra attachment received as a file upload; when
+            None, the base64 file_data of the payload is used
+
+    Returns:
+        dict: Everything the deliveries need (PDF bytes, attachment, email content, recipients)
+
+    Raises:
+        LetterGenerationError: If the template cannot be filled, the PDF cannot be rendered
+            or the extra attachment is over the size cap
+        StageSaturated: If a blocking stage has no room for the work
+    """
+    today = datetime.today().strftime("%m-%d-%Y")
+    pdf_filename, email_subject = get_document_naming(details.transaction_type, details.request_id)
+
+    # Decode the extra attachment first, so an oversized one is refused before rendering
+    extra_attachment = None
+    try:
+        if attachment is not None:
+            if attachment.size:
+                extra_attachment = (attachment_filename(details.file_name or "attachment",
+                                                        details.mime_type or "application/octet-stream"),
+                                    await stage_executors.run("prepare", attachment.getvalue))
+        elif details.file_data and details.mime_type and details.file_name:
+            # (only if all parameters are provided)
+            extra_attachment = await stage_executors.run("prepare", decode_base64_attachment,
+                                                         details.file_data, details.mime_type, details.file_name)
+    except AttachmentError as e:
+        raise LetterGenerationError(str(e), status_code=e.status_code)
+
+    # Prepare email template data
+    email_data = {
+        "request_id": details.request_id,
+        "sender": details.sender,
+        "sender_email": details.sender_email,
+        "department": details.department,
+        "designation": details.designation,
+        "request_type": details.request_type,
+        "today": today
+    }
+    
+    # Load email content from template
+    html_mail_content = await stage_executors.run("prepare", get_email_content, email_data)
+    
+    # Strip paragraph tags and whitespace from the notes and find their images in one pass;
+    # short notes are cheaper to parse here than to hand to a thread
+    with metrics.stage("normalize_html"):
+        if len(details.notes_on_request or "") > NORMALIZE_INLINE_MAX_CHARS:
+            processed_notes = await stage_executors.run("prepare", normalize_html, details.notes_on_request)
+        else:
+            processed_notes = normalize_html(details.notes_on_request)
+    
+    # Signatory details and the pre-encoded signature image
+    try:
+        signatory = signature_registry.get(details.signatory)
+    except SignatureError as e:
+        raise LetterGenerationError(str(e), status_code=400 if details.signatory else 500)
+    
+    custom_data = {
+        "approval_type": details.approval_type,
+        "transaction_status": details.transaction_status,
+        "book_language": details.book_language,
+        "transaction_creator": details.transaction_creator,
+        "sender": details.sender,
+        "receiver": details.receiver,
+        "transaction_date": details.transaction_date,
+        "transaction_type": details.transaction_type,
+        "confidentiality": details.confidentiality,
+        "subject": details.subject,
+        "l1": processed_notes,
+        "l2": "",
+        "l3": "",
+        "signature_image": signatory["image"],
+        "signature_display": "block" if signatory["image"] else "none",
+        "signatory_name": signatory["name"],
+        "signatory_title": signatory["title"],
+        "signatory_designation": signatory["designation"]
+    }
+
+    # Remote images referenced in the notes are downloaded and inlined before the template is filled;
+    # letters without images never wait on the fetch stage
+    has_images = processed_notes.image_urls or any(
+        isinstance(value, str) and '<img' in value.lower() for value in custom_data.values())
+    letter_values = await stage_executors.run("fetch" if has_images else "prepare", inline_field_images, custom_data)
+    html_content = await stage_executors.run("prepare", fill_html_template, letter_values)
+    if not html_content:
+        raise LetterGenerationError("Template loading failed")
+
+    # A letter whose HTML was already rendered (e.g. a retried approval) reuses that PDF
+    backend = render_backend_for(details.transaction_type)
+    render_key = RenderCache.key(html_content, backend)
+    pdf_data = await stage_executors.run("storage", render_cache.get, render_key)
+    if pdf_data is None:
+        pdf_data = await stage_executors.run("render", render_letter, html_content, letter_values, backend)
+        if not pdf_data:
+            raise LetterGenerationError("PDF generation failed")
+        await stage_executors.run("storage", render_cache.put, render_key, pdf_data)
+
+    return {
+        "request_id": details.request_id,
+        "transaction_type": details.transaction_type,
+        "pdf_filename": pdf_filename,
+        "pdf_data": pdf_data,
+        "extra_attachment": extra_attachment,
+        "html_mail_content": html_mail_content,
+        "email_subject": email_subject,
+        "cc_emails": details.cc_emails,
+        "transaction_creator_email": details.transaction_creator_email,
+        "sender_email": details.sender_email
+    }
+
+
+def build_delivery_job(letter):
+    """
+    Describe the deliveries for a prepared letter: the emails and the OCI upload.
+
+    The transaction creator and the sender get the same email unless the sender's
+    copy carries the extra attachment; identical emails are one task, sent as one
+    message with both recipients.
+
+    Returns:
+        tuple: (artifacts, tasks) in the form Outbox.create_job expects
+    """
+    # The same buffers back every attachment and the upload
+    artifacts = {"pdf": (letter["pdf_filename"], letter["pdf_data"])}
+
+    extra_artifact = None
+    if letter["extra_attachment"]:
+        artifacts["extra"] = letter["extra_attachment"]
+        extra_artifact = "extra"
+
+    email_payload = {
+        "html_content": letter["html_mail_content"],
+        "request_id": letter["request_id"],
+        "subject": letter["email_subject"],
+        "cc_emails": letter["cc_emails"]
+    }
+    if extra_artifact is None:
+        # Email to receiver (transaction creator) and sender with the PDF only
+        receivers = [(recipient_addresses(letter["transaction_creator_email"], letter["sender_email"]), None)]
+    else:
+        # Email to receiver (transaction creator) with the PDF only, to sender with the additional file as well
+        receivers = [(recipient_addresses(letter["transaction_creator_email"]), None),
+                     (recipient_addresses(letter["sender_email"]), extra_artifact)]
+    tasks = [("email", dict(email_payload, receiver_emails=addresses, extra_artifact=extra))
+             for addresses, extra in receivers if addresses]
+    tasks.append(("upload", {"request_id": letter["request_id"], "transaction_type": letter["transaction_type"]}))
+    return artifacts, tasks
+
+
+def enqueue_delivery_job(letter, request_hash=None):
+    """
+    Store the rendered PDF (and optional extra attachment) in the outbox together with
+    the two emails and the OCI upload that must be delivered for it.
+
+    Args:
+        request_hash (str): payload_hash of the approval; a job that already exists for
+            it is returned instead of queueing the deliveries again
+
+    Returns:
+        str: Outbox job ID
+    """
+    artifacts, tasks = build_delivery_job(letter)
+    with metrics.stage("outbox_write"):
+        return outbox.create_job(letter["request_id"], artifacts, tasks, payload_hash=request_hash)
+
+
+# Concurrent retries of one approval wait for the first instead of rendering and queueing again
+approval_flights = SingleFlight()
+
+
+async def accept_letter(details, request_hash, attachment=None):
+    """
+    Render and queue an approval once per request_id and payload.
+
+    Args:
+        attachment (AttachmentSpool): Extra attachment of a multipart approval
+
+    Returns:
+        tuple: (response body, replayed) where replayed is True if an existing job was returned
+    """
+    job_id = await stage_executors.run("storage", outbox.find_job, details.request_id, request_hash)
+    if job_id is None:
+        letter = await prepare_letter(details, attachment)
+        pdf_filename = letter["pdf_filename"]
+        # Record the artifacts and delivery tasks; emails and upload run in the background
+        job_id = await stage_executors.run("storage", enqueue_delivery_job, letter, request_hash)
+        replayed = False
+    else:
+        pdf_filename, _ = get_document_naming(details.transaction_type, details.request_id)
+        replayed = True
+    return {
+        "status": "accepted",
+        "job_id": job_id,
+        "status_url": f"/jobs/{job_id}",
+        "pdf_filename": pdf_filename
+    }, replayed
+
 
+def print_approval(details, file_data_size):
     print(f"""
 Employee Details:
 -----------------
@@ -643,99 +1389,404 @@ Confidentiality     : {details.confidentiality}
 subject             : {details.subject}
 File Name           : {details.file_name}
 MIME Type          : {details.mime_type}
-File Data Size     : {len(details.file_data)} chars
+File Data Size     : {file_data_size}
 notes_on_request   : {details.notes_on_request}
 transaction_creator_email : {details.transaction_creator_email}
 """)
 
 
-# Transaction Creator Email: {details.transaction_creater_email}
+async def approve(details, request_hash, attachment=None):
+    """Accept an approval (once per request_id and payload) and build the 202 response."""
+    try:
+        # Retries (same request_id and payload) get the job of the first attempt
+        (body, replayed), shared = await approval_flights.run(
+            (details.request_id, request_hash), lambda: accept_letter(details, request_hash, attachment)
+        )
+        return JSONResponse(body, status_code=202,
+                            headers={"Idempotent-Replayed": "true"} if replayed or shared else None)
+    except LetterGenerationError as e:
+        return JSONResponse({"status": "error", "message": str(e)}, status_code=e.status_code)
+    except StageSaturated:
+        raise
+    except Exception as e:
+        traceback.print_exc()
+        return JSONResponse({"status": "error", "message": str(e)}, status_code=500)
+
+
+@app.post("/approve_letters", status_code=202)
+async def generate_emp_service_letter(details: approve_letters):
+    print_approval(details, f"{len(details.file_data)} chars")
+    # A digest of file_data stands in for it, so the base64 text is not serialized and encoded again
+    fields = details.model_dump()
+    file_data = fields.pop("file_data").strip()
+    request_hash = payload_hash(dict(fields, file_data_sha256=text_sha256(file_data) if file_data else None))
+    return await approve(details, request_hash)
+
+
+@app.post("/approve_letters/upload", status_code=202)
+async def generate_emp_service_letter_upload(request: Request):
+    """
+    /approve_letters with the extra attachment uploaded as a file instead of base64 JSON.
+
+    The body is multipart/form-data with a ``details`` part holding the /approve_letters
+    JSON (file_data may be omitted) and an optional ``file`` part. The file is streamed
+    into a spool capped at attachment_max_mb while the body arrives; its filename and
+    Content-Type are used when the details carry no file_name or mime_type.
+    """
+    content_length = request.headers.get("content-length", "")
+    if content_length.isdigit() and int(content_length) > ATTACHMENT_MAX_BYTES + MAX_DETAILS_BYTES:
+        return JSONResponse({"status": "error", "message": "Request body is too large"}, status_code=413)
 
-    
     try:
-        # Prepare email template data
-        email_data = {
-            "request_id": request_id,
-            "sender": sender,
-            "sender_email": sender_email,
-            "department": department,
-            "designation": designation,
-            "request_type": request_type,
-            "today": today
-        }
-        
-        # Load email content from template
-        html_mail_content = get_email_content(email_data)
-        
-        # Process notes_on_request to remove paragraph tags
-        processed_notes = remove_paragraph_tags(notes_on_request)
-        
-        # Convert signature image to base64
-        signature_image_base64 = ""
-        signature_image_path = "/home/growlt307/Desktop/oracle_poc2/Royal-poc/sign.jpg"
+        upload = MultipartApproval(request.headers.get("content-type", ""), ATTACHMENT_MAX_BYTES, ATTACHMENT_SPOOL_BYTES)
+    except AttachmentError as e:
+        return JSONResponse({"status": "error", "message": str(e)}, status_code=e.status_code)
+
+    try:
+        async for chunk in request.stream():
+            if upload.on_disk:
+                # Past the memory threshold every write goes to the spool file
+                await stage_executors.run("storage", upload.write, chunk)
+            else:
+                upload.write(chunk)
+        fields = upload.finish()
+
+        attachment = upload.attachment
+        fields = dict(fields, file_data="")
+        if attachment is not None:
+            fields["file_name"] = fields.get("file_name") or upload.filename or "attachment"
+            fields["mime_type"] = fields.get("mime_type") or upload.content_type or "application/octet-stream"
+        fields.setdefault("file_name", "")
+        fields.setdefault("mime_type", "")
         try:
-            if os.path.exists(signature_image_path):
-                with open(signature_image_path, 'rb') as img_file:
-                    signature_data = base64.b64encode(img_file.read()).decode('utf-8')
-                    signature_image_base64 = f"data:image/jpeg;base64,{signature_data}"
-        except Exception as e:
-            signature_image_base64 = ""
-        
-        custom_data = {
-            "approval_type": approval_type,
-            "transaction_status": transaction_status,
-            "book_language": book_language,
-            "transaction_creator": transaction_creator,
-            "sender": sender,
-            "receiver": receiver,
-            "transaction_date": transaction_date,
-            "transaction_type": transaction_type,
-            "confidentiality": confidentiality,
-            "subject": subject,
-            "l1": processed_notes,
-            "l2": "",
-            "l3": "",
-            "signature_image": signature_image_base64,
-            "signature_display": "block" if signature_image_base64 else "none",
-            "signatory_name": "Hardik Seth",
-            "signatory_title": "Senior Manager",
-            "signatory_designation": ""
-        }
-
-        html_content = get_html_content(custom_data)
-    
-        if html_content:
-            pdf_path = html_to_pdf(html_content, pdf_filename)
-            if not pdf_path:
-                return JSONResponse({"status": "error", "message": "PDF generation failed"}, status_code=500)
-        else:
-            return JSONResponse({"status": "error", "message": "Template loading failed"}, status_code=500)
+            details = approve_letters(**fields)
+        except ValidationError as e:
+            raise RequestValidationError(e.errors())
 
-        # Create file from base64 data (only if all parameters are provided)
-        extra_file_path = None
-        if file_data and mime_type and file_name:
-            extra_file_path = create_file_from_base64(file_data, mime_type, file_name)
-        
-        # Send email to receiver (current flow - no change)
-        send_email_with_attachment(pdf_path, html_mail_content, transaction_creator_email, request_id, email_subject, cc_emails)
-        
-        # Send email to sender with additional file attachment only if file was created successfully
-        if extra_file_path and os.path.exists(extra_file_path):
-            send_email_with_extra_attachment(pdf_path, html_mail_content, sender_email, request_id, email_subject, cc_emails, extra_file_path)
-        else:
-            send_email_with_attachment(pdf_path, html_mail_content, sender_email, request_id, email_subject, cc_emails)
+        print_approval(details, f"{attachment.size if attachment is not None else 0} bytes (upload)")
+        # The file's digest stands in for the base64 file_data in the payload hash
+        request_hash = payload_hash(dict(details.model_dump(),
+                                         file_sha256=attachment.hexdigest() if attachment is not None else None))
+        return await approve(details, request_hash, attachment)
+    except AttachmentError as e:
+        return JSONResponse({"status": "error", "message": str(e)}, status_code=e.status_code)
+    finally:
+        upload.close()
+
+
+# -------------------------------
+# BATCH APPROVALS
+# -------------------------------
+async def deliver_letter_now(letter, mail_batcher):
+    """
+    Deliver a prepared letter inside the request: its emails go through the shared
+    mail batcher and the upload runs concurrently with them.
 
-        # Upload PDF to OCI bucket after sending emails
-        oci_object_name = upload_pdf_to_oci(pdf_path, request_id, transaction_type)
+    Deliveries that fail are handed to the outbox so they are retried in the background.
+    Emails whose delivery could not be confirmed (DeliveryUnknown) are not retried, so
+    a recipient does not get the letter twice; they are listed in the result instead.
 
-        return JSONResponse({
-            "status": "success", 
-            "pdf_path": pdf_path,
-            "oci_object_name": oci_object_name
+    Returns:
+        dict: Per-item result for the batch response
+    """
+    artifacts, tasks = build_delivery_job(letter)
+    email_tasks = [task for task in tasks if task[0] == "email"]
+    upload_task = next(task for task in tasks if task[0] == "upload")
+
+    def build_messages():
+        # The emails of a letter share their body and PDF, encoded once
+        assembly = approval_message_assembly(email_tasks[0][1]["html_content"], email_tasks[0][1]["subject"], artifacts)
+        return [build_task_email(payload, artifacts, assembly) for _, payload in email_tasks]
+
+    messages = await stage_executors.run("prepare", build_messages) if email_tasks else []
+    email_results, upload_result = await asyncio.gather(
+        mail_batcher.send(messages),
+        stage_executors.run("storage", deliver_upload_task, upload_task[1], artifacts),
+        return_exceptions=True
+    )
+    if isinstance(email_results, BaseException):
+        email_results = [DeliveryUnknown(email_results)] * len(email_tasks)
+
+    failed_tasks = [task for task, error in zip(email_tasks, email_results)
+                    if error is not None and not isinstance(error, DeliveryUnknown)]
+    errors = [str(error) for error in email_results
+              if error is not None and not isinstance(error, DeliveryUnknown)]
+    unconfirmed = [receiver for (_, payload), error in zip(email_tasks, email_results)
+                   if isinstance(error, DeliveryUnknown) for receiver in task_receivers(payload)]
+    if isinstance(upload_result, BaseException):
+        failed_tasks.append(upload_task)
+        errors.append(str(upload_result))
+        upload_result = {}
+
+    result = {
+        "request_id": letter["request_id"],
+        "status": "success",
+        "pdf_filename": letter["pdf_filename"],
+        "emails_sent": sum(len(task_receivers(payload)) for (_, payload), error in zip(email_tasks, email_results)
+                           if error is None),
+        "oci_object_name": upload_result.get("oci_object_name")
+    }
+    if unconfirmed:
+        print(f"Delivery of request {letter['request_id']} to {', '.join(unconfirmed)} could not be confirmed, "
+              f"not retrying it")
+        result.update({
+            "status": "unconfirmed",
+            "unconfirmed_emails": unconfirmed,
+            "message": "Delivery of some emails could not be confirmed; they were not retried to avoid duplicates"
         })
-    except Exception as e:
-        traceback.print_exc()
-        return JSONResponse({"status": "error", "message": str(e)}, status_code=500)
+    if failed_tasks:
+        job_id = await stage_executors.run("storage", outbox.create_job, letter["request_id"], artifacts, failed_tasks)
+        result.update({
+            "status": "accepted",
+            "message": "Some deliveries failed and were queued for retry: " + "; ".join(errors),
+            "job_id": job_id,
+            "status_url": f"/jobs/{job_id}"
+        })
+    return result
+
+
+@app.post("/approve_letters/batch")
+async def generate_emp_service_letters_batch(items: List[approve_letters]):
+    """
+    Generate and deliver many letters in one call.
+
+    PDFs are rendered in parallel across the render workers, emails from all items are
+    grouped onto shared SMTP sessions, and uploads run concurrently. One JSON line is
+    streamed back per item as soon as that item finishes (NDJSON), in completion order.
+    """
+    print(f"Batch approval received with {len(items)} item(s)")
+    # Keep every render worker busy without overrunning the render stage's admission limit
+    concurrency = asyncio.Semaphore(max(1, stage_executors["render"].workers))
+
+    async def process(index, details, mail_batcher):
+        async with concurrency:
+            try:
+                letter = await prepare_letter(details)
+                result = await deliver_letter_now(letter, mail_batcher)
+            except StageSaturated as e:
+                result = {"request_id": details.request_id, "status": "error", "message": str(e), "retry": True}
+            except LetterGenerationError as e:
+                result = {"request_id": details.request_id, "status": "error", "message": str(e)}
+            except Exception as e:
+                traceback.print_exc()
+                result = {"request_id": details.request_id, "status": "error", "message": str(e)}
+        return dict(result, index=index)
+
+    async def stream_results():
+        mail_batcher = SMTPBatcher(get_smtp_pool(), lambda fn, *args: stage_executors.run("mail", fn, *args),
+                                   max_batch=config.get("smtp_batch_size", 20))
+        try:
+            pending = [asyncio.ensure_future(process(index, details, mail_batcher)) for index, details in enumerate(items)]
+            for finished in asyncio.as_completed(pending):
+                yield json.dumps(await finished) + "\n"
+        finally:
+            await mail_batcher.close()
+
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+
+# -------------------------------
+# DELIVERY JOB STATUS
+# -------------------------------
+@app.get("/jobs/{job_id}")
+async def get_job_status(job_id: str):
+    """
+    Report the delivery status of an approval accepted by /approve_letters.
+
+    Returns:
+        JSONResponse: Overall job status plus the status, attempts and result of each task
+    """
+    job = await stage_executors.run("storage", outbox.get_job, job_id)
+    if job is None:
+        return JSONResponse({"status": "error", "message": f"No job found with ID: {job_id}"}, status_code=404)
+    return JSONResponse(job)
+
+
+# -------------------------------
+# RENDER POOL STATS
+# -------------------------------
+@app.get("/render_stats")
+async def render_stats():
+    """
+    Report render queue depth, worker recycling counters and per-job render times, and
+    in overlay mode the letters stamped onto letterheads and those rendered in full.
+    """
+    stats = render_pool.stats() if render_pool is not None else {"status": "idle", "queue_depth": 0}
+    if letterhead_renderer is not None:
+        stats["letterhead"] = letterhead_renderer.stats()
+    return JSONResponse(stats)
+
+
+def register_metric_collectors():
+    """Export the counters the services already keep; they are read on every /metrics scrape."""
+    def cache_events():
+        samples = []
+        for name, cache in (("image", image_cache), ("document", document_cache), ("render", render_cache)):
+            for event, value in cache.stats().items():
+                # "hits" is the sum of the per-level hits
+                if isinstance(value, int) and event != "hits":
+                    samples.append(({"cache": name, "event": event}, value))
+        return samples
+
+    def smtp_events():
+        return [({"event": event}, value) for event, value in smtp_pool.stats().items() if event != "idle"]
+
+    def letterhead_events():
+        if letterhead_renderer is None:
+            return []
+        return [({"event": event}, value) for event, value in letterhead_renderer.stats().items()
+                if isinstance(value, int)]
+
+    def stage_load(key):
+        return lambda: [({"stage": name}, values[key]) for name, values in stage_executors.stats().items()]
+
+    metrics.REGISTRY.add_collector("letters_cache_events_total", "Cache hits, misses and stores per cache.",
+                                   "counter", cache_events)
+    metrics.REGISTRY.add_collector("letters_smtp_events_total", "SMTP session connects, reuses and messages sent.",
+                                   "counter", smtp_events)
+    metrics.REGISTRY.add_collector("letters_smtp_idle_sessions", "Logged-in SMTP sessions waiting in the pool.",
+                                   "gauge", lambda: [({}, smtp_pool.stats()["idle"])])
+    metrics.REGISTRY.add_collector("letters_stage_in_flight", "Blocking calls running or queued per stage executor.",
+                                   "gauge", stage_load("in_flight"))
+    metrics.REGISTRY.add_collector("letters_stage_rejected_total", "Calls rejected because a stage executor was full.",
+                                   "counter", stage_load("rejected"))
+    metrics.REGISTRY.add_collector("letters_render_queue_depth", "PDF render jobs waiting for a worker.",
+                                   "gauge", lambda: [({}, render_pool.stats()["queue_depth"] if render_pool else 0)])
+    metrics.REGISTRY.add_collector("letters_letterhead_events_total",
+                                   "Letters stamped onto a letterhead, overflows and unusable letterheads "
+                                   "rendered in full, and letterheads rendered.",
+                                   "counter", letterhead_events)
+    metrics.REGISTRY.add_collector("letters_approvals_collapsed_total",
+                                   "Approvals answered by a duplicate already in flight.",
+                                   "counter", lambda: [({}, approval_flights.stats()["collapsed"])])
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """
+    Stage latency and PDF size histograms plus service counters in the Prometheus text format.
+    """
+    body = await stage_executors.run("storage", metrics.REGISTRY.render)
+    return Response(body, media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.get("/idempotency_stats")
+async def idempotency_stats():
+    """
+    Report approvals collapsed into an in-flight duplicate and render cache hits.
+    """
+    return JSONResponse({"approvals": approval_flights.stats(),
+                         "render_cache": await stage_executors.run("storage", render_cache.stats)})
+
+
+@app.get("/stage_stats")
+async def stage_stats():
+    """
+    Report in-flight and rejected calls for each blocking stage executor.
+    """
+    return JSONResponse(stage_executors.stats())
+
+
+@app.get("/image_cache_stats")
+async def image_cache_stats():
+    """
+    Report image cache hits per level, revalidations, downloads and failures.
+    """
+    return JSONResponse(image_cache.stats())
+
+
+@app.get("/smtp_stats")
+async def smtp_stats():
+    """
+    Report SMTP session connects, reuses, reconnects and messages sent.
+    """
+    return JSONResponse(smtp_pool.stats())
+
+
+@app.get("/pdf_index_stats")
+async def pdf_index_stats():
+    """
+    Report indexed PDFs, lookup hits and misses and the last rebuild from the bucket.
+    """
+    return JSONResponse(await stage_executors.run("storage", pdf_index.stats))
+
+
+@app.get("/pdf_cache_stats")
+async def pdf_cache_stats():
+    """
+    Report document cache hits per level, misses, revalidations and evictions.
+    """
+    return JSONResponse(await stage_executors.run("storage", document_cache.stats))
+
+
+def check_dependencies():
+    """
+    Report each dependency without contacting it, as "ok", "starting" (not ready yet),
+    "error" (with the last error), "idle" (started on first use) or "disabled" (not configured).
+    """
+    if config is None:
+        return {"config": {"status": "starting"}}
+    checks = {"config": {"status": "ok"}}
+
+    checks["templates"] = {"status": "ok"}
+    for path in (LETTER_TEMPLATE_PATH, EMAIL_TEMPLATE_PATH):
+        try:
+            template_registry.get(path)
+        except TemplateError as e:
+            checks["templates"] = {"status": "error", "error": str(e)}
+
+    try:
+        signature_registry.get()
+        checks["signatures"] = {"status": "ok"}
+    except SignatureError as e:
+        checks["signatures"] = {"status": "error", "error": str(e)}
+
+    vault = sm.stats()
+    if vault["age_seconds"] is not None:
+        checks["vault"] = {"status": "ok", "age_seconds": vault["age_seconds"]}
+    elif vault["last_error"]:
+        checks["vault"] = {"status": "error", "error": vault["last_error"]}
+    else:
+        checks["vault"] = {"status": "starting"}
+
+    if _smtp_credentials_loaded:
+        checks["smtp"] = {"status": "ok", "idle_sessions": smtp_pool.stats()["idle"]}
+    else:
+        checks["smtp"] = {"status": "error" if checks["vault"]["status"] == "error" else "starting",
+                          "error": "no credentials from the vault yet"}
+
+    if not OCI_NAMESPACE:
+        checks["object_storage"] = {"status": "disabled"}
+    elif object_storage_client is not None:
+        checks["object_storage"] = {"status": "ok"}
+    elif _oci_client_error:
+        checks["object_storage"] = {"status": "error", "error": _oci_client_error}
+    else:
+        checks["object_storage"] = {"status": "starting"}
+
+    checks["outbox"] = {"status": "ok" if outbox.running() else "error"}
+    checks["render_pool"] = {"status": "ok" if render_pool is not None else "idle"}
+    return checks
+
+
+@app.get("/health/live")
+async def health_live():
+    """
+    Liveness: the process is up and its event loop answers.
+    """
+    return JSONResponse({"status": "alive"})
+
+
+@app.get("/health/ready")
+async def health_ready():
+    """
+    Readiness: 200 once every dependency is usable, otherwise 503 with the ones that are not.
+    """
+    # The checks take locks shared with blocking work (template reloads, vault refreshes); keep them off the loop
+    checks = await asyncio.get_running_loop().run_in_executor(None, check_dependencies)
+    ready = all(check["status"] in ("ok", "idle", "disabled") for check in checks.values())
+    return JSONResponse({"status": "ready" if ready else "not_ready", "dependencies": checks},
+                        status_code=200 if ready else 503)
 
 
 # -------------------------------
@@ -744,58 +1795,150 @@ transaction_creator_email : {details.transaction_creator_email}
 class GetPDFRequest(BaseModel):
     id: str
 
+async def serve_pdf(search_id, range_header=None, if_range=None, if_none_match=None, if_modified_since=None):
+    """
+    Build the response for an archived PDF: ``304`` when the client's copy is current,
+    otherwise the cached copy or the OCI download stream, whole or as a single range.
+    
+    Every success carries a strong ``ETag``, ``Last-Modified`` and ``Cache-Control``.
+    """
+    search_id = search_id.strip()
+    
+    if not search_id:
+        return JSONResponse(
+            {"status": "error", "message": "ID parameter is required"}, 
+            status_code=400
+        )
+    
+    byte_range = parse_byte_range(range_header)
+    
+    # Look up the PDF in the cache, or open the OCI download stream
+    try:
+        source = await stage_executors.run(
+            "storage", open_pdf_by_id, search_id, byte_range, if_none_match, if_modified_since, if_range)
+    except oci.exceptions.ServiceError as e:
+        if e.status != 416:
+            raise
+        entry = await stage_executors.run("storage", pdf_index.lookup, search_id)
+        headers = {"Content-Range": f"bytes */{entry['size']}"} if entry and entry["size"] is not None else {}
+        return JSONResponse(
+            {"status": "error", "message": "Requested range not satisfiable"},
+            status_code=416,
+            headers=headers
+        )
+    
+    if source is None:
+        return JSONResponse(
+            {"status": "error", "message": f"No PDF found with ID: {search_id}"}, 
+            status_code=404
+        )
+    
+    get_object_response = source["response"]
+    etag = strong_etag(source["etag"])
+    headers = {"Cache-Control": PDF_CACHE_CONTROL}
+    if etag:
+        headers["ETag"] = etag
+    if source["last_modified"]:
+        headers["Last-Modified"] = source["last_modified"]
+    
+    if source["not_modified"] or is_not_modified(etag, source["last_modified"], if_none_match, if_modified_since):
+        if get_object_response is not None:
+            get_object_response.data.close()
+        return Response(status_code=304, headers=headers)
+    
+    headers.update({
+        "Content-Disposition": f'attachment; filename="{os.path.basename(source["object_name"])}"',
+        "Accept-Ranges": "bytes"
+    })
+    
+    cached = source["cached"]
+    if cached is not None:
+        # Serve (a range of) the cached copy; a stale If-Range means the whole document
+        data = cached["data"]
+        status_code = 200
+        if byte_range and range_applies(if_range, etag, source["last_modified"]):
+            offsets = resolve_byte_range(byte_range, len(data))
+            if offsets is None:
+                return JSONResponse(
+                    {"status": "error", "message": "Requested range not satisfiable"},
+                    status_code=416,
+                    headers={"Content-Range": f"bytes */{len(data)}"}
+                )
+            start, end = offsets
+            headers["Content-Range"] = f"bytes {start}-{end}/{len(data)}"
+            data = data[start:end + 1]
+            status_code = 206
+        return Response(content=data, status_code=status_code, media_type='application/pdf', headers=headers)
+    
+    # Pass the object's length and range through to the client
+    for name in ("Content-Length", "Content-Range"):
+        value = get_object_response.headers.get(name)
+        if value:
+            headers[name] = value
+    
+    # Fill the cache from complete, cacheable downloads while they stream
+    on_complete = None
+    content_length = get_object_response.headers.get("Content-Length")
+    if get_object_response.status == 200 and content_length and document_cache.cacheable(int(content_length)):
+        on_complete = lambda data: document_cache.put(source["object_name"], data, etag=source["etag"],
+                                                      last_modified=source["last_modified"])
+    
+    return StreamingResponse(
+        stream_object_body(get_object_response, on_complete=on_complete),
+        status_code=206 if get_object_response.status == 206 else 200,
+        media_type='application/pdf',
+        headers=headers
+    )
+
+
 @app.post("/get_pdf_by_id")
-async def get_pdf_by_id(request: GetPDFRequest):
+async def get_pdf_by_id(request: GetPDFRequest, range: Optional[str] = Header(None),
+                        if_range: Optional[str] = Header(None), if_none_match: Optional[str] = Header(None),
+                        if_modified_since: Optional[str] = Header(None)):
     """
-    Search for PDF file in OCI bucket by ID and return it.
+    Search for PDF file in OCI bucket by ID and stream it to the client.
+    
+    The OCI download is passed straight through, so the first bytes are sent as soon as
+    they arrive and nothing is written to disk. A single ``Range: bytes=...`` request
+    is answered with ``206 Partial Content``, and a matching ``If-None-Match`` /
+    ``If-Modified-Since`` with ``304 Not Modified``.
     
     Args:
         request: GetPDFRequest containing the ID to search for
+        range: Optional HTTP Range header
     
     Returns:
-        FileResponse: PDF file if found, error message if not found
+        StreamingResponse: PDF file if found, error message if not found
     """
     try:
-        search_id = request.id.strip()
-        
-        if not search_id:
-            return JSONResponse(
-                {"status": "error", "message": "ID parameter is required"}, 
-                status_code=400
-            )
-        
-        # Search and download PDF from OCI
-        file_path, object_name = search_and_download_pdf_by_id(search_id)
-        
-        if not file_path or not object_name:
-            return JSONResponse(
-                {"status": "error", "message": f"No PDF found with ID starting with: {search_id}"}, 
-                status_code=404
-            )
-        
-        # Return the file as response
-        def cleanup_file():
-            """Clean up temporary file after response is sent"""
-            try:
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-            except Exception as e:
-                print(f"Error cleaning up file {file_path}: {str(e)}")
-        
-        # Return file response with cleanup
-        response = FileResponse(
-            path=file_path,
-            filename=object_name,
-            media_type='application/pdf',
-            background=cleanup_file
-        )
-        
-        return response
-        
+        return await serve_pdf(request.id, range, if_range, if_none_match, if_modified_since)
+    except StageSaturated:
+        raise
     except Exception as e:
         print(f"Error in get_pdf_by_id API: {str(e)}")
         traceback.print_exc()
         return JSONResponse(
             {"status": "error", "message": f"Internal server error: {str(e)}"}, 
             status_code=500
-        )
\ No newline at end of file
+        )
+
+
+@app.get("/pdf/{request_id}")
+async def get_pdf(request_id: str, range: Optional[str] = Header(None),
+                  if_range: Optional[str] = Header(None), if_none_match: Optional[str] = Header(None),
+                  if_modified_since: Optional[str] = Header(None)):
+    """
+    Cacheable GET variant of /get_pdf_by_id: the request ID is in the path, so browsers,
+    CDNs and proxies can store the response and revalidate it with its ETag.
+    """
+    try:
+        return await serve_pdf(request_id, range, if_range, if_none_match, if_modified_since)
+    except StageSaturated:
+        raise
+    except Exception as e:
+        print(f"Error in get_pdf API: {str(e)}")
+        traceback.print_exc()
+        return JSONResponse(
+            {"status": "error", "message": f"Internal server error: {str(e)}"}, 
+            status_code=500
+        )
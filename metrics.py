@@ -0,0 +1,263 @@
+"""
+metrics.py
+
+This module times the stages of a request and exposes the results in the
+Prometheus text exposition format (served on ``/metrics``):
+
+    with metrics.stage("render"):                  # letters_stage_seconds{stage="render"}
+        pdf = render(html)
+    metrics.PDF_BYTES.observe(len(pdf))            # letters_pdf_bytes
+
+Recording a stage is a ``perf_counter`` pair, a bisect into the bucket bounds and
+a locked increment, a few microseconds in all. Values that the services already
+count (cache hits, SMTP sessions, stage executor load) are not recorded twice:
+collectors registered with ``REGISTRY.add_collector`` read them at scrape time.
+
+A request can also be traced: TraceMiddleware starts a Trace for requests that
+send ``X-Trace: 1`` (or for a sampled share of all requests), every stage timed
+while serving it is added as a span, the spans are returned in a ``Server-Timing``
+header and the whole trace is printed as one JSON line when the response is done.
+The trace lives in a context variable, so stages timed in executor threads are
+attached to it as long as the context is copied into the thread (StageExecutors
+and ImageFetcher do this).
+
+Classes:
+    Histogram: Cumulative-bucket histogram with optional labels.
+    Registry: Metrics and scrape-time collectors rendered as Prometheus text.
+    Trace: Spans of the stages that ran for one request.
+    TraceMiddleware: ASGI middleware that starts traces and reports them.
+
+Configuration (config.json, optional):
+    trace_sample_rate  Share of requests traced without an X-Trace header (default: 0)
+"""
+import bisect
+import contextvars
+import json
+import random
+import threading
+import time
+import uuid
+
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = tuple(16 * 1024 * 4 ** power for power in range(7))  # 16 KiB .. 64 MiB
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{str(value)}"' for name, value in labels) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram(object):
+    """
+    Prometheus histogram: per label set, a count per bucket plus the sum and count.
+    """
+    def __init__(self, name, documentation, buckets=LATENCY_BUCKETS, labelnames=()):
+        """
+        Args:
+            name (str): Metric name
+            documentation (str): HELP text
+            buckets (tuple): Upper bounds of the buckets; +Inf is added
+            labelnames (tuple): Names of the labels passed to observe()
+        """
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets))
+        self.labelnames = tuple(labelnames)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def collect(self):
+        """
+        Returns:
+            list: Exposition lines for this histogram
+        """
+        with self._lock:
+            series = {labels: (list(counts), total) for labels, (counts, total) in self._series.items()}
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for labelvalues, (counts, total) in sorted(series.items()):
+            labels = list(zip(self.labelnames, labelvalues))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(labels + [('le', _format_value(bound))])} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {cumulative}")
+        return lines
+
+
+class Registry(object):
+    """
+    Histograms plus collectors that report values kept elsewhere, rendered on scrape.
+    """
+    def __init__(self):
+        self._metrics = []
+        self._collectors = {}
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, name, documentation, kind, collect):
+        """
+        Report a metric whose values are read at scrape time. Adding a collector with
+        the name of an existing one replaces it.
+
+        Args:
+            name (str): Metric name
+            documentation (str): HELP text
+            kind (str): Prometheus type ("counter" or "gauge")
+            collect: Function returning a list of (labels dict, value) samples
+        """
+        self._collectors[name] = (documentation, kind, collect)
+
+    def render(self):
+        """
+        Returns:
+            str: Every metric in the Prometheus text exposition format
+        """
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.collect())
+        for name, (documentation, kind, collect) in list(self._collectors.items()):
+            try:
+                samples = collect()
+            except Exception as e:
+                print(f"Error collecting metric {name}: {str(e)}")
+                continue
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                lines.append(f"{name}{_format_labels(sorted(labels.items()))} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "letters_stage_seconds", "Time spent in each stage of generating and delivering letters.",
+    LATENCY_BUCKETS, ("stage",)
+))
+PDF_BYTES = REGISTRY.register(Histogram(
+    "letters_pdf_bytes", "Size of rendered PDFs.", SIZE_BUCKETS
+))
+
+
+# -------------------------------
+# TRACES
+# -------------------------------
+_current_trace = contextvars.ContextVar("letters_trace", default=None)
+
+
+class Trace(object):
+    """
+    Spans (stage, offset, duration) of the stages that ran for one request.
+    """
+    def __init__(self, name):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.started = time.perf_counter()
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, stage_name, started, duration):
+        with self._lock:
+            self.spans.append((stage_name, started - self.started, duration))
+
+    def server_timing(self):
+        """Total time per stage as a Server-Timing header value."""
+        totals = {}
+        with self._lock:
+            for stage_name, _, duration in self.spans:
+                totals[stage_name] = totals.get(stage_name, 0.0) + duration
+        return ", ".join(f"{stage_name};dur={duration * 1000:.1f}" for stage_name, duration in totals.items())
+
+    def to_dict(self):
+        with self._lock:
+            spans = sorted(self.spans, key=lambda span: span[1])
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "duration_ms": round((time.perf_counter() - self.started) * 1000, 3),
+            "spans": [{"stage": stage_name, "start_ms": round(offset * 1000, 3), "duration_ms": round(duration * 1000, 3)}
+                      for stage_name, offset, duration in spans]
+        }
+
+
+class _StageTimer(object):
+    __slots__ = ("name", "started")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        duration = time.perf_counter() - self.started
+        STAGE_SECONDS.observe(duration, self.name)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add(self.name, self.started, duration)
+        return False
+
+
+def stage(name):
+    """Context manager that records the duration of the ``with`` block as stage ``name``."""
+    return _StageTimer(name)
+
+
+class TraceMiddleware(object):
+    """
+    ASGI middleware tracing requests that send ``X-Trace: 1``, plus ``sample_rate`` of the others.
+    """
+    sample_rate = 0.0
+
+    def __init__(self, app):
+        self.app = app
+
+    def _wants_trace(self, scope):
+        for name, value in scope.get("headers", ()):
+            if name == b"x-trace":
+                return value.lower() in (b"1", b"true", b"yes")
+        return bool(self.sample_rate) and random.random() < self.sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._wants_trace(scope):
+            await self.app(scope, receive, send)
+            return
+
+        trace = Trace(f"{scope['method']} {scope['path']}")
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", ()))
+                headers.append((b"x-trace-id", trace.trace_id.encode("ascii")))
+                server_timing = trace.server_timing()
+                if server_timing:
+                    headers.append((b"server-timing", server_timing.encode("ascii")))
+                message = dict(message, headers=headers)
+            await send(message)
+
+        token = _current_trace.set(trace)
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current_trace.reset(token)
+            print(json.dumps({"trace": trace.to_dict()}))
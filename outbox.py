@@ -0,0 +1,419 @@
+"""
+outbox.py
+
+This module provides a durable delivery outbox backed by SQLite. The API records a
+job (the rendered artifacts plus the delivery tasks that must happen for them) and
+returns immediately; background workers then run each task with retries and
+exponential backoff.
+
+Several processes (e.g. uvicorn workers) can share one database. A worker that
+claims a task records itself as the owner together with a lease expiry, and keeps
+renewing the lease while the task runs. Tasks whose lease has expired - their
+process died or hung - are claimed again by any live worker, so an accepted job is
+never silently lost, while tasks another live process is running are left alone.
+
+Artifacts are deleted once every task of a job is done. Jobs with a task that
+failed permanently keep theirs for a retention period, for inspection, and a
+periodic sweep deletes them afterwards.
+
+A job can carry the hash of the request payload it was created for; creating a
+job for a request_id and payload hash that already have one returns the existing
+job, so a retried request is not delivered twice.
+
+Classes:
+    Outbox: Stores jobs, artifacts and tasks and runs the delivery workers.
+
+Configuration (config.json, optional):
+    outbox_path                  SQLite database file (default: outbox.db)
+    outbox_workers               Number of delivery worker threads (default: 2)
+    outbox_max_attempts          Attempts per task before it is marked failed (default: 8)
+    outbox_backoff_base_seconds  First retry delay, doubled on each attempt (default: 2)
+    outbox_backoff_max_seconds   Upper bound for the retry delay (default: 300)
+    outbox_lease_seconds         Claim lease of a running task, renewed while it runs (default: 120)
+    outbox_failed_retention_hours  Hours the artifacts of failed jobs are kept (default: 168)
+"""
+import json
+import os
+import random
+import socket
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+from contextlib import contextmanager
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    request_id TEXT,
+    payload_hash TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS artifacts (
+    job_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    filename TEXT,
+    data BLOB NOT NULL,
+    PRIMARY KEY (job_id, name)
+);
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    last_error TEXT,
+    result TEXT
+);
+CREATE INDEX IF NOT EXISTS tasks_due ON tasks (status, next_attempt_at);
+CREATE INDEX IF NOT EXISTS tasks_job ON tasks (job_id);
+"""
+
+
+class Outbox(object):
+    """
+    SQLite-backed job store with a pool of delivery worker threads.
+    """
+    def __init__(self, path="outbox.db", workers=2, max_attempts=8,
+                 backoff_base_seconds=2, backoff_max_seconds=300, poll_interval=1.0,
+                 lease_seconds=120, failed_retention_seconds=7 * 24 * 3600, sweep_interval=600):
+        """
+        Args:
+            path (str): SQLite database file
+            workers (int): Number of delivery worker threads
+            max_attempts (int): Attempts per task before it is marked failed
+            backoff_base_seconds (float): First retry delay, doubled on each attempt
+            backoff_max_seconds (float): Upper bound for the retry delay
+            poll_interval (float): Seconds a worker sleeps when no task is due
+            lease_seconds (float): How long a claim holds without being renewed
+            failed_retention_seconds (float): Age after which artifacts of failed jobs are deleted
+            sweep_interval (float): Seconds between retention sweeps
+        """
+        self.path = path
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff_base_seconds = backoff_base_seconds
+        self.backoff_max_seconds = backoff_max_seconds
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.failed_retention_seconds = failed_retention_seconds
+        self.sweep_interval = sweep_interval
+        # Identifies this outbox's claims among the processes sharing the database
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+        self._handlers = {}
+        self._claim_lock = threading.Lock()
+        self._wakeup = threading.Condition()
+        self._stopping = threading.Event()
+        self._threads = []
+        self._maintenance_thread = None
+
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript(_SCHEMA)
+            # Databases created before jobs carried a payload hash
+            if "payload_hash" not in {row["name"] for row in db.execute("PRAGMA table_info(jobs)")}:
+                db.execute("ALTER TABLE jobs ADD COLUMN payload_hash TEXT")
+            # Databases created before tasks carried a claim lease
+            task_columns = {row["name"] for row in db.execute("PRAGMA table_info(tasks)")}
+            if "claimed_by" not in task_columns:
+                db.execute("ALTER TABLE tasks ADD COLUMN claimed_by TEXT")
+                db.execute("ALTER TABLE tasks ADD COLUMN lease_expires_at REAL")
+            db.execute("CREATE INDEX IF NOT EXISTS tasks_lease ON tasks (status, lease_expires_at)")
+            db.execute("CREATE UNIQUE INDEX IF NOT EXISTS jobs_payload ON jobs (request_id, payload_hash) "
+                       "WHERE payload_hash IS NOT NULL")
+
+    @classmethod
+    def from_config(cls, config):
+        """Build an outbox from the optional outbox_* keys in config.json."""
+        return cls(
+            path=config.get("outbox_path", "outbox.db"),
+            workers=config.get("outbox_workers", 2),
+            max_attempts=config.get("outbox_max_attempts", 8),
+            backoff_base_seconds=config.get("outbox_backoff_base_seconds", 2),
+            backoff_max_seconds=config.get("outbox_backoff_max_seconds", 300),
+            lease_seconds=config.get("outbox_lease_seconds", 120),
+            failed_retention_seconds=config.get("outbox_failed_retention_hours", 168) * 3600
+        )
+
+    @contextmanager
+    def _connect(self):
+        """Open a connection, commit on success and always close it."""
+        db = sqlite3.connect(self.path, timeout=30)
+        db.row_factory = sqlite3.Row
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def register_handler(self, kind, handler):
+        """
+        Register the function that delivers tasks of one kind.
+
+        The handler is called as ``handler(payload, artifacts)`` where ``artifacts``
+        maps artifact name to ``(filename, bytes)``. Raising an exception schedules a
+        retry; the return value (JSON serializable) is stored as the task result.
+        """
+        self._handlers[kind] = handler
+
+    # -------------------------------
+    # PRODUCER SIDE
+    # -------------------------------
+    def create_job(self, request_id, artifacts, tasks, payload_hash=None):
+        """
+        Durably record a job and its delivery tasks.
+
+        Args:
+            request_id (str): Business request ID, kept for lookups
+            artifacts (dict): name -> (filename, bytes) for files the tasks need
+            tasks (list): (kind, payload) tuples; payloads must be JSON serializable
+            payload_hash (str): Hash of the request payload; if a job already exists
+                for this request_id and hash, nothing is recorded
+
+        Returns:
+            str: The new job ID, or the existing job's ID
+        """
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._connect() as db:
+            if payload_hash is not None:
+                # Take the write lock first so a concurrent duplicate in another process waits for this job
+                db.execute("BEGIN IMMEDIATE")
+                existing = self._find_job(db, request_id, payload_hash)
+                if existing is not None:
+                    return existing
+            db.execute("INSERT INTO jobs (id, request_id, payload_hash, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+                       (job_id, request_id, payload_hash, now, now))
+            db.executemany("INSERT INTO artifacts (job_id, name, filename, data) VALUES (?, ?, ?, ?)",
+                           [(job_id, name, filename, sqlite3.Binary(data))
+                            for name, (filename, data) in artifacts.items()])
+            db.executemany("INSERT INTO tasks (job_id, kind, payload, status, next_attempt_at) VALUES (?, ?, ?, 'pending', ?)",
+                           [(job_id, kind, json.dumps(payload), now) for kind, payload in tasks])
+        with self._wakeup:
+            self._wakeup.notify_all()
+        return job_id
+
+    @staticmethod
+    def _find_job(db, request_id, payload_hash):
+        row = db.execute("SELECT id FROM jobs WHERE request_id = ? AND payload_hash = ?",
+                         (request_id, payload_hash)).fetchone()
+        return row["id"] if row is not None else None
+
+    def find_job(self, request_id, payload_hash):
+        """
+        Returns:
+            str: ID of the job created for this request_id and payload hash, or None
+        """
+        with self._connect() as db:
+            return self._find_job(db, request_id, payload_hash)
+
+    def get_job(self, job_id):
+        """
+        Returns:
+            dict: Job status with per-task details, or None if the job does not exist
+        """
+        with self._connect() as db:
+            job = db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if job is None:
+                return None
+            tasks = db.execute("SELECT * FROM tasks WHERE job_id = ? ORDER BY id", (job_id,)).fetchall()
+
+        statuses = {task["status"] for task in tasks}
+        if "failed" in statuses:
+            status = "failed"
+        elif statuses <= {"done"}:
+            status = "completed"
+        elif statuses & {"running", "done"} or any(task["attempts"] for task in tasks):
+            status = "in_progress"
+        else:
+            status = "queued"
+
+        return {
+            "job_id": job["id"],
+            "request_id": job["request_id"],
+            "status": status,
+            "created_at": job["created_at"],
+            "updated_at": job["updated_at"],
+            "tasks": [{
+                "kind": task["kind"],
+                "status": task["status"],
+                "attempts": task["attempts"],
+                "next_attempt_at": task["next_attempt_at"] if task["status"] == "pending" else None,
+                "last_error": task["last_error"],
+                "result": json.loads(task["result"]) if task["result"] else None
+            } for task in tasks]
+        }
+
+    # -------------------------------
+    # WORKER SIDE
+    # -------------------------------
+    def _claim_next(self):
+        """
+        Atomically claim the next due task, or a running task whose lease has expired,
+        for this outbox and return it.
+        """
+        now = time.time()
+        with self._claim_lock, self._connect() as db:
+            # Take the write lock up front so workers in other processes cannot claim the same task
+            db.execute("BEGIN IMMEDIATE")
+            task = db.execute(
+                "SELECT * FROM tasks WHERE status = 'pending' AND next_attempt_at <= ? ORDER BY next_attempt_at, id LIMIT 1",
+                (now,)
+            ).fetchone()
+            if task is None:
+                # Tasks claimed before leases existed have none and count as expired
+                task = db.execute(
+                    "SELECT * FROM tasks WHERE status = 'running' AND COALESCE(lease_expires_at, 0) < ? ORDER BY id LIMIT 1",
+                    (now,)
+                ).fetchone()
+                if task is None:
+                    return None
+                print(f"Outbox task {task['id']} ({task['kind']}): lease of {task['claimed_by'] or 'an older worker'} "
+                      f"expired, running it again")
+            db.execute("UPDATE tasks SET status = 'running', attempts = attempts + 1, claimed_by = ?, lease_expires_at = ? "
+                       "WHERE id = ?", (self.owner, now + self.lease_seconds, task["id"]))
+            return dict(task, attempts=task["attempts"] + 1)
+
+    def _renew_leases(self):
+        """Extend the leases of the tasks this outbox is running."""
+        with self._connect() as db:
+            db.execute("UPDATE tasks SET lease_expires_at = ? WHERE status = 'running' AND claimed_by = ?",
+                       (time.time() + self.lease_seconds, self.owner))
+
+    def sweep(self):
+        """
+        Delete the artifacts of jobs that failed permanently and have not changed for
+        failed_retention_seconds.
+
+        Returns:
+            int: Number of jobs whose artifacts were deleted
+        """
+        cutoff = time.time() - self.failed_retention_seconds
+        with self._connect() as db:
+            jobs = [row["id"] for row in db.execute(
+                "SELECT jobs.id FROM jobs WHERE jobs.updated_at < ? "
+                "AND EXISTS (SELECT 1 FROM tasks WHERE tasks.job_id = jobs.id AND tasks.status = 'failed') "
+                "AND NOT EXISTS (SELECT 1 FROM tasks WHERE tasks.job_id = jobs.id AND tasks.status IN ('pending', 'running')) "
+                "AND EXISTS (SELECT 1 FROM artifacts WHERE artifacts.job_id = jobs.id)",
+                (cutoff,)
+            )]
+            db.executemany("DELETE FROM artifacts WHERE job_id = ?", [(job_id,) for job_id in jobs])
+        if jobs:
+            print(f"Outbox: deleted the artifacts of {len(jobs)} failed jobs")
+        return len(jobs)
+
+    def _load_artifacts(self, job_id):
+        with self._connect() as db:
+            rows = db.execute("SELECT name, filename, data FROM artifacts WHERE job_id = ?", (job_id,)).fetchall()
+        return {row["name"]: (row["filename"], bytes(row["data"])) for row in rows}
+
+    def _backoff(self, attempts):
+        delay = min(self.backoff_max_seconds, self.backoff_base_seconds * (2 ** (attempts - 1)))
+        # Jitter keeps retries from many jobs from hitting a recovering server together
+        return delay * random.uniform(0.8, 1.2)
+
+    def _finish(self, task, status, result=None, error=None, next_attempt_at=None):
+        now = time.time()
+        with self._connect() as db:
+            updated = db.execute(
+                "UPDATE tasks SET status = ?, result = ?, last_error = ?, next_attempt_at = COALESCE(?, next_attempt_at), "
+                "claimed_by = NULL, lease_expires_at = NULL WHERE id = ? AND claimed_by = ?",
+                (status, json.dumps(result) if result is not None else None, error, next_attempt_at, task["id"], self.owner)
+            ).rowcount
+            if not updated:
+                # The lease expired and another worker claimed the task; its outcome counts
+                print(f"Outbox task {task['id']} ({task['kind']}) finished after its lease was taken over")
+                return
+            db.execute("UPDATE jobs SET updated_at = ? WHERE id = ?", (now, task["job_id"]))
+            open_tasks = db.execute(
+                "SELECT COUNT(*) FROM tasks WHERE job_id = ? AND status IN ('pending', 'running', 'failed')",
+                (task["job_id"],)
+            ).fetchone()[0]
+            if not open_tasks:
+                # Every delivery succeeded, the stored artifacts are no longer needed
+                db.execute("DELETE FROM artifacts WHERE job_id = ?", (task["job_id"],))
+
+    def _run_task(self, task):
+        handler = self._handlers.get(task["kind"])
+        if handler is None:
+            self._finish(task, "failed", error=f"No handler registered for task kind '{task['kind']}'")
+            return
+        try:
+            result = handler(json.loads(task["payload"]), self._load_artifacts(task["job_id"]))
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            if task["attempts"] >= self.max_attempts:
+                print(f"Outbox task {task['id']} ({task['kind']}) failed permanently: {error}")
+                self._finish(task, "failed", error=error)
+            else:
+                delay = self._backoff(task["attempts"])
+                print(f"Outbox task {task['id']} ({task['kind']}) attempt {task['attempts']} failed, retrying in {delay:.1f}s: {error}")
+                self._finish(task, "pending", error=error, next_attempt_at=time.time() + delay)
+            return
+        self._finish(task, "done", result=result)
+
+    def _worker_loop(self):
+        while not self._stopping.is_set():
+            try:
+                task = self._claim_next()
+            except Exception:
+                traceback.print_exc()
+                task = None
+            if task is None:
+                with self._wakeup:
+                    self._wakeup.wait(self.poll_interval)
+                continue
+            self._run_task(task)
+
+    def _maintenance_loop(self):
+        """Renew the leases of running tasks and sweep failed jobs' artifacts periodically."""
+        next_sweep = time.monotonic()
+        while not self._stopping.wait(self.lease_seconds / 3):
+            try:
+                self._renew_leases()
+                if time.monotonic() >= next_sweep:
+                    self.sweep()
+                    next_sweep = time.monotonic() + self.sweep_interval
+            except Exception:
+                traceback.print_exc()
+
+    def start(self):
+        """
+        Start the delivery workers. Tasks interrupted in a process that died are
+        claimed again once their lease expires.
+        """
+        if self._threads:
+            return self
+        self._stopping.clear()
+        try:
+            self.sweep()
+        except Exception:
+            traceback.print_exc()
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._worker_loop, name=f"outbox-worker-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        self._maintenance_thread = threading.Thread(target=self._maintenance_loop, name="outbox-maintenance", daemon=True)
+        self._maintenance_thread.start()
+        return self
+
+    def running(self):
+        """True while the delivery workers are alive."""
+        return any(thread.is_alive() for thread in self._threads)
+
+    def stop(self, timeout=10):
+        """Stop the workers; tasks still running are claimed again once their lease expires."""
+        self._stopping.set()
+        with self._wakeup:
+            self._wakeup.notify_all()
+        threads = self._threads + ([self._maintenance_thread] if self._maintenance_thread else [])
+        for thread in threads:
+            thread.join(timeout=timeout)
+        self._threads = []
+        self._maintenance_thread = None
@@ -0,0 +1,200 @@
+"""
+pdf_index.py
+
+This module keeps a local SQLite index of the PDFs archived in OCI Object Storage,
+mapping each request ID to its object name, size and ETag. A lookup is a single
+primary-key read, so retrieving a document costs one ``get_object`` instead of a
+``list_objects`` prefix scan per request.
+
+The index is written whenever a PDF is uploaded and rebuilt from a bucket listing
+at startup, so objects uploaded by other instances (or before the index existed)
+are found as well.
+
+Object names follow ``{folder}/{request_id}_{TRANSACTION_TYPE}.pdf``, where spaces in
+the transaction type become underscores. Uploads record the real request ID, and a
+rebuild keeps that ID for every object already indexed. Other objects are only
+indexed when their name can be split one way: a single underscore, or a known
+transaction type at the end. Request IDs and transaction types may both contain
+underscores, so names like ``REQ_12_CUSTOM_TYPE.pdf`` are skipped rather than guessed.
+
+Classes:
+    PDFIndex: Persistent request_id -> archived PDF object mapping.
+
+Configuration (config.json, optional):
+    pdf_index_path                 SQLite database file (default: pdf_index.db)
+    pdf_index_rebuild_on_startup   Rebuild the index from the bucket at startup (default: true)
+"""
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pdfs (
+    request_id TEXT PRIMARY KEY,
+    object_name TEXT NOT NULL,
+    size INTEGER,
+    etag TEXT,
+    time_created REAL NOT NULL,
+    indexed_at REAL NOT NULL
+);
+"""
+
+# Transaction types whose object names can be split after the request ID
+TRANSACTION_TYPES = ("INNER BOOK", "CERTIFICATE LETTER", "OUTER BOOK", "MEMO", "NOTE")
+
+# Keep the newest object when several PDFs exist for one request ID
+_UPSERT = """
+INSERT INTO pdfs (request_id, object_name, size, etag, time_created, indexed_at)
+VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT (request_id) DO UPDATE SET
+    object_name = excluded.object_name,
+    size = excluded.size,
+    etag = excluded.etag,
+    time_created = excluded.time_created,
+    indexed_at = excluded.indexed_at
+WHERE excluded.time_created >= pdfs.time_created OR excluded.object_name = pdfs.object_name
+"""
+
+
+def request_id_from_object_name(object_name, transaction_types=TRANSACTION_TYPES):
+    """
+    Extract the request ID from an archived PDF's object name.
+
+    Args:
+        object_name (str): ``{folder}/{request_id}_{TRANSACTION_TYPE}.pdf``
+        transaction_types (tuple): Types recognised at the end of a name with several underscores
+
+    Returns:
+        str: The request ID, or None if the name is not a PDF object or can be split more than one way
+    """
+    file_name = os.path.basename(object_name)
+    if not file_name.lower().endswith('.pdf'):
+        return None
+    stem = file_name[:-4]
+    if stem.count('_') == 1:
+        return stem.split('_', 1)[0] or None
+    candidates = set()
+    for transaction_type in transaction_types:
+        suffix = "_" + transaction_type.replace(' ', '_')
+        if len(stem) > len(suffix) and stem.upper().endswith(suffix.upper()):
+            candidates.add(stem[:-len(suffix)])
+    return candidates.pop() if len(candidates) == 1 else None
+
+
+class PDFIndex(object):
+    """
+    SQLite-backed index of archived PDFs keyed by request ID.
+    """
+    def __init__(self, path="pdf_index.db"):
+        """
+        Args:
+            path (str): SQLite database file
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "recorded": 0, "rebuilds": 0}
+        self.last_rebuild = None
+
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript(_SCHEMA)
+
+    @classmethod
+    def from_config(cls, config):
+        """Build an index from the optional pdf_index_* keys in config.json."""
+        return cls(path=config.get("pdf_index_path", "pdf_index.db"))
+
+    @contextmanager
+    def _connect(self):
+        """Open a connection, commit on success and always close it."""
+        db = sqlite3.connect(self.path, timeout=30)
+        db.row_factory = sqlite3.Row
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def lookup(self, request_id):
+        """
+        Returns:
+            dict: request_id, object_name, size, etag and time_created, or None if not indexed
+        """
+        with self._connect() as db:
+            row = db.execute("SELECT * FROM pdfs WHERE request_id = ?", (request_id,)).fetchone()
+        self._count("hits" if row is not None else "misses")
+        return dict(row) if row is not None else None
+
+    def owner(self, object_name):
+        """
+        Returns:
+            str: The request ID an object is indexed under, or None
+        """
+        with self._connect() as db:
+            row = db.execute("SELECT request_id FROM pdfs WHERE object_name = ?", (object_name,)).fetchone()
+        return row["request_id"] if row is not None else None
+
+    def record(self, request_id, object_name, size=None, etag=None, time_created=None):
+        """Index an uploaded PDF, replacing an older object for the same request ID."""
+        now = time.time()
+        with self._connect() as db:
+            db.execute(_UPSERT, (request_id, object_name, size, etag,
+                                 time_created if time_created is not None else now, now))
+        self._count("recorded")
+
+    def forget(self, request_id, object_name=None):
+        """Drop the entry for ``request_id`` (only if it still points at ``object_name``, when given)."""
+        with self._connect() as db:
+            if object_name is None:
+                db.execute("DELETE FROM pdfs WHERE request_id = ?", (request_id,))
+            else:
+                db.execute("DELETE FROM pdfs WHERE request_id = ? AND object_name = ?", (request_id, object_name))
+
+    def rebuild(self, objects):
+        """
+        Re-index from a full bucket listing.
+
+        Objects already indexed keep the request ID recorded at upload; other objects
+        are indexed only when request_id_from_object_name can parse their name.
+        Entries recorded by uploads while the listing was running are kept; entries
+        whose objects no longer exist are removed.
+
+        Args:
+            objects (iterable): dicts with object_name, size, etag and time_created (epoch seconds)
+
+        Returns:
+            int: Number of PDFs indexed from the listing
+        """
+        started = time.time()
+        with self._connect() as db:
+            owners = dict(db.execute("SELECT object_name, request_id FROM pdfs").fetchall())
+        rows = []
+        for obj in objects:
+            request_id = owners.get(obj["object_name"]) or request_id_from_object_name(obj["object_name"])
+            if request_id is None:
+                continue
+            rows.append((request_id, obj["object_name"], obj.get("size"), obj.get("etag"),
+                         obj.get("time_created") or 0.0, started))
+
+        with self._connect() as db:
+            db.executemany(_UPSERT, rows)
+            db.execute("DELETE FROM pdfs WHERE indexed_at < ?", (started,))
+        self._count("rebuilds")
+        self.last_rebuild = {"at": started, "objects": len(rows), "seconds": round(time.time() - started, 3)}
+        return len(rows)
+
+    def stats(self):
+        with self._connect() as db:
+            entries = db.execute("SELECT COUNT(*) FROM pdfs").fetchone()[0]
+        with self._lock:
+            counters = dict(self._counters)
+        counters["entries"] = entries
+        counters["last_rebuild"] = self.last_rebuild
+        return counters
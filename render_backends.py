@@ -0,0 +1,507 @@
+"""
+render_backends.py
+
+This module holds the HTML to PDF engines the render workers can use. Every backend
+takes the complete HTML document and the wkhtmltopdf-style job options and returns
+the PDF bytes:
+
+    wkhtmltopdf  pdfkit + the wkhtmltopdf binary: full WebKit layout (flexbox, floats,
+                 positioning, web fonts), one wkhtmltopdf process per document
+    pymupdf      PyMuPDF's Story, in the worker process: HTML and CSS with Arabic
+                 shaping and font fallback, but no flexbox, positioning, cell
+                 backgrounds or max-width/max-height on images
+    reportlab    reportlab's Platypus, in the worker process: paragraphs, headings,
+                 lists, tables and inline data URI images, styled from CSS class, tag
+                 and inline rules (fonts, sizes, colours, alignment, backgrounds), in
+                 the standard PDF fonts; no right-to-left shaping, so for Latin-script
+                 documents only
+
+The in-process backends honour ``page-size``, ``orientation`` and ``margin-*`` from the
+options and ignore the other wkhtmltopdf options. CSS px are laid out at 96 dpi, as
+wkhtmltopdf does. A backend's library is imported when it is first created, so a
+worker only loads the engines it is asked for.
+
+Classes:
+    WkhtmltopdfBackend: pdfkit / wkhtmltopdf.
+    PyMuPDFBackend: PyMuPDF Story.
+    ReportLabBackend: reportlab Platypus.
+
+Functions:
+    create_backend: Instantiate a backend by name.
+    page_geometry: Page size and margins in points from wkhtmltopdf-style options.
+"""
+import base64
+import html
+import io
+import re
+from html.parser import HTMLParser
+
+
+DEFAULT_BACKEND = "wkhtmltopdf"
+
+# Points per CSS px at 96 dpi
+PX = 0.75
+
+_UNITS = {"mm": 72 / 25.4, "cm": 72 / 2.54, "in": 72.0, "pt": 1.0, "px": PX}
+_PAGE_SIZES = {
+    "A3": (842.0, 1191.0), "A4": (595.0, 842.0), "A5": (420.0, 595.0),
+    "LETTER": (612.0, 792.0), "LEGAL": (612.0, 1008.0)
+}
+# wkhtmltopdf's default margins are 10mm
+_DEFAULT_MARGIN = "10mm"
+
+
+def _length(value, default_unit="mm"):
+    """Convert '10mm', '0.5in', '12pt', '20px' or a bare number (in default_unit) to points."""
+    match = re.match(r'^\s*(-?[\d.]+)\s*([a-z]*)\s*$', str(value).lower())
+    if not match:
+        raise ValueError(f"Invalid length: {value!r}")
+    return float(match.group(1)) * _UNITS.get(match.group(2) or default_unit, _UNITS[default_unit])
+
+
+def page_geometry(options):
+    """
+    Page size and margins from wkhtmltopdf-style options.
+
+    Args:
+        options (dict): Job options; page-size, orientation and margin-* are used
+
+    Returns:
+        tuple: (width, height, (top, right, bottom, left)) in points
+    """
+    options = options or {}
+    width, height = _PAGE_SIZES.get(str(options.get("page-size", "A4")).upper(), _PAGE_SIZES["A4"])
+    if str(options.get("orientation", "Portrait")).lower() == "landscape":
+        width, height = height, width
+    margins = tuple(_length(options.get(f"margin-{side}", _DEFAULT_MARGIN))
+                    for side in ("top", "right", "bottom", "left"))
+    return width, height, margins
+
+
+class WkhtmltopdfBackend(object):
+    """
+    pdfkit driving the wkhtmltopdf binary.
+    """
+    name = "wkhtmltopdf"
+
+    def __init__(self, wkhtmltopdf_path=None):
+        """
+        Args:
+            wkhtmltopdf_path (str): Explicit wkhtmltopdf binary, looked up on PATH if empty
+        """
+        import pdfkit
+
+        self._pdfkit = pdfkit
+        if wkhtmltopdf_path:
+            self.configuration = pdfkit.configuration(wkhtmltopdf=wkhtmltopdf_path)
+        else:
+            self.configuration = pdfkit.configuration()
+
+    def render(self, html_content, options=None):
+        return self._pdfkit.from_string(html_content, False, options=options, configuration=self.configuration)
+
+
+# MuPDF has no flexbox: keep tables styled "display: flex" laid out as tables
+_PYMUPDF_CSS = "table {display: table !important;}"
+
+
+class PyMuPDFBackend(object):
+    """
+    PyMuPDF's Story: MuPDF's HTML engine laid out page by page in this process.
+    """
+    name = "pymupdf"
+
+    def __init__(self):
+        import pymupdf
+
+        self._pymupdf = pymupdf
+
+    def render(self, html_content, options=None):
+        pymupdf = self._pymupdf
+        width, height, (top, right, bottom, left) = page_geometry(options)
+        mediabox = pymupdf.Rect(0, 0, width, height)
+        # The story is laid out in CSS px and scaled onto the page
+        where = pymupdf.Rect(left / PX, top / PX, (width - right) / PX, (height - bottom) / PX)
+        scale = pymupdf.Matrix(PX, PX)
+        story = pymupdf.Story(html=html_content, user_css=_PYMUPDF_CSS, em=16)
+        with story.write_with_links(lambda rect_number, filled: (mediabox, where, scale)) as document:
+            return document.tobytes(deflate=True)
+
+
+# -------------------------------
+# REPORTLAB
+# -------------------------------
+# Properties children take from their parent
+_INHERITED = ("font-size", "font-family", "font-weight", "font-style", "color", "text-align",
+              "line-height", "text-decoration")
+_BLOCK_TAGS = frozenset(("p", "div", "h1", "h2", "h3", "h4", "h5", "h6", "li", "ul", "ol", "body",
+                         "blockquote", "pre", "section", "article", "header", "footer"))
+_SKIPPED_TAGS = frozenset(("head", "style", "script", "title"))
+_VOID_TAGS = frozenset(("area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "wbr"))
+_TAG_STYLES = {
+    "h1": {"font-size": "2em", "font-weight": "bold"},
+    "h2": {"font-size": "1.5em", "font-weight": "bold"},
+    "h3": {"font-size": "1.17em", "font-weight": "bold"},
+    "h4": {"font-weight": "bold"},
+    "h5": {"font-size": "0.83em", "font-weight": "bold"},
+    "h6": {"font-size": "0.67em", "font-weight": "bold"},
+    "b": {"font-weight": "bold"}, "strong": {"font-weight": "bold"}, "th": {"font-weight": "bold"},
+    "i": {"font-style": "italic"}, "em": {"font-style": "italic"},
+    "u": {"text-decoration": "underline"}, "pre": {"font-family": "monospace"}
+}
+# Font keywords in CSS px
+_FONT_SIZES = {"xx-small": 9, "x-small": 10, "small": 13, "medium": 16, "large": 18, "x-large": 24, "xx-large": 32}
+_FONTS = {
+    "Helvetica": ("Helvetica", "Helvetica-Bold", "Helvetica-Oblique", "Helvetica-BoldOblique"),
+    "Times": ("Times-Roman", "Times-Bold", "Times-Italic", "Times-BoldItalic"),
+    "Courier": ("Courier", "Courier-Bold", "Courier-Oblique", "Courier-BoldOblique")
+}
+_CSS_RULE = re.compile(r'([^{}]+)\{([^{}]*)\}')
+_CSS_COMMENT = re.compile(r'/\*.*?\*/', re.DOTALL)
+_SIMPLE_SELECTOR = re.compile(r'^([a-z][a-z0-9]*)?(?:\.([\w-]+))?$', re.IGNORECASE)
+
+
+def _declarations(text):
+    """Parse 'a: b; c: d' into a dict."""
+    declarations = {}
+    for declaration in text.split(";"):
+        name, _, value = declaration.partition(":")
+        if value.strip():
+            declarations[name.strip().lower()] = value.strip()
+    return declarations
+
+
+def _stylesheet(css):
+    """
+    Rules of a style sheet keyed by (tag, class). Only 'tag', '.class' and 'tag.class'
+    selectors are kept; others are ignored.
+    """
+    rules = {}
+    for selectors, body in _CSS_RULE.findall(_CSS_COMMENT.sub("", css)):
+        declarations = _declarations(body)
+        for selector in selectors.split(","):
+            match = _SIMPLE_SELECTOR.match(selector.strip())
+            if match and (match.group(1) or match.group(2)):
+                key = ((match.group(1) or "").lower() or None, match.group(2))
+                rules.setdefault(key, {}).update(declarations)
+    return rules
+
+
+def _font_size(value, parent_size):
+    """CSS font-size -> points."""
+    value = value.strip().lower()
+    if value in _FONT_SIZES:
+        return _FONT_SIZES[value] * PX
+    try:
+        if value.endswith("em"):
+            return float(value[:-2]) * parent_size
+        if value.endswith("%"):
+            return float(value[:-1]) / 100 * parent_size
+        return _length(value, "px")
+    except ValueError:
+        return parent_size
+
+
+def _font_name(style):
+    family = style.get("font-family", "").lower()
+    if "mono" in family or "courier" in family:
+        faces = _FONTS["Courier"]
+    elif "serif" in family.replace("sans-serif", "") or "times" in family:
+        faces = _FONTS["Times"]
+    else:
+        faces = _FONTS["Helvetica"]
+    bold = style.get("font-weight", "normal").lower() in ("bold", "bolder", "600", "700", "800", "900")
+    italic = style.get("font-style", "normal").lower() in ("italic", "oblique")
+    return faces[bold + 2 * italic]
+
+
+class _PlatypusBuilder(HTMLParser):
+    """
+    Turns an HTML document into Platypus flowables. Inline content collects into the
+    paragraph of the nearest block element; tables become Tables of flowable cells.
+    """
+    def __init__(self, platypus, colors, frame_width):
+        super().__init__(convert_charrefs=True)
+        self.platypus = platypus
+        self.colors = colors
+        self.story = []
+        self._rules = {}
+        self._css = None
+        self._skip = 0
+        self._elements = [("html", {"font-size": 16 * PX, "color": "black"})]
+        # Flowables go to the story or to the innermost table cell
+        self._containers = [(self.story, frame_width)]
+        self._tables = []
+        self._lists = []
+        self._parts = []
+        self._block_style = self._elements[0][1]
+        self._largest_font = 0
+
+    # Styles -----------------------------------------------------------------
+    def _computed(self, tag, attrs):
+        parent = self._elements[-1][1]
+        style = {name: parent[name] for name in _INHERITED if name in parent}
+        declared = dict(_TAG_STYLES.get(tag, {}))
+        declared.update(self._rules.get((tag, None), {}))
+        for css_class in (attrs.get("class") or "").split():
+            declared.update(self._rules.get((None, css_class), {}))
+            declared.update(self._rules.get((tag, css_class), {}))
+        declared.update(_declarations(attrs.get("style") or ""))
+        if "align" in attrs:
+            declared.setdefault("text-align", attrs["align"])
+        for name, value in declared.items():
+            style[name] = _font_size(value, parent["font-size"]) if name == "font-size" else value
+        return style
+
+    def _color(self, value, default=None):
+        try:
+            return self.colors.toColor(value.strip())
+        except Exception:
+            return default
+
+    def _paragraph_style(self, style):
+        from reportlab.lib.enums import TA_CENTER, TA_JUSTIFY, TA_LEFT, TA_RIGHT
+        from reportlab.lib.styles import ParagraphStyle
+
+        size = style["font-size"]
+        font_size = max(self._largest_font, size)
+        line_height = style.get("line-height", "normal").strip().lower()
+        if line_height.endswith("%"):
+            leading = float(line_height[:-1]) / 100 * font_size
+        elif re.match(r'^[\d.]+$', line_height):
+            leading = float(line_height) * font_size
+        elif line_height != "normal":
+            leading = _font_size(line_height, font_size)
+        else:
+            leading = 1.2 * font_size
+        alignment = {"center": TA_CENTER, "right": TA_RIGHT, "justify": TA_JUSTIFY}.get(
+            style.get("text-align", "left").lower(), TA_LEFT)
+        return ParagraphStyle("block", fontName=_font_name(style), fontSize=size, leading=leading,
+                              alignment=alignment, textColor=self._color(style.get("color", "black")),
+                              leftIndent=18 * len(self._lists))
+
+    # Flowables ---------------------------------------------------------------
+    def _add(self, flowable):
+        self._containers[-1][0].append(flowable)
+
+    def _flush(self):
+        """Close the paragraph being collected, if it has any content."""
+        parts, self._parts = self._parts, []
+        text = "".join(parts)
+        if text.replace("<br/>", "").strip():
+            self._add(self.platypus.Paragraph(text, self._paragraph_style(self._block_style)))
+        elif "<br/>" in text:
+            # A paragraph holding only line breaks is vertical space
+            size = max(self._largest_font, self._block_style["font-size"])
+            self._add(self.platypus.Spacer(1, 1.2 * size * text.count("<br/>")))
+        self._largest_font = 0
+
+    def _text(self, text, style):
+        size = style["font-size"]
+        self._largest_font = max(self._largest_font, size)
+        color = self._color(style.get("color", "black"), self.colors.black).hexval().replace("0x", "#")
+        markup = f'<font name="{_font_name(style)}" size="{size:.2f}" color="{color}">{html.escape(text, quote=False)}</font>'
+        if "underline" in style.get("text-decoration", ""):
+            markup = f"<u>{markup}</u>"
+        self._parts.append(markup)
+
+    def _image(self, attrs, style):
+        src = attrs.get("src") or ""
+        if not src.startswith("data:") or "," not in src:
+            return
+        from reportlab.lib.utils import ImageReader
+
+        # An image that cannot be decoded is left out, as a browser shows it broken
+        try:
+            data = base64.b64decode(src.split(",", 1)[1])
+            natural_width, natural_height = ImageReader(io.BytesIO(data)).getSize()
+        except Exception:
+            return
+        width, height = natural_width * PX, natural_height * PX
+        try:
+            if attrs.get("width") or "width" in style:
+                width = _length(attrs.get("width") or style["width"], "px")
+                height = natural_height * width / natural_width if not (attrs.get("height") or "height" in style) \
+                    else _length(attrs.get("height") or style["height"], "px")
+            elif attrs.get("height") or "height" in style:
+                height = _length(attrs.get("height") or style["height"], "px")
+                width = natural_width * height / natural_height
+        except ValueError:
+            pass
+        # max-width / max-height and the available width shrink the image, keeping its aspect
+        limits = [self._containers[-1][1] / width]
+        for name, size in (("max-width", width), ("max-height", height)):
+            try:
+                limits.append(_length(style[name], "px") / size)
+            except (KeyError, ValueError):
+                pass
+        factor = min(1.0, *limits)
+        self._flush()
+        image = self.platypus.Image(io.BytesIO(data), width=width * factor, height=height * factor)
+        image.hAlign = {"center": "CENTER", "right": "RIGHT"}.get(style.get("text-align", "left").lower(), "LEFT")
+        self._add(image)
+
+    def _close_table(self):
+        table = self._tables.pop()
+        rows = [row for row in table["rows"] if row]
+        if not rows:
+            return
+        columns = max(len(row) for row in rows)
+        data = [[cell for cell, _ in row] + [""] * (columns - len(row)) for row in rows]
+        commands = [("VALIGN", (0, 0), (-1, -1), "TOP"),
+                    ("LEFTPADDING", (0, 0), (-1, -1), 4), ("RIGHTPADDING", (0, 0), (-1, -1), 4),
+                    ("TOPPADDING", (0, 0), (-1, -1), 1), ("BOTTOMPADDING", (0, 0), (-1, -1), 1)]
+        for row_number, row in enumerate(rows):
+            for column, (_, background) in enumerate(row):
+                if background is not None:
+                    commands.append(("BACKGROUND", (column, row_number), (column, row_number), background))
+        width = self._containers[-1][1]
+        self._add(self.platypus.Table(data, colWidths=[width / columns] * columns,
+                                      style=self.platypus.TableStyle(commands), hAlign="CENTER"))
+
+    # Parser events -------------------------------------------------------------
+    def handle_starttag(self, tag, attrs):
+        attrs = {name: value or "" for name, value in attrs}
+        if self._skip or tag in _SKIPPED_TAGS:
+            if tag not in _VOID_TAGS:
+                self._skip += 1
+            if tag == "style":
+                self._css = []
+            return
+        style = self._computed(tag, attrs)
+        if style.get("display", "").strip().lower() == "none":
+            if tag not in _VOID_TAGS:
+                self._skip += 1
+            return
+
+        if tag == "br":
+            self._parts.append("<br/>")
+        elif tag == "img":
+            self._image(attrs, style)
+        elif tag == "hr":
+            self._flush()
+            self._add(self.platypus.HRFlowable(width="100%"))
+        if tag in _VOID_TAGS:
+            return
+
+        if tag == "table":
+            self._flush()
+            self._tables.append({"rows": []})
+        elif tag == "tr" and self._tables:
+            self._tables[-1]["rows"].append([])
+        elif tag in ("td", "th") and self._tables:
+            self._flush()
+            rows = self._tables[-1]["rows"]
+            if not rows:
+                rows.append([])
+            background = style.get("background-color") or style.get("background")
+            cell = []
+            rows[-1].append((cell, self._color(background) if background else None))
+            self._containers.append((cell, self._containers[-1][1]))
+            self._block_style = style
+        elif tag in ("ul", "ol"):
+            self._flush()
+            self._lists.append([tag, 0])
+        elif tag in _BLOCK_TAGS:
+            self._flush()
+            self._block_style = style
+            if tag == "li" and self._lists:
+                self._lists[-1][1] += 1
+                kind, number = self._lists[-1]
+                self._text("• " if kind == "ul" else f"{number}. ", style)
+        self._elements.append((tag, style))
+
+    def handle_endtag(self, tag):
+        if self._skip:
+            if tag not in _VOID_TAGS:
+                self._skip -= 1
+            if tag == "style" and self._css is not None:
+                for key, declarations in _stylesheet("".join(self._css)).items():
+                    self._rules.setdefault(key, {}).update(declarations)
+                self._css = None
+            return
+        if not any(open_tag == tag for open_tag, _ in self._elements[1:]):
+            return
+        # Close every element left open inside this one
+        while self._elements[-1][0] != tag:
+            self.handle_endtag(self._elements[-1][0])
+        self._elements.pop()
+
+        if tag == "table" and self._tables:
+            self._flush()
+            self._close_table()
+        elif tag in ("td", "th") and len(self._containers) > 1:
+            self._flush()
+            self._containers.pop()
+        elif tag in ("ul", "ol") and self._lists:
+            self._flush()
+            self._lists.pop()
+        elif tag in _BLOCK_TAGS:
+            self._flush()
+        if tag in _BLOCK_TAGS or tag in ("td", "th", "table"):
+            # Text after a block belongs to its parent block
+            self._block_style = next((style for open_tag, style in reversed(self._elements)
+                                      if open_tag in _BLOCK_TAGS or open_tag in ("td", "th")), self._elements[0][1])
+
+    def handle_data(self, data):
+        if self._skip:
+            if self._css is not None:
+                self._css.append(data)
+            return
+        if not self._parts and not data.strip():
+            return
+        self._text(data, self._elements[-1][1])
+
+    def close(self):
+        super().close()
+        while len(self._elements) > 1:
+            self.handle_endtag(self._elements[-1][0])
+        self._flush()
+
+
+class ReportLabBackend(object):
+    """
+    reportlab's Platypus, fed by a small HTML and CSS to flowables converter.
+    """
+    name = "reportlab"
+
+    def __init__(self):
+        from reportlab import platypus, rl_config
+        from reportlab.lib import colors
+
+        # Embed images as binary streams: ASCII85 (pure Python) costs more than the layout
+        rl_config.useA85 = 0
+        self._platypus = platypus
+        self._colors = colors
+
+    def render(self, html_content, options=None):
+        width, height, (top, right, bottom, left) = page_geometry(options)
+        builder = _PlatypusBuilder(self._platypus, self._colors, width - left - right)
+        builder.feed(html_content)
+        builder.close()
+        buffer = io.BytesIO()
+        document = self._platypus.SimpleDocTemplate(buffer, pagesize=(width, height), topMargin=top,
+                                                    rightMargin=right, bottomMargin=bottom, leftMargin=left)
+        document.build(builder.story or [self._platypus.Spacer(1, 1)])
+        return buffer.getvalue()
+
+
+BACKENDS = {backend.name: backend for backend in (WkhtmltopdfBackend, PyMuPDFBackend, ReportLabBackend)}
+
+
+def create_backend(name, wkhtmltopdf_path=None):
+    """
+    Instantiate a backend by name.
+
+    Args:
+        name (str): One of BACKENDS
+        wkhtmltopdf_path (str): Explicit wkhtmltopdf binary for the wkhtmltopdf backend
+
+    Raises:
+        ValueError: For an unknown backend name
+        ImportError: If the backend's library is not installed
+    """
+    backend = BACKENDS.get(name)
+    if backend is None:
+        raise ValueError(f"Unknown render backend '{name}' (available: {', '.join(sorted(BACKENDS))})")
+    return backend(wkhtmltopdf_path=wkhtmltopdf_path) if backend is WkhtmltopdfBackend else backend()
@@ -0,0 +1,362 @@
+"""
+renderer.py
+
+This module keeps a pool of long-lived PDF rendering workers so that HTML to PDF
+conversion does not pay for interpreter start-up, pdfkit import and wkhtmltopdf
+discovery on every request.
+
+Each worker is a separate process that receives HTML jobs over a pipe and answers
+with the rendered PDF bytes. Workers are recycled after a configurable number of
+jobs or when their resident memory grows past a threshold. A job that runs past
+its deadline has its worker terminated and replaced, and fails with TimeoutError,
+so a hung render never holds a worker or its caller indefinitely.
+
+Every job names the render backend (see render_backends.py) that converts it. A
+worker creates the pool's preloaded backends when it starts and any other backend
+the first time a job asks for it, and keeps them for the jobs that follow, so one
+pool serves wkhtmltopdf and the in-process engines alike.
+
+Classes:
+    RenderPool: Dispatches HTML render jobs to warm worker processes.
+
+Configuration (config.json, all optional):
+    render_workers               Number of worker processes (default: CPU count)
+    render_max_jobs_per_worker   Jobs before a worker is recycled (default: 200)
+    render_max_worker_rss_mb     RSS in MiB before a worker is recycled (default: 512)
+    render_job_timeout_seconds   Render time after which a job's worker is killed (default: 120)
+    wkhtmltopdf_path             Explicit path to the wkhtmltopdf binary
+    render_backend,
+    render_backends_by_type      The backends named here are preloaded by every worker
+"""
+import os
+import queue
+import threading
+import time
+import multiprocessing
+from collections import deque
+from concurrent.futures import Future
+
+from render_backends import BACKENDS, DEFAULT_BACKEND, create_backend
+
+
+def _current_rss_mb():
+    """Return the resident set size of the current process in MiB."""
+    try:
+        with open('/proc/self/statm') as statm:
+            resident_pages = int(statm.read().split()[1])
+        return resident_pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except Exception:
+        import resource
+        # ru_maxrss is reported in KiB on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _render_worker(conn, wkhtmltopdf_path, preload=(DEFAULT_BACKEND,)):
+    """
+    Worker process main loop.
+
+    Each backend's library is imported and its configuration (for wkhtmltopdf, the
+    binary lookup) resolved once, at start-up for the preloaded backends and on the
+    first job for the others; the worker serves jobs until it receives ``None`` or
+    the pipe is closed.
+
+    Args:
+        conn: Worker end of a multiprocessing Pipe
+        wkhtmltopdf_path (str): Optional explicit path to wkhtmltopdf
+        preload (tuple): Backend names to create before the first job
+    """
+    backends = {}
+    for backend_name in preload:
+        try:
+            backends[backend_name] = create_backend(backend_name, wkhtmltopdf_path=wkhtmltopdf_path)
+        except Exception as e:
+            # Jobs for this backend retry the creation and fail with the error
+            print(f"Render worker could not load the {backend_name} backend: {e}")
+
+    while True:
+        try:
+            job = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+        if job is None:
+            break
+
+        backend_name, html_content, options = job
+        started = time.perf_counter()
+        try:
+            backend = backends.get(backend_name)
+            if backend is None:
+                backend = backends[backend_name] = create_backend(backend_name, wkhtmltopdf_path=wkhtmltopdf_path)
+            pdf_bytes = backend.render(html_content, options)
+            conn.send((True, pdf_bytes, time.perf_counter() - started, _current_rss_mb()))
+        except Exception as e:
+            conn.send((False, str(e), time.perf_counter() - started, _current_rss_mb()))
+
+
+class _WorkerSlot(object):
+    """
+    Owns one worker process and the dispatcher thread that feeds it.
+    The slot respawns its process whenever the recycle policy says so.
+    """
+    def __init__(self, pool, index):
+        self.pool = pool
+        self.index = index
+        self.process = None
+        self.conn = None
+        self.jobs_done = 0
+        self.thread = threading.Thread(target=self._run, name=f"render-slot-{index}", daemon=True)
+
+    def _spawn(self):
+        parent_conn, child_conn = self.pool._context.Pipe()
+        process = self.pool._context.Process(
+            target=_render_worker,
+            args=(child_conn, self.pool.wkhtmltopdf_path, self.pool.preload),
+            name=f"render-worker-{self.index}",
+            daemon=True
+        )
+        process.start()
+        child_conn.close()
+        self.process = process
+        self.conn = parent_conn
+        self.jobs_done = 0
+        self.pool._record_spawn()
+
+    def _kill(self):
+        """Terminate the worker without waiting for the job it is running."""
+        self.process.terminate()
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join(timeout=5)
+        self.conn.close()
+        self.process = None
+        self.conn = None
+
+    def _retire(self):
+        if self.process is None:
+            return
+        try:
+            self.conn.send(None)
+        except Exception:
+            pass
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join(timeout=5)
+        self.conn.close()
+        self.process = None
+        self.conn = None
+
+    def _run(self):
+        self._spawn()
+        while True:
+            item = self.pool._jobs.get()
+            if item is None:
+                break
+            backend, html_content, options, future, enqueued_at, timeout = item
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            self.pool._record_wait(time.perf_counter() - enqueued_at)
+            try:
+                self.conn.send((backend, html_content, options))
+                if not self.conn.poll(timeout):
+                    # The worker is stuck (e.g. wkhtmltopdf waiting on a resource); replace it
+                    print(f"Render worker {self.index} exceeded the {timeout}s job deadline, restarting it")
+                    self._kill()
+                    self._spawn()
+                    self.pool._record_timeout(timeout, backend)
+                    future.set_exception(TimeoutError(f"Render job did not finish within {timeout}s"))
+                    continue
+                ok, payload, elapsed, rss_mb = self.conn.recv()
+            except (EOFError, OSError, BrokenPipeError) as e:
+                # Worker died mid-job; start a fresh one for the next job
+                future.set_exception(RuntimeError(f"Render worker exited unexpectedly: {e}"))
+                self._retire()
+                self._spawn()
+                continue
+
+            self.jobs_done += 1
+            self.pool._record_render(elapsed, ok, backend)
+            if ok:
+                future.set_result(payload)
+            else:
+                future.set_exception(RuntimeError(payload))
+
+            if self.jobs_done >= self.pool.max_jobs_per_worker or rss_mb >= self.pool.max_worker_rss_mb:
+                print(f"Recycling render worker {self.index} after {self.jobs_done} jobs ({rss_mb:.0f} MiB RSS)")
+                self._retire()
+                self._spawn()
+                self.pool._record_recycle()
+
+        self._retire()
+
+
+class RenderPool(object):
+    """
+    Keeps ``workers`` warm rendering processes and dispatches HTML jobs to them
+    through a shared queue.
+    """
+    def __init__(self, workers=None, max_jobs_per_worker=200, max_worker_rss_mb=512,
+                 wkhtmltopdf_path=None, options=None, history_size=1000, preload=(DEFAULT_BACKEND,),
+                 job_timeout=120):
+        """
+        Args:
+            workers (int): Number of worker processes, defaults to the CPU count
+            max_jobs_per_worker (int): Recycle a worker after this many jobs
+            max_worker_rss_mb (float): Recycle a worker once its RSS passes this value
+            wkhtmltopdf_path (str): Explicit wkhtmltopdf binary, looked up on PATH if empty
+            options (dict): Default wkhtmltopdf options applied to every job
+            history_size (int): Number of recent render timings kept for stats
+            preload (tuple): Render backends every worker creates when it starts
+            job_timeout (float): Seconds a job may render before its worker is killed
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self.max_worker_rss_mb = max_worker_rss_mb
+        self.wkhtmltopdf_path = wkhtmltopdf_path
+        self.options = options or {'quiet': ''}
+        self.preload = tuple(preload)
+        self.job_timeout = job_timeout
+
+        self._context = multiprocessing.get_context('spawn')
+        self._jobs = queue.Queue()
+        self._slots = []
+        self._lock = threading.Lock()
+        self._render_times = deque(maxlen=history_size)
+        self._wait_times = deque(maxlen=history_size)
+        self._counters = {"completed": 0, "failed": 0, "timed_out": 0, "spawned": 0, "recycled": 0}
+        self._backend_jobs = {}
+        self._started = False
+
+    @classmethod
+    def from_config(cls, config):
+        """Build a pool from the optional render_* keys in config.json."""
+        preload = {config.get("render_backend", DEFAULT_BACKEND)}
+        preload.update((config.get("render_backends_by_type") or {}).values())
+        return cls(
+            workers=config.get("render_workers"),
+            max_jobs_per_worker=config.get("render_max_jobs_per_worker", 200),
+            max_worker_rss_mb=config.get("render_max_worker_rss_mb", 512),
+            wkhtmltopdf_path=config.get("wkhtmltopdf_path"),
+            preload=sorted(name for name in preload if name in BACKENDS),
+            job_timeout=config.get("render_job_timeout_seconds", 120)
+        )
+
+    def start(self):
+        """Spawn the worker processes. Safe to call more than once."""
+        with self._lock:
+            if self._started:
+                return self
+            for index in range(self.workers):
+                slot = _WorkerSlot(self, index)
+                self._slots.append(slot)
+                slot.thread.start()
+            self._started = True
+        return self
+
+    def shutdown(self, wait=True):
+        """Stop all workers after the jobs already queued have been served."""
+        with self._lock:
+            if not self._started:
+                return
+            slots, self._slots = self._slots, []
+            self._started = False
+        for _ in slots:
+            self._jobs.put(None)
+        if wait:
+            for slot in slots:
+                slot.thread.join()
+
+    def submit(self, html_content, options=None, backend=DEFAULT_BACKEND, timeout=None):
+        """
+        Queue an HTML document for rendering.
+
+        Args:
+            html_content (str): Complete HTML document
+            options (dict): wkhtmltopdf options overriding the pool defaults
+            backend (str): Render backend name, one of render_backends.BACKENDS
+            timeout (float): Render deadline of this job once a worker picks it up,
+                defaults to the pool's job_timeout
+
+        Returns:
+            concurrent.futures.Future: Resolves to the PDF bytes, or raises
+                TimeoutError if the job ran past its deadline
+        """
+        self.start()
+        job_options = dict(self.options)
+        if options:
+            job_options.update(options)
+        future = Future()
+        job_timeout = self.job_timeout if timeout is None else timeout
+        self._jobs.put((backend, html_content, job_options, future, time.perf_counter(), job_timeout))
+        return future
+
+    def render(self, html_content, options=None, timeout=None, backend=DEFAULT_BACKEND):
+        """
+        Render synchronously and return the PDF bytes.
+
+        ``timeout`` bounds the render itself (see submit); time spent queued for a
+        free worker is not counted.
+        """
+        return self.submit(html_content, options, backend, timeout).result()
+
+    # -------------------------------
+    # STATS
+    # -------------------------------
+    def _record_render(self, elapsed, ok, backend):
+        with self._lock:
+            self._render_times.append(elapsed)
+            self._counters["completed" if ok else "failed"] += 1
+            self._backend_jobs[backend] = self._backend_jobs.get(backend, 0) + 1
+
+    def _record_wait(self, elapsed):
+        with self._lock:
+            self._wait_times.append(elapsed)
+
+    def _record_timeout(self, elapsed, backend):
+        with self._lock:
+            self._render_times.append(elapsed)
+            self._counters["timed_out"] += 1
+            self._backend_jobs[backend] = self._backend_jobs.get(backend, 0) + 1
+
+    def _record_spawn(self):
+        with self._lock:
+            self._counters["spawned"] += 1
+
+    def _record_recycle(self):
+        with self._lock:
+            self._counters["recycled"] += 1
+
+    @staticmethod
+    def _summarize(samples):
+        if not samples:
+            return {"count": 0, "avg_ms": 0.0, "p50_ms": 0.0, "p95_ms": 0.0, "max_ms": 0.0}
+        ordered = sorted(samples)
+        return {
+            "count": len(ordered),
+            "avg_ms": round(sum(ordered) / len(ordered) * 1000, 2),
+            "p50_ms": round(ordered[len(ordered) // 2] * 1000, 2),
+            "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 2),
+            "max_ms": round(ordered[-1] * 1000, 2)
+        }
+
+    def stats(self):
+        """
+        Returns:
+            dict: Queue depth, worker count, job counters (overall and per backend) and
+                render/wait time summaries
+        """
+        with self._lock:
+            render_times = list(self._render_times)
+            wait_times = list(self._wait_times)
+            counters = dict(self._counters)
+            backend_jobs = dict(self._backend_jobs)
+        return {
+            "workers": self.workers,
+            "queue_depth": self._jobs.qsize(),
+            "jobs": counters,
+            "jobs_by_backend": backend_jobs,
+            "render_time": self._summarize(render_times),
+            "queue_wait_time": self._summarize(wait_times)
+        }
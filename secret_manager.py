@@ -5,56 +5,96 @@ This module provides functionality to retrieve secrets such as usernames and pas
 from Oracle Cloud Infrastructure (OCI) Vault. It reads secret OCIDs from a configuration file
 and securely fetches their values using OCI's Instance Principals authentication.
 
+Secret values are cached: one signer and one SecretsClient are shared by every fetch,
+all configured secrets are fetched concurrently, and the values are kept for a TTL.
+A background thread refreshes them shortly before they expire, so a rotated password
+is picked up without a restart, and callers that see an authentication failure can
+force an immediate re-fetch with ``refresh(force=True)``.
+
 Classes:
-    SecretManager: Manages the retrieval of API and database credentials from OCI Vault.
+    SecretManager: Manages the retrieval of email credentials from OCI Vault.
 
 Dependencies:
     - oci (Oracle Cloud Infrastructure Python SDK)
-    - configparser
-    - logger_config (custom logger module)
 
 Configuration:
-    The module expects a `config.ini` file with the following sections and keys:
+    The module expects a `config.json` file with the secret OCIDs:
 
-    [AUTH]
-    login_username_ocid=<OCID for API login username>
-    login_password_ocid=<OCID for API login password>
+    smtp_username                  OCID of the SMTP username secret
+    smtp_password                  OCID of the SMTP password secret
 
-    [ADW]
-    adw_user_oci=<OCID for ADW username>
-    adw_password_oci=<OCID for ADW password>
+    Optional:
+    secret_ttl_seconds             How long fetched values are used (default: 3600)
+    secret_refresh_margin_seconds  Refresh this long before the TTL ends (default: 300)
+    secret_min_refresh_seconds     Minimum time between forced re-fetches (default: 30)
 """
-import oci
-from configparser import ConfigParser
+import base64
 import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import oci
+
 
+# Name in get_secret()'s result -> config.json key holding the secret's OCID
+SECRET_KEYS = {
+    "email_username": "smtp_username",
+    "email_password": "smtp_password"
+}
 
 
 class SecretManager(object):
     """
     Handles retrieval of secrets (usernames and passwords) from OCI Vault using OCIDs
-    provided in a configuration file.
+    provided in a configuration file, and keeps them cached and refreshed.
     """
-    def __init__(self):
+    def __init__(self, config_path='config.json', secrets_client=None):
         """
-        Initializes the SecretManager by reading secret OCIDs from a local config file (./config.ini).
-        The config file must have sections 'AUTH' and 'ADW' with corresponding keys.
+        Initializes the SecretManager by reading secret OCIDs from the config file.
+
+        Args:
+            config_path (str): JSON config with the secret OCIDs
+            secrets_client: SecretsClient (or a stand-in with get_secret_bundle); by
+                default one Instance Principals client is created on first use
         """
         try:
-            config = ConfigParser()
-            with open('config.json') as config_file:
+            with open(config_path) as config_file:
                 config = json.load(config_file)
 
-            self.EMAIL_USERNAME_SECRET_OCID = config['smtp_username']
-            self.EMAIL_PASSWORD_SECRET_OCID = config['smtp_password']
-            print(self.EMAIL_USERNAME_SECRET_OCID)
-            print(self.EMAIL_PASSWORD_SECRET_OCID)
+            self.secret_ocids = {name: config[key] for name, key in SECRET_KEYS.items()}
+            self.EMAIL_USERNAME_SECRET_OCID = self.secret_ocids["email_username"]
+            self.EMAIL_PASSWORD_SECRET_OCID = self.secret_ocids["email_password"]
         except Exception as e:
             raise Exception(f"Failed to read config file or missing keys: {e}")
 
-
-    @staticmethod
-    def get_secret_from_oci(secret_ocid: str) -> str:
+        self.ttl = config.get("secret_ttl_seconds", 3600)
+        self.refresh_margin = config.get("secret_refresh_margin_seconds", 300)
+        self.min_refresh_interval = config.get("secret_min_refresh_seconds", 30)
+
+        self._secrets_client = secrets_client
+        self._client_lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        # Guards the counters and status fields only; never held across a vault call, so stats() does not wait on one
+        self._stats_lock = threading.Lock()
+        self._values = None
+        self._fetched_at = 0.0
+        self._last_error = None
+        self._listeners = []
+        self._stopping = threading.Event()
+        self._refresh_thread = None
+        self._counters = {"fetches": 0, "forced": 0, "failures": 0, "changes": 0}
+
+    def _client(self):
+        """Return the shared SecretsClient, creating the signer and client once."""
+        if self._secrets_client is None:
+            with self._client_lock:
+                if self._secrets_client is None:
+                    signer = oci.auth.signers.InstancePrincipalsSecurityTokenSigner()
+                    self._secrets_client = oci.secrets.SecretsClient({}, signer=signer)
+        return self._secrets_client
+
+    def get_secret_from_oci(self, secret_ocid: str) -> str:
         """
         Retrieves a secret value from OCI Vault using its OCID.
 
@@ -64,21 +104,69 @@ class SecretManager(object):
         Returns:
             str: The decoded secret string (base64-decoded if needed).
         """
-        signer = oci.auth.signers.InstancePrincipalsSecurityTokenSigner()
-        secrets_client = oci.secrets.SecretsClient({}, signer=signer)
-
-        response = secrets_client.get_secret_bundle(secret_ocid)
-        if not response.data.secret_bundle_content.content_type=="BASE64":
-            content = response.data.secret_bundle_content.content
+        response = self._client().get_secret_bundle(secret_ocid)
+        content = response.data.secret_bundle_content.content
+        if not response.data.secret_bundle_content.content_type == "BASE64":
             return content
-        else:
-            content = response.data.secret_bundle_content.content
-            import base64
-            return base64.b64decode(content).decode()
+        return base64.b64decode(content).decode()
+
+    def _fetch_all(self):
+        """Fetch every configured secret concurrently."""
+        with ThreadPoolExecutor(max_workers=len(self.secret_ocids), thread_name_prefix="secret-fetch") as executor:
+            futures = {name: executor.submit(self.get_secret_from_oci, ocid)
+                       for name, ocid in self.secret_ocids.items()}
+            return {name: future.result() for name, future in futures.items()}
+
+    def refresh(self, force=False):
+        """
+        Return the cached secrets, fetching them from the vault when they have expired.
+
+        Args:
+            force (bool): Re-fetch now (e.g. after an authentication failure), unless the
+                values were fetched less than ``min_refresh_interval`` seconds ago
+
+        Returns:
+            dict: Secret name -> value
+
+        Raises:
+            Exception: If the vault cannot be reached and no values are cached
+        """
+        with self._refresh_lock:
+            age = time.time() - self._fetched_at
+            if self._values is not None:
+                if not force and age < self.ttl:
+                    return dict(self._values)
+                if force and age < self.min_refresh_interval:
+                    return dict(self._values)
+            if force:
+                with self._stats_lock:
+                    self._counters["forced"] += 1
+            try:
+                values = self._fetch_all()
+            except Exception as e:
+                with self._stats_lock:
+                    self._counters["failures"] += 1
+                    self._last_error = str(e)
+                raise
+            changed = self._values is not None and values != self._values
+            with self._stats_lock:
+                self._counters["fetches"] += 1
+                self._last_error = None
+                if changed:
+                    self._counters["changes"] += 1
+                self._values = values
+                self._fetched_at = time.time()
+        if changed:
+            for callback in list(self._listeners):
+                try:
+                    callback(dict(values))
+                except Exception as e:
+                    print(f"Error applying refreshed secrets: {e}")
+        return dict(values)
 
     def get_secret(self, default=None):
         """
-        Fetches all configured secrets (email and DB credentials) from OCI Vault.
+        Fetches all configured secrets (email credentials) from OCI Vault, or the cache.
 
         Args:
             default (Any, optional): Value to return if an error occurs. Defaults to None.
@@ -90,13 +178,51 @@ class SecretManager(object):
             or the fallback `default` if retrieval fails.
         """
         try:
-            email_username = self.get_secret_from_oci(self.EMAIL_USERNAME_SECRET_OCID)
-            email_password = self.get_secret_from_oci(self.EMAIL_PASSWORD_SECRET_OCID)
-            return {
-                "email_username":email_username,
-                "email_password":email_password
-            }
+            return self.refresh()
         except Exception as e:
             print(f"Failed to retrieve secret: usernames and passwords -> {e}")
+            if self._values is not None:
+                # An expired value is better than none while the vault is unreachable
+                return dict(self._values)
             return default
 
+    def on_change(self, callback):
+        """Call ``callback(values)`` whenever a refresh returns different secret values."""
+        self._listeners.append(callback)
+
+    def start_refresh(self):
+        """Start the background thread that refreshes the secrets before they expire."""
+        if self._refresh_thread is None:
+            self._stopping.clear()
+            self._refresh_thread = threading.Thread(target=self._refresh_loop, name="secret-refresh", daemon=True)
+            self._refresh_thread.start()
+        return self
+
+    def stop_refresh(self):
+        self._stopping.set()
+        if self._refresh_thread is not None:
+            self._refresh_thread.join(timeout=5)
+            self._refresh_thread = None
+
+    def _refresh_loop(self):
+        retry_delay = self.min_refresh_interval
+        while not self._stopping.is_set():
+            refresh_at = self._fetched_at + max(self.ttl - self.refresh_margin, self.min_refresh_interval)
+            if self._stopping.wait(max(0.0, refresh_at - time.time())):
+                return
+            try:
+                self.refresh(force=True)
+                retry_delay = self.min_refresh_interval
+            except Exception as e:
+                print(f"Background secret refresh failed, retrying in {retry_delay:.0f}s: {e}")
+                if self._stopping.wait(retry_delay):
+                    return
+                retry_delay = min(retry_delay * 2, max(self.refresh_margin, self.min_refresh_interval))
+
+    def stats(self):
+        with self._stats_lock:
+            counters = dict(self._counters)
+            counters["age_seconds"] = round(time.time() - self._fetched_at, 1) if self._values is not None else None
+            counters["last_error"] = self._last_error
+        counters["ttl_seconds"] = self.ttl
+        return counters
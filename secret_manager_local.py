@@ -0,0 +1,82 @@
+"""
+secret_manager_local.py
+
+Local stand-in for secret_manager.py, for development machines and tests that have
+no OCI Vault or Instance Principals.
+
+FakeVault answers ``get_secret_bundle`` in the same shape as oci.secrets.SecretsClient,
+from an in-memory mapping of OCID to value. SecretManager here is the regular cached
+SecretManager backed by a FakeVault, so caching, background refresh and forced
+re-fetches behave exactly as in production. Secrets can be rotated with
+``FakeVault.put`` to exercise the refresh paths.
+
+Classes:
+    FakeVault: In-memory replacement for SecretsClient.
+    SecretManager: secret_manager.SecretManager backed by a FakeVault.
+
+Configuration:
+    Locally, `config.json` holds the plain values instead of OCIDs, e.g.
+    "smtp_username": "user@example.com", "smtp_password": "app-password".
+"""
+import base64
+import json
+import threading
+import time
+import types
+
+import oci
+
+import secret_manager
+
+
+class FakeVault(object):
+    """
+    Thread-safe in-memory secret store with the SecretsClient.get_secret_bundle interface.
+    """
+    def __init__(self, secrets=None, latency=0.0):
+        """
+        Args:
+            secrets (dict): OCID -> secret value
+            latency (float): Seconds added to every get_secret_bundle call
+        """
+        self.latency = latency
+        self.calls = 0
+        self._secrets = dict(secrets or {})
+        self._lock = threading.Lock()
+
+    def put(self, secret_ocid, value):
+        """Create or rotate a secret."""
+        with self._lock:
+            self._secrets[secret_ocid] = value
+
+    def get_secret_bundle(self, secret_id, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.calls += 1
+            value = self._secrets.get(secret_id)
+        if value is None:
+            raise oci.exceptions.ServiceError(404, "NotAuthorizedOrNotFound", {}, f"Secret {secret_id} not found")
+        content = types.SimpleNamespace(content_type="BASE64",
+                                        content=base64.b64encode(value.encode()).decode('ascii'))
+        return types.SimpleNamespace(data=types.SimpleNamespace(secret_bundle_content=content))
+
+
+class SecretManager(secret_manager.SecretManager):
+    """
+    SecretManager whose vault is a FakeVault seeded from config.json, where each
+    secret "OCID" is the secret's plain value.
+    """
+    def __init__(self, config_path='config.json', vault=None):
+        """
+        Args:
+            config_path (str): JSON config with the (local) secret values
+            vault (FakeVault): Vault to use instead of one seeded from the config
+        """
+        if vault is None:
+            with open(config_path) as config_file:
+                config = json.load(config_file)
+            vault = FakeVault({config[key]: config[key] for key in secret_manager.SECRET_KEYS.values()
+                               if config.get(key)})
+        self.vault = vault
+        super().__init__(config_path, secrets_client=vault)
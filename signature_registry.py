@@ -0,0 +1,155 @@
+"""
+signature_registry.py
+
+This module keeps the signatories that sign generated letters: their name, title,
+designation and signature image. Signatories are defined in ``signatories.json``:
+
+    {
+        "default": "hardik.seth",
+        "signatories": {
+            "hardik.seth": {"name": "Hardik Seth", "title": "Senior Manager",
+                            "designation": "", "image": "sign.jpg"}
+        }
+    }
+
+Image paths are relative to the definitions file. Every image is read and encoded
+once into the data URI the letter template embeds, so building a letter is a dict
+lookup instead of a file read and a base64 encode. The definitions file and the
+images are reloaded when their modification time changes; if a changed definitions
+file cannot be loaded, the previous signatories keep being served.
+
+Classes:
+    SignatureRegistry: Loads, caches and hot-reloads signatories by key.
+    SignatureError: Raised for an unknown signatory or an unusable definitions file.
+
+Configuration (config.json, optional):
+    signatories_path  Signatory definitions file (default: signatories.json)
+"""
+import base64
+import json
+import mimetypes
+import os
+import threading
+import time
+
+
+class SignatureError(Exception):
+    """Raised when the signatories cannot be loaded or a signatory is unknown."""
+
+
+class SignatureRegistry(object):
+    """
+    Signatories keyed by name, with their signature images pre-encoded as data URIs.
+    """
+    def __init__(self, path="signatories.json", check_interval=1.0):
+        """
+        Args:
+            path (str): Signatory definitions file
+            check_interval (float): Minimum seconds between mtime checks of the files
+        """
+        self.path = path
+        self.check_interval = check_interval
+        self._definitions = None
+        self._mtime = None
+        self._images = {}
+        self._signatories = {}
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        """Build a registry from the optional signatories_path key in config.json."""
+        return cls(config.get("signatories_path", "signatories.json"))
+
+    def _load_definitions(self, mtime):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as file:
+                definitions = json.load(file)
+        except (OSError, ValueError) as e:
+            raise SignatureError(f"Signatories file '{self.path}' could not be read: {e}")
+
+        signatories = definitions.get("signatories") if isinstance(definitions, dict) else None
+        if not isinstance(signatories, dict) or not signatories:
+            raise SignatureError(f"Signatories file '{self.path}' defines no signatories")
+        if definitions.get("default") not in signatories:
+            raise SignatureError(f"Default signatory '{definitions.get('default')}' is not defined in '{self.path}'")
+
+        self._definitions = definitions
+        self._mtime = mtime
+        print(f"Signatories loaded: {self.path} ({len(signatories)} signatories)")
+
+    def _image_uri(self, image):
+        """Return the data URI of a signature image, re-encoding it only when the file changed."""
+        if not image:
+            return ""
+        path = os.path.join(os.path.dirname(os.path.abspath(self.path)), image)
+        cached = self._images.get(path)
+        try:
+            mtime = os.stat(path).st_mtime
+            if cached is not None and cached[0] == mtime:
+                return cached[1]
+            with open(path, 'rb') as image_file:
+                data = image_file.read()
+        except OSError as e:
+            if cached is None or cached[0] is not None:
+                print(f"Warning: signature image '{path}' could not be read: {e}")
+            self._images[path] = (None, "")
+            return ""
+        mime_type = mimetypes.guess_type(path)[0] or "image/jpeg"
+        uri = f"data:{mime_type};base64,{base64.b64encode(data).decode('ascii')}"
+        self._images[path] = (mtime, uri)
+        return uri
+
+    def _refresh(self):
+        now = time.monotonic()
+        if self._definitions is not None and now - self._checked_at < self.check_interval:
+            return
+
+        with self._lock:
+            if self._definitions is not None and now - self._checked_at < self.check_interval:
+                return
+            try:
+                mtime = os.stat(self.path).st_mtime
+            except OSError as e:
+                if self._definitions is None:
+                    raise SignatureError(f"Signatories file '{self.path}' could not be read: {e}")
+                mtime = self._mtime
+            if mtime != self._mtime:
+                try:
+                    self._load_definitions(mtime)
+                except SignatureError as e:
+                    if self._definitions is None:
+                        raise
+                    print(f"Keeping previous signatories: {e}")
+                    self._mtime = mtime
+
+            self._signatories = {
+                key: {
+                    "name": signatory.get("name", ""),
+                    "title": signatory.get("title", ""),
+                    "designation": signatory.get("designation", ""),
+                    "image": self._image_uri(signatory.get("image"))
+                }
+                for key, signatory in self._definitions["signatories"].items()
+            }
+            self._checked_at = now
+
+    def get(self, key=None):
+        """
+        Return a signatory.
+
+        Args:
+            key (str): Signatory key, or None for the default signatory
+
+        Returns:
+            dict: name, title, designation and image (data URI, "" without an image).
+                The dict is shared; callers must not modify it.
+
+        Raises:
+            SignatureError: If the key is unknown or no signatories could be loaded
+        """
+        self._refresh()
+        signatory = self._signatories.get(key or self._definitions["default"])
+        if signatory is None:
+            raise SignatureError(f"Unknown signatory '{key}'")
+        return signatory
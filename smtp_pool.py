@@ -0,0 +1,382 @@
+"""
+smtp_pool.py
+
+This module keeps authenticated SMTP sessions open so that every email does not pay
+for a TCP connect, STARTTLS handshake and LOGIN.
+
+Connections are handed out one caller at a time, checked with NOOP when they have
+been idle for a while, retired after a number of messages or a period of
+inactivity, and transparently re-established when the server drops the session.
+When LOGIN is rejected, an optional callback can supply fresh credentials (e.g. a
+rotated password from the vault) and the login is retried once.
+
+Classes:
+    SMTPConnectionPool: Pool of logged-in smtplib.SMTP sessions.
+    SMTPBatcher: Groups messages from concurrent coroutines into one session per group.
+    DeliveryUnknown: A message's batch failed as a whole, so it may have been sent.
+
+Configuration (config.json, optional):
+    smtp_pool_size                 Maximum concurrent SMTP sessions (default: 4)
+    smtp_max_messages_per_session  Messages sent before a session is recycled (default: 100)
+    smtp_max_idle_seconds          Idle time before a session is closed (default: 60)
+    smtp_starttls                  Upgrade the session with STARTTLS (default: true)
+"""
+import asyncio
+import queue
+import smtplib
+import threading
+import time
+from contextlib import contextmanager
+
+import metrics
+
+
+# Errors that mean the session is gone and the message can be retried on a new one
+_DISCONNECT_ERRORS = (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError)
+
+# Errors that reject one message but leave the session usable for the next
+_REJECTION_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError)
+
+
+class DeliveryUnknown(Exception):
+    """
+    Result of a message whose batch failed as a whole after sending had started,
+    so the message may or may not have been delivered. Retrying it risks a duplicate.
+    """
+    def __init__(self, error):
+        super().__init__(f"Delivery could not be confirmed: {error}")
+        self.error = error
+
+
+class _PooledConnection(object):
+    def __init__(self, smtp):
+        self.smtp = smtp
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.messages_sent = 0
+
+
+class SMTPConnectionPool(object):
+    """
+    Thread-safe pool of authenticated SMTP sessions.
+    """
+    def __init__(self, host, port, username=None, password=None, size=4, starttls=True,
+                 max_messages_per_connection=100, max_idle_seconds=60,
+                 health_check_after_seconds=5, timeout=30, on_auth_failure=None):
+        """
+        Args:
+            host (str): SMTP server host
+            port (int): SMTP server port
+            username (str): LOGIN user, no authentication if empty
+            password (str): LOGIN password
+            size (int): Maximum number of sessions open at once
+            starttls (bool): Run STARTTLS before LOGIN
+            max_messages_per_connection (int): Recycle a session after this many messages
+            max_idle_seconds (float): Close sessions unused for longer than this
+            health_check_after_seconds (float): Send NOOP before reusing a session idle this long
+            timeout (float): Socket timeout for SMTP operations
+            on_auth_failure (callable): Called when LOGIN is rejected; returns fresh
+                (username, password) or None
+        """
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.size = size
+        self.starttls = starttls
+        self.max_messages_per_connection = max_messages_per_connection
+        self.max_idle_seconds = max_idle_seconds
+        self.health_check_after_seconds = health_check_after_seconds
+        self.timeout = timeout
+        self.on_auth_failure = on_auth_failure
+
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._counters = {"connects": 0, "reused": 0, "noop_failures": 0, "reconnects": 0, "messages": 0,
+                          "credential_refreshes": 0}
+
+    @classmethod
+    def from_config(cls, config, host, port, username, password, on_auth_failure=None):
+        """Build a pool from the optional smtp_* keys in config.json."""
+        return cls(
+            host, port, username, password,
+            on_auth_failure=on_auth_failure,
+            size=config.get("smtp_pool_size", 4),
+            starttls=config.get("smtp_starttls", True),
+            max_messages_per_connection=config.get("smtp_max_messages_per_session", 100),
+            max_idle_seconds=config.get("smtp_max_idle_seconds", 60)
+        )
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def _connect(self, reauthenticated=False):
+        smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        username, password = self.username, self.password
+        try:
+            if self.starttls:
+                smtp.starttls()
+            if username:
+                smtp.login(username, password)
+        except smtplib.SMTPAuthenticationError:
+            self._close(smtp)
+            if reauthenticated or self.on_auth_failure is None:
+                raise
+            credentials = self.on_auth_failure()
+            if not credentials or tuple(credentials) == (username, password):
+                raise
+            # The credentials were rotated; log in again with the new ones
+            self._count("credential_refreshes")
+            self.set_credentials(*credentials)
+            return self._connect(reauthenticated=True)
+        except Exception:
+            self._close(smtp)
+            raise
+        self._count("connects")
+        return _PooledConnection(smtp)
+
+    def set_credentials(self, username, password):
+        """Use new LOGIN credentials for sessions opened from now on and close idle ones."""
+        self.username = username
+        self.password = password
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._close(conn.smtp)
+
+    @staticmethod
+    def _close(smtp):
+        try:
+            smtp.quit()
+        except Exception:
+            try:
+                smtp.close()
+            except Exception:
+                pass
+
+    def _is_reusable(self, conn):
+        """Decide whether an idle session can carry another message."""
+        if conn.messages_sent >= self.max_messages_per_connection:
+            return False
+        idle_for = time.monotonic() - conn.last_used
+        if idle_for > self.max_idle_seconds:
+            return False
+        if idle_for > self.health_check_after_seconds:
+            try:
+                if conn.smtp.noop()[0] != 250:
+                    self._count("noop_failures")
+                    return False
+            except (smtplib.SMTPException, OSError):
+                self._count("noop_failures")
+                return False
+        return True
+
+    def _checkout(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                with metrics.stage("smtp_connect"):
+                    return self._connect()
+            if self._is_reusable(conn):
+                self._count("reused")
+                return conn
+            self._close(conn.smtp)
+
+    @contextmanager
+    def connection(self):
+        """
+        Borrow a logged-in session for the duration of the ``with`` block.
+
+        The session goes back to the pool unless the block raised, in which case it
+        is closed because its protocol state is unknown.
+
+        Yields:
+            _PooledConnection: Wrapper whose ``smtp`` attribute is an authenticated session
+        """
+        self._slots.acquire()
+        conn = None
+        try:
+            conn = self._checkout()
+            yield conn
+            conn.last_used = time.monotonic()
+            self._idle.put(conn)
+        except BaseException:
+            if conn is not None:
+                self._close(conn.smtp)
+            raise
+        finally:
+            self._slots.release()
+
+    def send_messages(self, messages):
+        """
+        Send several messages over a single session.
+
+        A message that fails (rejected by the server, or any other error such as an
+        address that cannot be encoded) does not stop the ones after it. Messages
+        interrupted by a dropped session are retried once on a fresh session. If no
+        session can be opened (e.g. LOGIN is refused), only the messages not sent
+        yet fail with that error; the results of the others are kept.
+
+        Args:
+            messages (list): EmailMessage objects, or (message, from_addr, to_addrs) tuples
+                where message is an EmailMessage or already serialized bytes (see
+                mail_assembly.py); a message with several recipients is one transaction
+
+        Returns:
+            list: One entry per message, None if it was sent, otherwise the exception
+        """
+        pending = list(enumerate(m if isinstance(m, tuple) else (m, None, None) for m in messages))
+        results = [None] * len(pending)
+        retried = False
+        while pending:
+            try:
+                with self.connection() as conn:
+                    while pending:
+                        index, (msg, from_addr, to_addrs) = pending[0]
+                        try:
+                            with metrics.stage("smtp_send"):
+                                if isinstance(msg, bytes):
+                                    conn.smtp.sendmail(from_addr, to_addrs, msg)
+                                else:
+                                    conn.smtp.send_message(msg, from_addr=from_addr, to_addrs=to_addrs)
+                            conn.messages_sent += 1
+                            self._count("messages")
+                        except _DISCONNECT_ERRORS:
+                            raise
+                        except _REJECTION_ERRORS as e:
+                            results[index] = e
+                        except Exception as e:
+                            results[index] = e
+                            # The transaction may have stopped halfway; reset it before the next message
+                            try:
+                                conn.smtp.rset()
+                            except (smtplib.SMTPException, OSError) as rset_error:
+                                pending.pop(0)
+                                raise smtplib.SMTPServerDisconnected(f"RSET failed: {rset_error}")
+                        pending.pop(0)
+            except _DISCONNECT_ERRORS as e:
+                if retried:
+                    for index, _ in pending:
+                        results[index] = e
+                    break
+                retried = True
+                self._count("reconnects")
+            except Exception as e:
+                # No usable session (e.g. LOGIN refused on reconnect); only the unsent messages fail
+                for index, _ in pending:
+                    results[index] = e
+                break
+        return results
+
+    def send_message(self, msg, from_addr=None, to_addrs=None):
+        """Send one message, reusing a pooled session. Raises if it was not sent."""
+        error = self.send_messages([(msg, from_addr, to_addrs)])[0]
+        if error is not None:
+            raise error
+
+    def close_all(self):
+        """Close every idle session."""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._close(conn.smtp)
+
+    def stats(self):
+        """
+        Returns:
+            dict: Session counters plus the number of idle sessions
+        """
+        with self._lock:
+            counters = dict(self._counters)
+        counters["idle"] = self._idle.qsize()
+        return counters
+
+
+class SMTPBatcher(object):
+    """
+    Groups messages coming from many concurrent coroutines so that each group is
+    sent over one pooled session with a single send_messages call.
+    """
+    def __init__(self, pool, run_blocking, max_batch=20, linger_seconds=0.05, senders=None):
+        """
+        Args:
+            pool (SMTPConnectionPool): Pool the groups are sent through
+            run_blocking: Coroutine function ``run_blocking(fn, *args)`` that runs a blocking
+                call off the event loop (e.g. a stage executor)
+            max_batch (int): Most messages sent over one session in one go
+            linger_seconds (float): How long a sender waits for more messages before sending
+            senders (int): Groups in flight at once, defaults to the pool size
+        """
+        self.pool = pool
+        self.max_batch = max_batch
+        self.linger_seconds = linger_seconds
+        self._run_blocking = run_blocking
+        self._queue = asyncio.Queue()
+        self._senders = [asyncio.ensure_future(self._sender()) for _ in range(senders or pool.size)]
+
+    async def send(self, messages):
+        """
+        Queue messages and wait until they have been sent.
+
+        Returns:
+            list: One entry per message, None if it was sent, otherwise the exception;
+                DeliveryUnknown when the message may have been sent
+        """
+        loop = asyncio.get_running_loop()
+        futures = []
+        for msg in messages:
+            future = loop.create_future()
+            self._queue.put_nowait((msg, future))
+            futures.append(future)
+        return await asyncio.gather(*futures)
+
+    async def _sender(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            linger_until = loop.time() + self.linger_seconds
+            while len(batch) < self.max_batch:
+                remaining = linger_until - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            started = []
+
+            def send(messages):
+                started.append(True)
+                return self.pool.send_messages(messages)
+
+            try:
+                results = await self._run_blocking(send, [msg for msg, _ in batch])
+            except Exception as e:
+                # Before send_messages started (e.g. the stage was saturated) nothing went out;
+                # after, some messages may have been delivered and must not be sent again blindly
+                results = [DeliveryUnknown(e) if started else e] * len(batch)
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+    async def close(self):
+        """Send whatever is still queued and stop the sender tasks."""
+        for _ in self._senders:
+            self._queue.put_nowait(None)
+        await asyncio.gather(*self._senders)
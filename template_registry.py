@@ -0,0 +1,178 @@
+"""
+template_registry.py
+
+This module loads the HTML templates (``template.txt``, ``email_template.txt``) once,
+compiles them into a list of literal segments and placeholder slots, and renders
+them by filling the slots and joining the segments. No file access or format-string
+parsing happens on the request path.
+
+Templates use ``str.format`` syntax (``{name}`` placeholders, ``{{``/``}}`` for literal
+braces), so existing template files work unchanged. A template is reloaded when its
+file's modification time changes.
+
+Classes:
+    CompiledTemplate: A parsed template that renders by joining segments.
+    TemplateRegistry: Loads, validates, caches and hot-reloads templates by path.
+    TemplateError: Raised when a template cannot be loaded or fails validation.
+"""
+import os
+import threading
+import time
+from string import Formatter
+
+
+class TemplateError(Exception):
+    """Raised when a template file is missing, malformed or has unexpected placeholders."""
+
+
+class CompiledTemplate(object):
+    """
+    A template split into literal text and named slots.
+    """
+    def __init__(self, source, path=None, mtime=None):
+        """
+        Args:
+            source (str): Template text in str.format syntax
+            path (str): File the template was loaded from
+            mtime (float): Modification time of that file when loaded
+
+        Raises:
+            TemplateError: If the template uses positional, attribute, indexed or
+                formatted placeholders, which the compiled renderer does not support
+        """
+        self.path = path
+        self.mtime = mtime
+        self._parts = []
+        self._slots = []
+
+        try:
+            parsed = list(Formatter().parse(source))
+        except ValueError as e:
+            raise TemplateError(f"Invalid template syntax in {path or 'template'}: {e}")
+
+        literal = []
+        for literal_text, field_name, format_spec, conversion in parsed:
+            literal.append(literal_text)
+            if field_name is None:
+                continue
+            if not field_name.isidentifier() or format_spec or conversion:
+                raise TemplateError(f"Unsupported placeholder '{{{field_name}}}' in {path or 'template'}")
+            self._parts.append(''.join(literal))
+            literal = []
+            self._slots.append((len(self._parts), field_name))
+            self._parts.append(None)
+        self._parts.append(''.join(literal))
+        self.fields = frozenset(name for _, name in self._slots)
+
+    def render(self, values):
+        """
+        Fill every slot from ``values`` and join the segments.
+
+        Args:
+            values (dict): Placeholder name -> value
+
+        Returns:
+            str: Rendered text
+
+        Raises:
+            KeyError: If a placeholder has no value, as str.format would
+        """
+        parts = self._parts[:]
+        for index, name in self._slots:
+            value = values[name]
+            parts[index] = value if isinstance(value, str) else str(value)
+        return ''.join(parts)
+
+
+class TemplateRegistry(object):
+    """
+    Cache of compiled templates keyed by file path.
+    """
+    def __init__(self, check_interval=1.0):
+        """
+        Args:
+            check_interval (float): Minimum seconds between mtime checks of a template file
+        """
+        self.check_interval = check_interval
+        self._templates = {}
+        self._expected_fields = {}
+        self._checked_at = {}
+        self._lock = threading.Lock()
+
+    def register(self, path, fields=None):
+        """
+        Load and compile a template, optionally checking its placeholders.
+
+        Args:
+            path (str): Template file path
+            fields (iterable): Exact set of placeholder names the caller supplies.
+                Loading fails if the template uses a name outside this set or
+                leaves one of them unused.
+
+        Returns:
+            CompiledTemplate: The compiled template
+
+        Raises:
+            TemplateError: If the file is missing or fails validation
+        """
+        if fields is not None:
+            self._expected_fields[path] = frozenset(fields)
+        with self._lock:
+            return self._load(path)
+
+    def _load(self, path):
+        try:
+            mtime = os.stat(path).st_mtime
+            with open(path, 'r', encoding='utf-8') as file:
+                source = file.read()
+        except OSError as e:
+            raise TemplateError(f"Template file '{path}' could not be read: {e}")
+
+        template = CompiledTemplate(source, path, mtime)
+        expected = self._expected_fields.get(path)
+        if expected is not None:
+            missing = expected - template.fields
+            unknown = template.fields - expected
+            if unknown or missing:
+                raise TemplateError(
+                    f"Template '{path}' placeholders do not match: "
+                    f"unknown={sorted(unknown)} unused={sorted(missing)}"
+                )
+
+        self._templates[path] = template
+        self._checked_at[path] = time.monotonic()
+        print(f"Template compiled: {path} ({len(template.fields)} placeholders)")
+        return template
+
+    def get(self, path):
+        """
+        Return the compiled template for ``path``, loading it on first use and
+        reloading it when the file has changed on disk.
+
+        If a changed file fails to load, the previously compiled version keeps
+        being served.
+        """
+        template = self._templates.get(path)
+        now = time.monotonic()
+        if template is not None and now - self._checked_at.get(path, 0) < self.check_interval:
+            return template
+
+        with self._lock:
+            template = self._templates.get(path)
+            if template is None:
+                return self._load(path)
+            self._checked_at[path] = now
+            try:
+                mtime = os.stat(path).st_mtime
+            except OSError:
+                return template
+            if mtime != template.mtime:
+                try:
+                    return self._load(path)
+                except TemplateError as e:
+                    print(f"Keeping previous version of template '{path}': {e}")
+            return template
+
+    def render(self, path, values):
+        """Render the template at ``path`` with ``values``."""
+        return self.get(path).render(values)
@@ -0,0 +1,187 @@
+"""
+upload_manager.py
+
+This module uploads documents to OCI Object Storage. Small documents go up in a
+single ``put_object``; documents above a size threshold use OCI multipart upload,
+sending their parts concurrently and retrying only the parts that failed.
+
+Every request carries the base64 MD5 of its body as ``Content-MD5``, so Object
+Storage rejects corrupted parts, and the MD5 echoed back in ``opc-content-md5`` is
+checked as well. A multipart upload that cannot be completed is aborted so no
+orphaned parts are left in the bucket.
+
+The manager only uses the ``put_object`` / ``create_multipart_upload`` /
+``upload_part`` / ``commit_multipart_upload`` / ``abort_multipart_upload`` calls
+of the client, so any object with those methods (for example the stand-in in
+``benchmarks/fake_object_storage.py``) can take the place of ObjectStorageClient.
+
+Classes:
+    UploadError: An upload failed after all retries.
+    UploadManager: Single-shot or multipart parallel uploader.
+
+Configuration (config.json, optional):
+    oci_multipart_threshold_mb  Documents at least this large use multipart upload (default: 16)
+    oci_multipart_part_size_mb  Part size; OCI requires at least 10 MiB except for the last part (default: 10)
+    oci_upload_parallelism      Parts uploaded concurrently per document (default: 4)
+    oci_upload_part_attempts    Attempts per part (or single upload) before giving up (default: 3)
+"""
+import base64
+import hashlib
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from oci.object_storage.models import (CommitMultipartUploadDetails, CommitMultipartUploadPartDetails,
+                                       CreateMultipartUploadDetails)
+
+import metrics
+
+
+class UploadError(Exception):
+    """Raised when an upload (or one of its parts) still fails after all attempts."""
+
+
+def content_md5(data):
+    """Base64-encoded MD5 digest, the format of the Content-MD5 header."""
+    return base64.b64encode(hashlib.md5(data).digest()).decode('ascii')
+
+
+class UploadManager(object):
+    """
+    Uploads byte buffers to one bucket, switching to parallel multipart upload for large ones.
+    """
+    def __init__(self, client, namespace, bucket, multipart_threshold=16 * 1024 * 1024,
+                 part_size=10 * 1024 * 1024, parallelism=4, part_attempts=3, retry_delay=0.5):
+        """
+        Args:
+            client: ObjectStorageClient (or a stand-in with the same methods)
+            namespace (str): Object Storage namespace
+            bucket (str): Bucket name
+            multipart_threshold (int): Documents at least this large use multipart upload
+            part_size (int): Size of each part but the last
+            parallelism (int): Parts uploaded concurrently per document
+            part_attempts (int): Attempts per part before the upload fails
+            retry_delay (float): First retry delay in seconds, doubled on each attempt
+        """
+        self.client = client
+        self.namespace = namespace
+        self.bucket = bucket
+        self.multipart_threshold = multipart_threshold
+        self.part_size = part_size
+        self.parallelism = parallelism
+        self.part_attempts = part_attempts
+        self.retry_delay = retry_delay
+
+    @classmethod
+    def from_config(cls, config, client, namespace, bucket):
+        """Build a manager from the optional oci_multipart_* / oci_upload_* keys in config.json."""
+        return cls(
+            client, namespace, bucket,
+            multipart_threshold=int(config.get("oci_multipart_threshold_mb", 16) * 1024 * 1024),
+            part_size=int(config.get("oci_multipart_part_size_mb", 10) * 1024 * 1024),
+            parallelism=config.get("oci_upload_parallelism", 4),
+            part_attempts=config.get("oci_upload_part_attempts", 3)
+        )
+
+    def _with_retries(self, description, call):
+        """Run ``call`` up to part_attempts times with exponential backoff."""
+        for attempt in range(1, self.part_attempts + 1):
+            try:
+                return call()
+            except Exception as e:
+                if attempt == self.part_attempts:
+                    raise UploadError(f"{description} failed after {attempt} attempts: {e}")
+                print(f"{description} failed (attempt {attempt}/{self.part_attempts}), retrying: {str(e)}")
+                time.sleep(self.retry_delay * (2 ** (attempt - 1)))
+
+    @staticmethod
+    def _check_md5(description, response, expected):
+        echoed = response.headers.get('opc-content-md5')
+        if echoed and echoed != expected:
+            raise UploadError(f"{description}: MD5 mismatch (sent {expected}, stored {echoed})")
+
+    def upload(self, object_name, data, content_type='application/pdf'):
+        """
+        Upload ``data`` as ``object_name``.
+
+        Returns:
+            dict: etag, last_modified, size, md5 (single upload) and parts (1 for a single upload)
+
+        Raises:
+            UploadError: If the upload still fails after retrying
+        """
+        with metrics.stage("oci_put"):
+            if len(data) >= self.multipart_threshold:
+                return self._upload_multipart(object_name, data, content_type)
+            return self._upload_single(object_name, data, content_type)
+
+    def _upload_single(self, object_name, data, content_type):
+        md5 = content_md5(data)
+
+        def put():
+            response = self.client.put_object(
+                namespace_name=self.namespace,
+                bucket_name=self.bucket,
+                object_name=object_name,
+                put_object_body=data,
+                content_type=content_type,
+                content_md5=md5
+            )
+            self._check_md5(f"Upload of {object_name}", response, md5)
+            return response
+
+        response = self._with_retries(f"Upload of {object_name}", put)
+        return {"etag": response.headers.get('etag'), "last_modified": response.headers.get('last-modified'),
+                "size": len(data), "md5": md5, "parts": 1}
+
+    def _upload_part(self, object_name, upload_id, part_num, part):
+        """
+        Upload one part, given as a memoryview slice of the document.
+
+        The SDK takes a bytes body, so the part is copied here, when a worker thread
+        starts on it, rather than when it is queued.
+        """
+        md5 = content_md5(part)
+        description = f"Part {part_num} of {object_name}"
+        body = bytes(part)
+
+        def put():
+            response = self.client.upload_part(
+                self.namespace, self.bucket, object_name, upload_id, part_num, body, content_md5=md5
+            )
+            self._check_md5(description, response, md5)
+            return response.headers.get('etag')
+
+        return part_num, self._with_retries(description, put)
+
+    def _upload_multipart(self, object_name, data, content_type):
+        upload = self.client.create_multipart_upload(
+            self.namespace, self.bucket,
+            CreateMultipartUploadDetails(object=object_name, content_type=content_type)
+        ).data
+        # Parts are memoryview slices of the document; _upload_part copies one only
+        # when a thread picks it up, so at most `parallelism` part copies exist at once
+        view = memoryview(data)
+        parts = [(number, view[offset:offset + self.part_size])
+                 for number, offset in enumerate(range(0, len(data), self.part_size), start=1)]
+        try:
+            with ThreadPoolExecutor(max_workers=min(self.parallelism, len(parts)),
+                                    thread_name_prefix="oci-upload") as executor:
+                futures = [executor.submit(self._upload_part, object_name, upload.upload_id, number, part)
+                           for number, part in parts]
+                etags = dict(future.result() for future in futures)
+
+            response = self.client.commit_multipart_upload(
+                self.namespace, self.bucket, object_name, upload.upload_id,
+                CommitMultipartUploadDetails(parts_to_commit=[
+                    CommitMultipartUploadPartDetails(part_num=number, etag=etags[number])
+                    for number in sorted(etags)
+                ])
+            )
+        except BaseException:
+            try:
+                self.client.abort_multipart_upload(self.namespace, self.bucket, object_name, upload.upload_id)
+            except Exception as e:
+                print(f"Error aborting multipart upload of {object_name}: {str(e)}")
+            raise
+        return {"etag": response.headers.get('etag'), "last_modified": response.headers.get('last-modified'),
+                "size": len(data), "md5": response.headers.get('opc-multipart-md5'), "parts": len(parts)}